@@ -8,8 +8,10 @@ export function showIdName(dir: number): string {
     return state.idMap.get(dir)?.name ?? "";
 }
 
-export function getIdImageSrc(file: number): string {
-    return baseAdjust("/static/assets/" + state.idMap.get(file)!.file_hash);
+// With a size the server sends the smallest downscaled variant of the image that is at least that large
+export function getIdImageSrc(file: number, size?: number): string {
+    const src = baseAdjust("/static/assets/" + state.idMap.get(file)!.file_hash);
+    return size === undefined ? src : `${src}?size=${size}`;
 }
 
 export function changeDirectory(folder: number): void {
@@ -8,6 +8,7 @@ import { wrapSocket } from "../../helpers";
 import { socket } from "../../socket";
 
 export const sendShapeAdd = wrapSocket<{ shape: ServerShape; temporary: boolean }>("Shape.Add");
+export const sendShapesAdd = wrapSocket<{ shapes: ServerShape[]; temporary: boolean }>("Shapes.Add");
 export const sendRemoveShapes = wrapSocket<{ uuids: string[]; temporary: boolean }>("Shapes.Remove");
 export const sendShapeOrder = wrapSocket<{ uuid: string; index: number; temporary: boolean }>("Shape.Order.Set");
 export const sendFloorChange = wrapSocket<{ uuids: string[]; floor: string }>("Shapes.Floor.Change");
@@ -20,6 +20,7 @@ export interface ILayer {
     get width(): number;
 
     addShape(shape: IShape, sync: SyncMode, invalidate: InvalidationMode): void;
+    addShapes(shapes: readonly IShape[], sync: SyncMode, invalidate: InvalidationMode): void;
     clear(): void;
     draw(doClear?: boolean): void;
     getShapes(options: { skipUiHelpers?: boolean; includeComposites: boolean }): readonly IShape[];
@@ -7,7 +7,7 @@ import { activeShapeStore } from "../../../store/activeShape";
 import { clientStore } from "../../../store/client";
 import { gameStore } from "../../../store/game";
 import { settingsStore } from "../../../store/settings";
-import { sendRemoveShapes, sendShapeAdd, sendShapeOrder } from "../../api/emits/shape/core";
+import { sendRemoveShapes, sendShapeAdd, sendShapeOrder, sendShapesAdd } from "../../api/emits/shape/core";
 import { removeGroupMember } from "../../groups";
 import { dropId, getGlobalId } from "../../id";
 import type { LocalId } from "../../id";
@@ -140,6 +140,24 @@ export class Layer implements ILayer {
         shape.onLayerAdd();
     }
 
+    /**
+     * Adds multiple shapes at once, they are synced to the server with a single event and undone as a single operation
+     */
+    addShapes(shapes: readonly IShape[], sync: SyncMode, invalidate: InvalidationMode): void {
+        for (const shape of shapes) this.addShape(shape, SyncMode.NO_SYNC, InvalidationMode.NO);
+
+        if (sync !== SyncMode.NO_SYNC) {
+            const serverShapes = shapes.filter((s) => !s.preventSync).map((s) => s.asDict());
+            if (serverShapes.length > 0) {
+                sendShapesAdd({ shapes: serverShapes, temporary: sync === SyncMode.TEMP_SYNC });
+            }
+        }
+        if (sync === SyncMode.FULL_SYNC && shapes.length > 0) {
+            addOperation({ type: "shapeadd", shapes: shapes.map((s) => s.asDict()) });
+        }
+        if (invalidate) this.invalidate(invalidate !== InvalidationMode.WITH_LIGHT);
+    }
+
     // UI helpers are objects that are created for UI reaons but that are not pertinent to the actual state
     // They are often not desired unless in specific circumstances
     getShapes(options: { skipUiHelpers?: boolean; includeComposites: boolean }): readonly IShape[] {
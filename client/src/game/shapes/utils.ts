@@ -129,12 +129,14 @@ export function pasteShapes(targetLayer?: LayerName): readonly IShape[] {
     }
 
     // Finalize
+    const shapes: IShape[] = [];
     for (const serverShape of serverShapes) {
         const shape = createShapeFromDict(serverShape);
-        if (shape === undefined) continue;
-
-        layer.addShape(shape, SyncMode.FULL_SYNC, InvalidationMode.WITH_LIGHT);
-
+        if (shape !== undefined) shapes.push(shape);
+    }
+    // A paste can contain hundreds of shapes, they are sent to the server in one go
+    layer.addShapes(shapes, SyncMode.FULL_SYNC, InvalidationMode.WITH_LIGHT);
+    for (const shape of shapes) {
         if (!(shape.options.skipDraw ?? false)) selectionState.push(shape);
     }
 
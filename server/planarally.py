@@ -1,3 +1,9 @@
-from src import planarserver
+import multiprocessing
 
-planarserver.main()
+# Worker processes import this module as well, they must not start a server
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    from src import planarserver
+
+    planarserver.main()
@@ -0,0 +1,26 @@
+from aiohttp import web
+
+from ....metrics import event_metrics
+from ....state.position import position_buffer
+from ....watchdog import loop_watchdog
+
+
+async def get_events(_request: web.Request) -> web.Response:
+    return web.Response(
+        body=event_metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def get_loop(_request: web.Request) -> web.Response:
+    return web.Response(
+        body=loop_watchdog.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def get_positions(_request: web.Request) -> web.Response:
+    return web.Response(
+        body=position_buffer.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
@@ -0,0 +1,114 @@
+import asyncio
+from pathlib import Path
+from typing import Optional, Tuple
+
+from aiohttp import hdrs, web
+
+from ...assets import (
+    VARIANT_CONTENT_TYPE,
+    find_variant,
+    get_content_type,
+    get_encoded_path,
+)
+
+ETAG_KEY = "asset_etag"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+ASSET_HEADERS = {
+    hdrs.VARY: hdrs.ACCEPT_ENCODING,
+    # Svg files can contain scripts, these must not run when an asset is opened directly
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+}
+
+
+def resolve_asset(
+    file_hash: str, accept_encoding: str, size: Optional[int]
+) -> Tuple[str, Path, str, Optional[int]]:
+    """Returns the content type, path, encoding and variant size of the file to send for an asset request."""
+    if size is not None:
+        variant = find_variant(file_hash, size)
+        if variant is not None:
+            return VARIANT_CONTENT_TYPE, variant[0], "identity", variant[1]
+    content_type = get_content_type(file_hash)
+    path, encoding = get_encoded_path(file_hash, accept_encoding)
+    return content_type, path, encoding, None
+
+
+def is_not_modified(request: web.Request, etag: str) -> bool:
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+    if if_none_match is None:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return bool(tags & {"*", etag, f"W/{etag}"})
+
+
+async def get_asset(request: web.Request) -> web.StreamResponse:
+    """
+    Serves an asset file by its hash.
+
+    With a `size` query parameter the smallest downscaled variant of an image that is at least that large is served instead,
+    the full image is served when there is no such variant.
+    """
+    file_hash = request.match_info["file_hash"]
+
+    size: Optional[int] = None
+    if "size" in request.query:
+        try:
+            size = int(request.query["size"])
+        except ValueError:
+            raise web.HTTPBadRequest()
+    else:
+        # The hash identifies the content, a client that knows the tag has the file
+        etag = f'"{file_hash}"'
+        if is_not_modified(request, etag):
+            request[ETAG_KEY] = etag
+            return web.Response(
+                status=304,
+                headers={
+                    **ASSET_HEADERS,
+                    hdrs.CACHE_CONTROL: IMMUTABLE,
+                    hdrs.ETAG: etag,
+                },
+            )
+
+    loop = asyncio.get_running_loop()
+    try:
+        content_type, path, encoding, variant_size = await loop.run_in_executor(
+            None,
+            resolve_asset,
+            file_hash,
+            request.headers.get(hdrs.ACCEPT_ENCODING, ""),
+            size,
+        )
+    except FileNotFoundError:
+        raise web.HTTPNotFound()
+
+    if variant_size is None:
+        etag = f'"{file_hash}"'
+    else:
+        etag = f'"{file_hash}-{variant_size}"'
+    request[ETAG_KEY] = etag
+    headers = {
+        **ASSET_HEADERS,
+        # The variant for a size can still be in the making, until then the full image has to be revalidated
+        hdrs.CACHE_CONTROL: IMMUTABLE
+        if size is None or variant_size is not None
+        else "no-cache",
+        hdrs.ETAG: etag,
+    }
+    if is_not_modified(request, etag):
+        return web.Response(status=304, headers=headers)
+
+    headers[hdrs.CONTENT_TYPE] = content_type
+    if encoding != "identity":
+        headers[hdrs.CONTENT_ENCODING] = encoding
+    # Range requests and sendfile are handled by the file response
+    return web.FileResponse(path, headers=headers)
+
+
+async def set_asset_etag(request: web.Request, response: web.StreamResponse):
+    """File responses tag files by their modification time, assets are tagged by their hash instead."""
+    etag = request.get(ETAG_KEY)
+    if etag is not None:
+        response.headers[hdrs.ETAG] = etag
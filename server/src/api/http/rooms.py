@@ -1,19 +1,21 @@
 import asyncio
-import io
 from datetime import datetime
-from typing import Dict, List, Optional, cast
-from typing_extensions import TypedDict
+from pathlib import Path
+from typing import List, Optional, cast
+from urllib.parse import quote
 
 from aiohttp import web
 from aiohttp_security import check_authorized
 
 from ...app import sio
 from ...config import config
-from ...export.campaign import export_campaign, import_campaign
+from ...export.campaign import export_campaign, import_campaign, stream_campaign
+from ...export.manifest import Manifest, check_manifest
 from ...models import Location, LocationOptions, PlayerRoom, Room, User
 from ...models.db import db
 from ...models.role import Role
 from ...state.dashboard import dashboard_state
+from ...state.imports import import_spool
 from ..socket.constants import DASHBOARD_NS
 
 
@@ -193,7 +195,31 @@ async def export(request: web.Request):
         if room is None:
             return web.HTTPBadRequest()
 
-        await asyncio.create_task(export_campaign(f"{roomname}-{creator}", [room]))
+        filename = f"{roomname}-{creator}"
+
+        # The manifest of an earlier export can be posted to only export what changed since
+        base: Optional[Manifest] = None
+        if request.can_read_body:
+            try:
+                base = check_manifest(await request.json())
+            except ValueError:
+                return web.HTTPBadRequest()
+
+        # Send the archive while it is being built instead of storing it for a later download
+        if "stream" in request.query:
+            response = web.StreamResponse(
+                headers={
+                    "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}.pac"
+                }
+            )
+            response.content_type = "application/gzip"
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            await stream_campaign(filename, [room], response.write, base=base)
+            await response.write_eof()
+            return response
+
+        await asyncio.create_task(export_campaign(filename, [room], base=base))
 
         return web.HTTPAccepted(
             text=f"Processing started. Check /static/temp/{room.name}-{room.creator.name}.pac soon."
@@ -222,38 +248,33 @@ async def export_all(request: web.Request):
     return web.HTTPUnauthorized()
 
 
-class ImportData(TypedDict):
-    totalLength: int
-    chunks: List[Optional[bytes]]
-
-
-import_mapping: Dict[str, ImportData] = {}
-
-
 async def import_info(request: web.Request):
     if not config.getboolean("General", "enable_export"):
         return web.HTTPForbidden()
 
-    await check_authorized(request)
+    user: User = await check_authorized(request)
 
     name = request.match_info["name"]
 
     data = await request.json()
-    length = data["totalChunks"]
-
     try:
-        length = int(length)
-    except ValueError:
+        length = int(data["totalChunks"])
+        chunk_size = int(
+            data.get(
+                "chunkSize", config.getint("Webserver", "max_upload_size_in_bytes")
+            )
+        )
+        # Differential exports are uploaded together with the exports they are based on
+        group = list(dict.fromkeys(str(member) for member in data.get("group", [name])))
+    except (KeyError, TypeError, ValueError):
+        return web.HTTPBadRequest()
+    if length <= 0 or chunk_size <= 0 or name not in group:
         return web.HTTPBadRequest()
 
-    import_mapping[name] = {
-        "totalLength": length,
-        "chunks": [None for _ in range(length)],
-    }
+    # An upload of the same file with the same chunks continues where it was interrupted
+    pending = import_spool.start(user.id, name, length, chunk_size, group)
 
-    # todo: some timer / or other condition to clear the import_mapping
-
-    return web.HTTPOk()
+    return web.json_response({"received": pending.checksums})
 
 
 async def import_chunk(request: web.Request):
@@ -268,29 +289,32 @@ async def import_chunk(request: web.Request):
     except ValueError:
         return web.HTTPBadRequest()
 
-    print(f"Got chunk {chunk} for {name}")
-
-    if name not in import_mapping:
+    pending = import_spool.get(user.id, name)
+    if pending is None:
         return web.HTTPNotFound()
-    if not (0 <= chunk < import_mapping[name]["totalLength"]):
-        return web.HTTPBadRequest()
 
     data = await request.read()
+    if not pending.accepts(chunk, len(data)):
+        return web.HTTPBadRequest()
 
-    import_mapping[name]["chunks"][chunk] = data
+    loop = asyncio.get_running_loop()
+    checksum = await loop.run_in_executor(None, pending.write, chunk, data)
 
-    chunks = import_mapping[name]["chunks"]
-    if all(chunks):
+    if pending.complete and import_spool.get(user.id, name) is pending:
         print(f"Got all chunks for {name}")
-        await asyncio.create_task(
-            handle_import(user, name, io.BytesIO(b"".join(cast(List[bytes], chunks))))
-        )
-        del import_mapping[name]
+        # The import starts once all files uploaded together are complete
+        paths = import_spool.finish(user.id, name)
+        if paths is not None:
+            await asyncio.create_task(handle_import(user, name, paths))
 
-    return web.HTTPOk()
+    return web.json_response({"checksum": checksum})
 
 
-async def handle_import(user: User, name: str, pac: io.BytesIO):
-    await import_campaign(user, pac)
+async def handle_import(user: User, name: str, pacs: List[Path]):
+    try:
+        await import_campaign(user, pacs)
+    finally:
+        for pac in pacs:
+            pac.unlink(missing_ok=True)
     for sid in dashboard_state.get_sids(id=user.id):
         await sio.emit("Campaign.Import.Done", name, room=sid, namespace=DASHBOARD_NS)
@@ -1,4 +1,4 @@
-import hashlib
+import asyncio
 import io
 import json
 import os
@@ -17,11 +17,13 @@ from aiohttp_security import authorized_userid
 
 from .... import auth
 from ....app import app, sio
+from ....assets import precompress, reuse_asset_file, schedule_variants
 from ....logs import logger
 from ....models import Asset
 from ....models.user import User
 from ....state.asset import asset_state
 from ....state.game import game_state
+from ....state.uploads import UPLOADS_DIR, PendingUpload, asset_uploads
 from ....utils import TEMP_DIR
 from ..constants import ASSET_NS, GAME_NS
 from .common import UploadData
@@ -42,14 +44,12 @@ class AssetExport(TypedDict):
 
 
 async def update_live_game(user: User):
-    for sid, pr in game_state._sid_map.items():
-        if pr.player == user:
-            await sio.emit(
-                "Asset.List.Set",
-                Asset.get_user_structure(user),
-                room=sid,
-                namespace=GAME_NS,
-            )
+    sids = [sid for sid, pr in game_state._sid_map.items() if pr.player == user]
+    if not sids:
+        return
+    structure = Asset.get_user_structure(user)
+    for sid in sids:
+        await sio.emit("Asset.List.Set", structure, room=sid, namespace=GAME_NS)
 
 
 @sio.on("connect", namespace=ASSET_NS)
@@ -68,6 +68,7 @@ async def disconnect(sid):
     if not asset_state.has_sid(sid):
         return
 
+    asset_uploads.discard_sid(sid)
     await asset_state.remove_sid(sid)
 
 
@@ -105,12 +106,12 @@ async def get_folder_by_path(sid: str, folder):
     id_path = []
 
     if folder:
-        for path in folder.split("/"):
-            try:
-                target_folder = target_folder.get_child(path)
-                id_path.append(target_folder.id)
-            except Asset.DoesNotExist:
-                return await get_folder_by_path(sid, "/")
+        try:
+            folders = target_folder.get_descendants_by_path(folder)
+        except Asset.DoesNotExist:
+            return await get_folder_by_path(sid, "/")
+        target_folder = folders[-1]
+        id_path = [f.id for f in folders]
 
     await sio.emit(
         "Folder.Set",
@@ -175,26 +176,10 @@ async def assetmgmt_rm(sid: str, data):
     if asset.owner != user:
         logger.warning(f"{user.name} attempted to remove a file it doesn't own.")
         return
-    asset_dict = asset.as_dict(children=True, recursive=True)
+    # The files of the asset are removed by the asset collector once they have stayed unused for long enough
     asset.delete_instance()
 
     await update_live_game(user)
-    cleanup_assets([asset_dict])
-
-
-def cleanup_assets(assets):
-    for asset in assets:
-        if (
-            asset["file_hash"] is not None
-            and (ASSETS_DIR / asset["file_hash"]).exists()
-        ):
-            if Asset.select().where(Asset.file_hash == asset["file_hash"]).count() == 0:
-                logger.info(
-                    f"No asset maps to file {asset['file_hash']}, removing from server"
-                )
-                (ASSETS_DIR / asset["file_hash"]).unlink()
-        if "children" in asset:
-            cleanup_assets(asset["children"])
 
 
 def get_safe_members(members: List[tarfile.TarInfo]) -> List[tarfile.TarInfo]:
@@ -211,9 +196,10 @@ def get_safe_members(members: List[tarfile.TarInfo]) -> List[tarfile.TarInfo]:
     return safe_members
 
 
-async def handle_paa_file(upload_data: UploadData, data: bytes, sid: str):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        with tarfile.open(fileobj=io.BytesIO(data), mode="r:bz2") as tar:
+def extract_paa_file(path: Path) -> List[AssetDict]:
+    # Extracting next to the assets allows the files to be moved in place instead of copied
+    with tempfile.TemporaryDirectory(dir=UPLOADS_DIR) as tmpdir:
+        with tarfile.open(path, mode="r:bz2") as tar:
             files = tarfile.TarInfo("files")
             files.type = tarfile.DIRTYPE
             # We need to explicitly list our members for security reasons
@@ -222,11 +208,17 @@ async def handle_paa_file(upload_data: UploadData, data: bytes, sid: str):
 
         tmp_path = Path(tmpdir)
         for asset in os.listdir(tmp_path / "files"):
-            if not (ASSETS_DIR / asset).exists():
+            if not reuse_asset_file(asset):
                 shutil.move(str(tmp_path / "files" / asset), str(ASSETS_DIR / asset))
+                precompress(asset)
 
         with open(tmp_path / "data") as json_data:
-            raw_assets: List[AssetDict] = json.load(json_data)
+            return json.load(json_data)
+
+
+async def handle_paa_file(upload_data: UploadData, path: Path, sid: str):
+    loop = asyncio.get_running_loop()
+    raw_assets = await loop.run_in_executor(None, extract_paa_file, path)
 
     user = asset_state.get_user(sid)
     parent_map: Dict[int, int] = defaultdict(lambda: upload_data["directory"])
@@ -246,13 +238,12 @@ async def handle_paa_file(upload_data: UploadData, data: bytes, sid: str):
     )
 
 
-async def handle_regular_file(upload_data: UploadData, data: bytes, sid: str):
-    sh = hashlib.sha1(data)
-    hashname = sh.hexdigest()
-
-    if not (ASSETS_DIR / hashname).exists():
-        with open(ASSETS_DIR / hashname, "wb") as f:
-            f.write(data)
+async def handle_regular_file(
+    upload_data: UploadData, pending: PendingUpload, sid: str
+):
+    loop = asyncio.get_running_loop()
+    hashname = await loop.run_in_executor(None, pending.store)
+    schedule_variants(hashname)
 
     user = asset_state.get_user(sid)
 
@@ -289,27 +280,31 @@ async def handle_regular_file(upload_data: UploadData, data: bytes, sid: str):
 async def assetmgmt_upload(sid: str, upload_data: UploadData):
     uuid = upload_data["uuid"]
 
-    if uuid not in asset_state.pending_file_upload_cache:
-        asset_state.pending_file_upload_cache[uuid] = {}
-    asset_state.pending_file_upload_cache[uuid][upload_data["slice"]] = upload_data
-    if len(asset_state.pending_file_upload_cache[uuid]) != upload_data["totalSlices"]:
-        # wait for the rest of the slices
+    # Slices are small, appending one to its file is cheaper than handing it to a worker thread
+    try:
+        pending = asset_uploads.get_or_start(sid, uuid, upload_data["totalSlices"])
+        pending.add(upload_data["slice"], upload_data["data"])
+    except ValueError as e:
+        logger.warning(f"Invalid asset upload {upload_data['name']}: {e}")
+        asset_uploads.discard(sid, uuid)
         return
 
-    # All slices are present
-    data = b""
-    for slice_ in range(upload_data["totalSlices"]):
-        data += asset_state.pending_file_upload_cache[uuid][slice_]["data"]
+    if not pending.complete:
+        # wait for the rest of the slices
+        return
 
-    del asset_state.pending_file_upload_cache[upload_data["uuid"]]
+    asset_uploads.finish(sid, uuid)
 
     file_name = upload_data["name"]
-    if file_name.endswith(".paa"):
-        await handle_paa_file(upload_data, data, sid)
-    elif file_name.endswith(".dd2vtt"):
-        await handle_ddraft_file(upload_data, data, sid)
-    else:
-        await handle_regular_file(upload_data, data, sid)
+    try:
+        if file_name.endswith(".paa"):
+            await handle_paa_file(upload_data, pending.path, sid)
+        elif file_name.endswith(".dd2vtt"):
+            await handle_ddraft_file(upload_data, pending.path, sid)
+        else:
+            await handle_regular_file(upload_data, pending, sid)
+    finally:
+        pending.path.unlink(missing_ok=True)
 
     user = asset_state.get_user(sid)
     await update_live_game(user)
@@ -344,9 +339,11 @@ def export_asset(asset: Union[AssetDict, List[AssetDict]], parent=-1) -> AssetEx
 @auth.login_required(app, sio, "asset")
 async def assetmgmt_export(sid: str, selection: List[int]):
 
-    full_selection: List[AssetDict] = [
-        Asset.get_by_id(asset).as_dict(True, True) for asset in selection
-    ]
+    assets = sorted(
+        Asset.select().where(Asset.id.in_(selection)),
+        key=lambda asset: selection.index(asset.id),
+    )
+    full_selection: List[AssetDict] = Asset.as_dicts(assets, recursive=True)
 
     asset_data = export_asset(full_selection)
     json_data = json.dumps(asset_data["data"])
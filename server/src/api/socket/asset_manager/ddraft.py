@@ -1,10 +1,13 @@
+import asyncio
 import base64
 import json
 import hashlib
-from typing import List
+from pathlib import Path
+from typing import List, Tuple
 from typing_extensions import TypedDict
 
 from ....app import sio
+from ....assets import precompress, reuse_asset_file, schedule_variants
 from ....models import Asset
 from ....state.asset import asset_state
 from ..constants import ASSET_NS
@@ -38,17 +41,28 @@ class DDraftData(TypedDict):
     image: str
 
 
-async def handle_ddraft_file(upload_data: UploadData, data: bytes, sid: str):
-    ddraft_file: DDraftData = json.loads(data)
+def store_ddraft_image(path: Path) -> Tuple[DDraftData, str]:
+    with open(path, "rb") as f:
+        ddraft_file: DDraftData = json.load(f)
 
     image = base64.b64decode(ddraft_file["image"])
 
     sh = hashlib.sha1(image)
     hashname = sh.hexdigest()
 
-    if not (ASSETS_DIR / hashname).exists():
+    if not reuse_asset_file(hashname):
         with open(ASSETS_DIR / hashname, "wb") as f:
             f.write(image)
+        precompress(hashname)
+
+    return ddraft_file, hashname
+
+
+async def handle_ddraft_file(upload_data: UploadData, path: Path, sid: str):
+    # The map image is embedded in the json, decoding it is left to a worker thread
+    loop = asyncio.get_running_loop()
+    ddraft_file, hashname = await loop.run_in_executor(None, store_ddraft_image, path)
+    schedule_variants(hashname)
 
     template = {
         "version": "0",
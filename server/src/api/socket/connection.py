@@ -47,7 +47,7 @@ async def connect(sid, environ):
 
     logger.info(f"User {user.name} connected with identifier {sid}")
 
-    sio.enter_room(sid, pr.active_location.get_path(), namespace=GAME_NS)
+    game_state.enter_location(sid, pr.active_location)
 
 
 @sio.on("disconnect", namespace=GAME_NS)
@@ -6,9 +6,10 @@ from ...api.socket.constants import GAME_NS
 from ...app import app, sio
 from ...logs import logger
 from ...models import Floor, PlayerRoom
-from ...models.db import db
+from ...models.db import db, db_executor
 from ...models.role import Role
 from ...state.game import game_state
+from ...state.snapshot import changes_location
 
 # DATA CLASSES FOR TYPE CHECKING
 class FloorRename(TypedDict):
@@ -33,6 +34,7 @@ class FloorBackgroundData(TypedDict):
 
 @sio.on("Floor.Create", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def create_floor(sid: str, data: str):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -58,6 +60,7 @@ async def create_floor(sid: str, data: str):
 
 @sio.on("Floor.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_floor(sid: str, data: str):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -66,7 +69,7 @@ async def remove_floor(sid: str, data: str):
         return
 
     floor: Floor = Floor.get(location=pr.active_location, name=data)
-    floor.delete_instance(recursive=True)
+    await db_executor.write(floor.delete_instance, recursive=True)
 
     await sio.emit(
         "Floor.Remove",
@@ -79,6 +82,7 @@ async def remove_floor(sid: str, data: str):
 
 @sio.on("Floor.Visible.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_floor_visibility(sid: str, data: FloorVisibleData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -101,6 +105,7 @@ async def set_floor_visibility(sid: str, data: FloorVisibleData):
 
 @sio.on("Floor.Rename", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def rename_floor(sid: str, data: FloorRename):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -123,6 +128,7 @@ async def rename_floor(sid: str, data: FloorRename):
 
 @sio.on("Floor.Type.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_floor_type(sid: str, data: FloorTypeData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -145,6 +151,7 @@ async def set_floor_type(sid: str, data: FloorTypeData):
 
 @sio.on("Floor.Background.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_floor_background(sid: str, data: FloorBackgroundData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -167,6 +174,7 @@ async def set_floor_background(sid: str, data: FloorBackgroundData):
 
 @sio.on("Floors.Reorder", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def reorder_floors(sid: str, data: List[str]):
     pr: PlayerRoom = game_state.get(sid)
 
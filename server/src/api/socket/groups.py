@@ -9,6 +9,7 @@ from ...app import app, sio
 from ...logs import logger
 from ...models import Group, PlayerRoom, Shape
 from ...state.game import game_state
+from ...state.snapshot import changes_location, snapshot_cache
 
 
 class ServerGroup(TypedDict):
@@ -61,6 +62,9 @@ async def update_group(sid: str, group_info: ServerGroup):
         update_model_from_dict(group, group_info)
         group.save()
 
+    for location in pr.room.locations:
+        snapshot_cache.bump(location.id)
+
     for psid, _ in game_state.get_users(room=pr.room):
         await sio.emit(
             "Group.Update",
@@ -73,6 +77,7 @@ async def update_group(sid: str, group_info: ServerGroup):
 
 @sio.on("Group.Members.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_group_badges(sid: str, member_badges: List[MemberBadge]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -121,6 +126,7 @@ async def create_group(sid: str, group_info: ServerGroup):
 
 @sio.on("Group.Join", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def join_group(sid: str, group_join: GroupJoin):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -156,6 +162,7 @@ async def join_group(sid: str, group_join: GroupJoin):
 
 @sio.on("Group.Leave", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def leave_group(sid: str, client_shapes: List[LeaveGroup]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -197,6 +204,9 @@ async def remove_group(sid: str, group_id: str):
         shape.show_badge = False
         shape.save()
 
+    for location in pr.room.locations:
+        snapshot_cache.bump(location.id)
+
     # check if group still has members
     await remove_group_if_empty(group_id)
 
@@ -10,12 +10,13 @@ from ...app import app, sio
 from ...logs import logger
 from ...models import (
     Initiative,
+    Layer,
     PlayerRoom,
     Shape,
 )
 from ...models.db import db
 from ...models.role import Role
-from ...models.shape.access import has_ownership
+from ...models.shape.access import filter_ownership, get_owned_shapes
 from ...state.game import game_state
 
 
@@ -105,9 +106,7 @@ async def request_initiatives(sid: str):
 async def update_initiative_option(sid: str, data: ServerInitiativeOption):
     pr: PlayerRoom = game_state.get(sid)
 
-    shape = Shape.get_or_none(uuid=data["shape"])
-
-    if not has_ownership(shape, pr):
+    if not get_owned_shapes([data["shape"]], pr):
         logger.warning(
             f"{pr.player.name} attempted to change initiative of an asset it does not own"
         )
@@ -143,9 +142,14 @@ async def update_initiative_option(sid: str, data: ServerInitiativeOption):
 async def add_initiative(sid: str, data: ServerInitiativeData):
     pr: PlayerRoom = game_state.get(sid)
 
-    shape = Shape.get_or_none(uuid=data)
+    shape = (
+        Shape.select(Shape, Layer)
+        .join(Layer)
+        .where(Shape.uuid == data["shape"])
+        .first()
+    )
 
-    if shape is not None and not has_ownership(shape, pr):
+    if shape is not None and not filter_ownership([shape], pr):
         logger.warning(
             f"{pr.player.name} attempted to add initiative to an asset it does not own"
         )
@@ -175,9 +179,14 @@ async def add_initiative(sid: str, data: ServerInitiativeData):
 async def set_initiative_value(sid: str, data: ServerSetInitiativeValue):
     pr: PlayerRoom = game_state.get(sid)
 
-    shape = Shape.get_or_none(uuid=data)
+    shape = (
+        Shape.select(Shape, Layer)
+        .join(Layer)
+        .where(Shape.uuid == data["shape"])
+        .first()
+    )
 
-    if shape is not None and not has_ownership(shape, pr):
+    if shape is not None and not filter_ownership([shape], pr):
         logger.warning(
             f"{pr.player.name} attempted to remove initiative of an asset it does not own"
         )
@@ -231,9 +240,9 @@ async def clear_initiatives(sid: str):
 async def remove_initiative(sid: str, data: str):
     pr: PlayerRoom = game_state.get(sid)
 
-    shape = Shape.get_or_none(uuid=data)
+    shape = Shape.select(Shape, Layer).join(Layer).where(Shape.uuid == data).first()
 
-    if shape is not None and not has_ownership(shape, pr):
+    if shape is not None and not filter_ownership([shape], pr):
         logger.warning(
             f"{pr.player.name} attempted to remove initiative of an asset it does not own"
         )
@@ -298,8 +307,8 @@ async def update_initiative_turn(sid: str, turn: int):
     location_data: Initiative = Initiative.get(location=pr.active_location)
     json_data = json.loads(location_data.data)
 
-    if pr.role != Role.DM and not has_ownership(
-        Shape.get_or_none(uuid=json_data[location_data.turn]["shape"]), pr
+    if pr.role != Role.DM and not get_owned_shapes(
+        [json_data[location_data.turn]["shape"]], pr
     ):
         logger.warning(f"{pr.player.name} attempted to advance the initiative tracker")
         return
@@ -343,9 +352,7 @@ async def update_initiative_round(sid: str, data: int):
 
     if pr.role != Role.DM:
         json_data = json.loads(location_data.data)
-        if not has_ownership(
-            Shape.get_or_none(uuid=json_data[location_data.turn]["shape"]), pr
-        ):
+        if not get_owned_shapes([json_data[location_data.turn]["shape"]], pr):
             logger.warning(
                 f"{pr.player.name} attempted to advance the initiative tracker"
             )
@@ -396,7 +403,7 @@ async def set_initiative_sort(sid: str, sort: int):
 async def new_initiative_effect(sid: str, data: ServerInitiativeEffectActor):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["actor"]), pr):
+    if not get_owned_shapes([data["actor"]], pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
@@ -425,7 +432,7 @@ async def new_initiative_effect(sid: str, data: ServerInitiativeEffectActor):
 async def rename_initiative_effect(sid: str, data: ServerRenameInitiativeEffect):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not get_owned_shapes([data["shape"]], pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
@@ -454,7 +461,7 @@ async def rename_initiative_effect(sid: str, data: ServerRenameInitiativeEffect)
 async def set_initiative_effect_tuns(sid: str, data: ServerInitiativeEffectTurns):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not get_owned_shapes([data["shape"]], pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
@@ -483,7 +490,7 @@ async def set_initiative_effect_tuns(sid: str, data: ServerInitiativeEffectTurns
 async def remove_initiative_effect(sid: str, data: ServerRemoveInitiativeEffectActor):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not get_owned_shapes([data["shape"]], pr):
         logger.warning(f"{pr.player.name} attempted to remove an initiative effect")
         return
 
@@ -1,12 +1,23 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 from typing_extensions import TypedDict
 
 from ... import auth
 from ...api.socket.constants import GAME_NS
 from ...app import app, sio
 from ...logs import logger
-from ...models import Label, LabelSelection, PlayerRoom, User
+from ...models import (
+    Floor,
+    Label,
+    LabelSelection,
+    Layer,
+    Location,
+    PlayerRoom,
+    Shape,
+    ShapeLabel,
+    User,
+)
 from ...state.game import game_state
+from ...state.snapshot import snapshot_cache
 
 
 class LabelVisibilityMessage(TypedDict):
@@ -14,6 +25,20 @@ class LabelVisibilityMessage(TypedDict):
     visible: bool
 
 
+def get_label_locations(label: Label) -> List[int]:
+    """Returns the locations with shapes that carry the label, these are the cached locations it affects."""
+    return [
+        location_id
+        for (location_id,) in Floor.select(Floor.location)
+        .join(Layer, on=(Layer.floor == Floor.id))
+        .join(Shape, on=(Shape.layer == Layer.id))
+        .join(ShapeLabel, on=(ShapeLabel.shape == Shape.uuid))
+        .where(ShapeLabel.label == label)
+        .distinct()
+        .tuples()
+    ]
+
+
 @sio.on("Label.Add", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
 async def add(sid: str, data: Dict[str, Any]):
@@ -54,7 +79,10 @@ async def delete(sid: str, data: Dict[str, Any]):
         logger.warn(f"{pr.player.name} tried to delete another user's label.")
         return
 
+    locations = get_label_locations(label)
     label.delete_instance(True)
+    for location_id in locations:
+        snapshot_cache.bump(location_id)
 
     await sio.emit(
         "Label.Delete",
@@ -83,26 +111,38 @@ async def set_visibility(sid: str, data: LabelVisibilityMessage):
     label.visible = data["visible"]
     label.save()
 
-    for psid in game_state.get_sids(skip_sid=sid, room=pr.room):
-        if game_state.get_user(psid) == pr.player:
-            await sio.emit(
-                "Label.Visibility.Set",
-                {"user": label.pr.player.name, **data},
-                room=psid,
-                namespace=GAME_NS,
-            )
-        else:
-            if data["visible"]:
-                await sio.emit(
-                    "Label.Add", label.as_dict(), room=psid, namespace=GAME_NS
-                )
-            else:
-                await sio.emit(
-                    "Label.Delete",
-                    {"uuid": label.uuid, "user": label.user.name},
-                    room=psid,
-                    namespace=GAME_NS,
-                )
+    for location_id in get_label_locations(label):
+        snapshot_cache.bump(location_id)
+
+    owner_sids = [*game_state.get_sids(player=pr.player, room=pr.room)]
+    for psid in owner_sids:
+        if psid == sid:
+            continue
+        await sio.emit(
+            "Label.Visibility.Set",
+            {"user": pr.player.name, **data},
+            room=psid,
+            namespace=GAME_NS,
+        )
+
+    if data["visible"]:
+        event, other_data = "Label.Add", label.as_dict()
+    else:
+        event, other_data = "Label.Delete", {"uuid": label.uuid, "user": pr.player.name}
+
+    # All other users in the room receive the same data, so one emit per location suffices
+    location_ids = {
+        game_state.get(psid).active_location_id
+        for psid in game_state.get_sids(room=pr.room)
+    }
+    for location in Location.select().where(Location.id << location_ids):
+        await sio.emit(
+            event,
+            other_data,
+            room=location.get_path(),
+            skip_sid=owner_sids,
+            namespace=GAME_NS,
+        )
 
 
 @sio.on("Labels.Filter.Add", namespace=GAME_NS)
@@ -1,5 +1,6 @@
+import asyncio
 import json
-from typing import List, Union, cast
+from typing import Any, Dict, List, Optional, Set, Tuple, Union, cast
 
 from playhouse.shortcuts import update_model_from_dict
 from typing_extensions import TypedDict
@@ -20,11 +21,16 @@ from ...models import (
     PlayerRoom,
     Room,
     Shape,
+    ShapeOwner,
 )
 from ...models.asset import Asset
+from ...models.db import db_executor
 from ...models.label import Label, LabelSelection
 from ...models.role import Role
+from ...models.shape.prefetch import ShapePrefetch
 from ...state.game import game_state
+from ...state.position import ShapePosition, position_buffer
+from ...state.snapshot import snapshot_cache
 from ...logs import logger
 
 
@@ -74,6 +80,123 @@ class LocationCloneData(TypedDict):
     room: str
 
 
+def get_owned_floors(location: Location, pr: PlayerRoom) -> Set[int]:
+    return {
+        floor_id
+        for (floor_id,) in ShapeOwner.select(Floor.id)
+        .join(Shape)
+        .join(Layer)
+        .join(Floor)
+        .where((Floor.location == location) & (ShapeOwner.user == pr.player))
+        .distinct()
+        .tuples()
+    }
+
+
+def apply_moves(
+    data: Dict[str, Any], moves: Dict[str, ShapePosition]
+) -> Dict[str, Any]:
+    """Returns the serialized floor with the positions of the moved shapes, the cached data itself is left unchanged."""
+    if not moves:
+        return data
+
+    layers = []
+    for layer in data["layers"]:
+        if any(shape["uuid"] in moves for shape in layer["shapes"]):
+            shapes = []
+            for shape in layer["shapes"]:
+                position = moves.get(shape["uuid"])
+                if position is not None:
+                    shape = {**shape}
+                    position.apply(shape)
+                shapes.append(shape)
+            layer = {**layer, "shapes": shapes}
+        layers.append(layer)
+    return {**data, "layers": layers}
+
+
+class SharedLocationData:
+    """
+    The parts of a location load that are the same for every player.
+
+    When multiple players load the same location at once, this is computed only once and shared between them.
+    """
+
+    def __init__(self, location: Location):
+        self.location = location
+        self.location_data = location.as_dict()
+        self.locations = [
+            {"id": l.id, "name": l.name, "archived": l.archived}
+            for l in Location.select()
+            .where(Location.room == location.room_id)
+            .order_by(Location.index)
+        ]
+        self.floors = [floor for floor in location.floors.order_by(Floor.index)]
+        initiative = Initiative.get_or_none(location=location)
+        self.initiative = None if initiative is None else initiative.as_dict()
+        # Concurrent loads of the same floor view wait for a single serialization
+        self._pending: Dict[Tuple[int, str], "asyncio.Task[Dict[str, Any]]"] = {}
+        self._prefetches: Dict[int, "asyncio.Task[ShapePrefetch]"] = {}
+
+    async def get_floor_data(
+        self, floor: Floor, pr: PlayerRoom, owned_floors: Set[int]
+    ):
+        """
+        Returns the serialized floor as seen by the given player.
+
+        Players that do not own any shape on the floor all share the same view,
+        so only the DM view, the generic player view and the views of players with ownership are cached separately.
+        """
+        if pr.role == Role.DM:
+            visibility = "dm"
+        elif floor.id in owned_floors:
+            visibility = f"player-{pr.player.id}"
+        else:
+            visibility = "player"
+
+        key = (floor.id, visibility)
+        data = snapshot_cache.get(self.location.id, key)
+        if data is not None:
+            return apply_moves(data, snapshot_cache.get_moves(self.location.id))
+
+        if key not in self._pending:
+            self._pending[key] = asyncio.create_task(self._load_floor(floor, pr, key))
+        # A player that disconnects halfway should not cancel the load for the others
+        return await asyncio.shield(self._pending[key])
+
+    async def _load_floor(
+        self, floor: Floor, pr: PlayerRoom, key: Tuple[int, str]
+    ) -> Dict[str, Any]:
+        try:
+            version = snapshot_cache.get_version(self.location.id)
+            # The prefetch is shared by all views of the floor
+            if floor.id not in self._prefetches:
+                self._prefetches[floor.id] = asyncio.create_task(
+                    db_executor.read(ShapePrefetch.for_floor, floor)
+                )
+            prefetch = await self._prefetches[floor.id]
+            data, size = await db_executor.read(
+                self._serialize_floor, floor, pr, prefetch
+            )
+            # The location can change while the floor is serialized off the event loop
+            snapshot_cache.set(self.location.id, key, data, size, version)
+            # Shapes can move while the floor is serialized without changing the version
+            return apply_moves(data, snapshot_cache.get_moves(self.location.id))
+        finally:
+            del self._pending[key]
+
+    def _serialize_floor(
+        self, floor: Floor, pr: PlayerRoom, prefetch: ShapePrefetch
+    ) -> Tuple[Dict[str, Any], int]:
+        data = floor.as_dict(
+            pr.player,
+            cast(bool, pr.role == Role.DM),
+            prefetch=prefetch,
+        )
+        # The size bounds the snapshot cache, it is measured here to keep the encoding off the event loop
+        return data, len(json.dumps(data, default=str))
+
+
 @sio.on("Location.Load", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
 async def _load_location(sid: str):
@@ -83,11 +206,21 @@ async def _load_location(sid: str):
 
 
 @auth.login_required(app, sio, "game")
-async def load_location(sid: str, location: Location, *, complete=False):
+async def load_location(
+    sid: str,
+    location: Location,
+    *,
+    complete=False,
+    shared: Optional[SharedLocationData] = None,
+):
     pr: PlayerRoom = game_state.get(sid)
+    if shared is None:
+        shared = SharedLocationData(location)
+
     if pr.active_location != location:
         pr.active_location = location
         pr.save()
+        game_state.update_sid(sid)
 
     # 0. CLEAR
 
@@ -134,7 +267,7 @@ async def load_location(sid: str, location: Location, *, complete=False):
 
     # 3. Load location
 
-    await sio.emit("Location.Set", location.as_dict(), room=sid, namespace=GAME_NS)
+    await sio.emit("Location.Set", shared.location_data, room=sid, namespace=GAME_NS)
 
     # 4. Load all location settings (DM)
 
@@ -151,13 +284,9 @@ async def load_location(sid: str, location: Location, *, complete=False):
 
     # 5. Load Board
 
-    locations = [
-        {"id": l.id, "name": l.name, "archived": l.archived}
-        for l in pr.room.locations.order_by(Location.index)
-    ]
-    await sio.emit("Board.Locations.Set", locations, room=sid, namespace=GAME_NS)
+    await sio.emit("Board.Locations.Set", shared.locations, room=sid, namespace=GAME_NS)
 
-    floors = [floor for floor in location.floors.order_by(Floor.index)]
+    floors = shared.floors
 
     if "active_floor" in client_options["location_user_options"]:
         index = next(
@@ -169,21 +298,20 @@ async def load_location(sid: str, location: Location, *, complete=False):
         higher_floors = floors[index + 1 :] if index < len(floors) else []
         floors = [floors[index], *lower_floors, *higher_floors]
 
+    owned_floors = set() if pr.role == Role.DM else get_owned_floors(location, pr)
+
     for floor in floors:
         await sio.emit(
             "Board.Floor.Set",
-            floor.as_dict(pr.player, cast(bool, pr.role == Role.DM)),
+            await shared.get_floor_data(floor, pr, owned_floors),
             room=sid,
             namespace=GAME_NS,
         )
 
     # 6. Load Initiative
 
-    location_data = Initiative.get_or_none(location=location)
-    if location_data:
-        await sio.emit(
-            "Initiative.Set", location_data.as_dict(), room=sid, namespace=GAME_NS
-        )
+    if shared.initiative:
+        await sio.emit("Initiative.Set", shared.initiative, room=sid, namespace=GAME_NS)
 
     # 7. Load labels
 
@@ -281,6 +409,22 @@ async def change_location(sid: str, data: LocationChangeData):
             await sio.emit("Location.Change.Start", room=psid, namespace=GAME_NS)
 
     new_location = Location.get_by_id(data["location"])
+    shared = SharedLocationData(new_location)
+
+    async def transfer(psid: str):
+        await load_location(psid, new_location, shared=shared)
+        # We could send this to all users in the new location, BUT
+        # loading times might vary and we don't want to snap people back when they already move around
+        # And it's possible that there are already users on the new location that don't want to be moved to this new position
+        if "position" in data:
+            await sio.emit(
+                "Position.Set",
+                data=data["position"],
+                room=psid,
+                namespace=GAME_NS,
+            )
+
+    transfers = []
 
     for room_player in pr.room.players:
         if room_player.player.name not in data["users"]:
@@ -288,27 +432,18 @@ async def change_location(sid: str, data: LocationChangeData):
 
         for psid in game_state.get_sids(player=room_player.player, room=pr.room):
             try:
-                sio.leave_room(
-                    psid, room_player.active_location.get_path(), namespace=GAME_NS
-                )
-                sio.enter_room(psid, new_location.get_path(), namespace=GAME_NS)
+                game_state.leave_location(psid, room_player.active_location)
+                game_state.enter_location(psid, new_location)
             except KeyError:
                 await game_state.remove_sid(psid)
                 continue
-            await load_location(psid, new_location)
-            # We could send this to all users in the new location, BUT
-            # loading times might vary and we don't want to snap people back when they already move around
-            # And it's possible that there are already users on the new location that don't want to be moved to this new position
-            if "position" in data:
-                await sio.emit(
-                    "Position.Set",
-                    data=data["position"],
-                    room=psid,
-                    namespace=GAME_NS,
-                )
+            transfers.append(transfer(psid))
         room_player.active_location = new_location
         room_player.save()
 
+    # The shared data is computed once, sending it to all players can happen concurrently
+    await asyncio.gather(*transfers)
+
 
 @sio.on("Location.Options.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
@@ -394,11 +529,10 @@ async def add_new_location(sid: str, location: str):
     )
     new_location.create_floor()
 
-    for psid in game_state.get_sids(
-        player=pr.player, active_location=pr.active_location
-    ):
-        sio.leave_room(psid, pr.active_location.get_path(), namespace=GAME_NS)
-        sio.enter_room(psid, new_location.get_path(), namespace=GAME_NS)
+    old_location = pr.active_location
+    for psid in game_state.get_sids(player=pr.player, active_location=old_location):
+        game_state.leave_location(psid, old_location)
+        game_state.enter_location(psid, new_location)
         await load_location(psid, new_location)
     pr.active_location = new_location
     pr.save()
@@ -411,6 +545,10 @@ async def clone_location(sid: str, data: LocationCloneData):
     if pr.role != Role.DM:
         logger.warning(f"{pr.player.name} attempted to clone locations.")
         return
+
+    # Copies are made from the database rows, pending moves have to be written first
+    await position_buffer.flush()
+
     try:
         room = Room.select().where(
             (Room.name == data["room"]) & (Room.creator == pr.player)
@@ -419,7 +557,20 @@ async def clone_location(sid: str, data: LocationCloneData):
         logger.warning(f"Destination room {data['room']} not found.")
         return
 
-    src_location = Location.get_by_id(data["location"])
+    new_location = await db_executor.write(_copy_location, data["location"], room)
+
+    if room == pr.room:
+        old_location = pr.active_location
+        for psid in game_state.get_sids(player=pr.player, active_location=old_location):
+            game_state.leave_location(psid, old_location)
+            game_state.enter_location(psid, new_location)
+            await load_location(psid, new_location)
+        pr.active_location = new_location
+        pr.save()
+
+
+def _copy_location(location_id: int, room: Room) -> Location:
+    src_location = Location.get_by_id(location_id)
     new_location = Location.create(
         room=room, name=src_location.name, index=room.locations.count()
     )
@@ -464,15 +615,7 @@ async def clone_location(sid: str, data: LocationCloneData):
         else:
             LocationUserOption.create(**lduo)
 
-    if room == pr.room:
-        for psid in game_state.get_sids(
-            player=pr.player, active_location=pr.active_location
-        ):
-            sio.leave_room(psid, pr.active_location.get_path(), namespace=GAME_NS)
-            sio.enter_room(psid, new_location.get_path(), namespace=GAME_NS)
-            await load_location(psid, new_location)
-        pr.active_location = new_location
-        pr.save()
+    return new_location
 
 
 @sio.on("Locations.Order.Set", namespace=GAME_NS)
@@ -533,7 +676,7 @@ async def delete_location(sid: str, location_id: int):
         )
         return
 
-    location.delete_instance(recursive=True)
+    await db_executor.write(location.delete_instance, recursive=True)
 
 
 @sio.on("Location.Archive", namespace=GAME_NS)
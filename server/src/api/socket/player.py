@@ -64,8 +64,8 @@ async def set_player_role(sid: str, data: PlayerRoleChange):
     player_pr.save()
 
     for sid in game_state.get_sids(player=player_pr.player, room=pr.room):
+        game_state.set_role(sid, new_role)
         await sio.disconnect(sid, namespace=GAME_NS)
 
-    for psid in game_state.get_sids(room=pr.room):
-        if game_state.get(psid).role == Role.DM:
-            await sio.emit("Player.Role.Set", data, room=psid, namespace=GAME_NS)
+    for psid in game_state.get_sids(room=pr.room, role=Role.DM):
+        await sio.emit("Player.Role.Set", data, room=psid, namespace=GAME_NS)
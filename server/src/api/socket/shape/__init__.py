@@ -1,6 +1,6 @@
-from typing import Any, Dict, List, Optional, Tuple, Union, cast
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union, cast
 
-from peewee import Case
 from socketio import AsyncServer
 
 from .... import auth
@@ -23,19 +23,30 @@ from ....models import (
     User,
 )
 from ....models.campaign import Location
-from ....models.db import db
+from ....models.db import db, db_executor
 from ....models.role import Role
-from ....models.shape.access import has_ownership
-from ....models.utils import get_table, reduce_data_to_model
+from ....models.shape.access import filter_ownership, permission_cache
+from ....models.shape.order import ORDER_KEY_STEP, get_next_index, move_to_position
+from ....models.shape.prefetch import ShapePrefetch
+from ....models.utils import get_table, insert_rows, reduce_data_to_model
 from ....state.game import game_state
+from ....state.position import ShapePosition, position_buffer
+from ....state.snapshot import changes_location, snapshot_cache
 from ..constants import GAME_NS
 from ..groups import remove_group_if_empty
 from .data_models import *
+from .utils import (
+    get_player_sids,
+    get_shapes_with_layer,
+    send_by_ownership,
+    send_shapes_by_ownership,
+)
 from . import access, options, toggle_composite
 
 
 @sio.on("Shape.Add", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def add_shape(sid: str, data: ShapeAdd):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -56,7 +67,7 @@ async def add_shape(sid: str, data: ShapeAdd):
     else:
         with db.atomic():
             data["shape"]["layer"] = layer
-            data["shape"]["index"] = layer.shapes.count()
+            data["shape"]["index"] = get_next_index(layer)
             # Shape itself
             shape = Shape.create(**reduce_data_to_model(Shape, data["shape"]))
             # Subshape
@@ -92,18 +103,188 @@ async def add_shape(sid: str, data: ShapeAdd):
             for aura in data["shape"]["auras"]:
                 Aura.create(**reduce_data_to_model(Aura, aura))
 
-    for room_player in pr.room.players:
-        is_dm = cast(bool, room_player.role == Role.DM)
-        for psid in game_state.get_sids(
-            player=room_player.player, active_location=pr.active_location
-        ):
-            if psid == sid:
-                continue
-            if not is_dm and not layer.player_visible:
+    if data["temporary"]:
+        await send_by_ownership(
+            "Shape.Add",
+            pr.active_location,
+            owned=data["shape"],
+            other=data["shape"] if layer.player_visible else None,
+            owner_ids=[],
+            skip_sid=sid,
+        )
+        return
+
+    owner_ids: Optional[Set[int]] = None
+    if not (shape.default_edit_access or shape.default_vision_access):
+        owner_ids = {owner.user_id for owner in shape.owners}
+
+    await send_by_ownership(
+        "Shape.Add",
+        pr.active_location,
+        owned=shape.as_dict(pr.player, True),
+        other=shape.as_dict(None, False) if layer.player_visible else None,
+        owner_ids=owner_ids if layer.player_visible else [],
+        skip_sid=sid,
+    )
+
+
+@sio.on("Shapes.Add", namespace=GAME_NS)
+@auth.login_required(app, sio, "game")
+@changes_location
+async def add_shapes(sid: str, data: ShapesAdd):
+    pr: PlayerRoom = game_state.get(sid)
+
+    if "temporary" not in data:
+        data["temporary"] = False
+
+    if not data["shapes"]:
+        return
+
+    layers: Dict[Tuple[str, str], Layer] = {
+        (layer.floor.name, layer.name): layer
+        for layer in Layer.select(Layer, Floor)
+        .join(Floor)
+        .where(Floor.location == pr.active_location)
+    }
+    try:
+        shape_layers = [
+            layers[(shape["floor"], shape["layer"])] for shape in data["shapes"]
+        ]
+    except KeyError:
+        return
+
+    if pr.role != Role.DM and not all(layer.player_editable for layer in shape_layers):
+        logger.warning(f"{pr.player.name} attempted to add a shape to a dm layer")
+        return
+
+    if data["temporary"]:
+        for shape in data["shapes"]:
+            game_state.add_temp(sid, shape["uuid"])
+        await send_shapes_by_ownership(
+            "Shapes.Add",
+            pr.active_location,
+            [
+                (layer, shape, shape, [])
+                for layer, shape in zip(shape_layers, data["shapes"])
+            ],
+            skip_sid=sid,
+        )
+        return
+
+    users = {
+        user.name: user
+        for user in User.select().where(
+            User.name
+            << [owner["user"] for shape in data["shapes"] for owner in shape["owners"]]
+        )
+    }
+
+    next_indices: Dict[int, int] = {}
+    shape_rows: List[Dict[str, Any]] = []
+    subtype_rows: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    owner_rows: List[Dict[str, Any]] = []
+    tracker_rows: List[Dict[str, Any]] = []
+    aura_rows: List[Dict[str, Any]] = []
+    owner_ids: Dict[str, Optional[Set[int]]] = {}
+
+    for layer, data_shape in zip(shape_layers, data["shapes"]):
+        type_table = get_table(data_shape["type_"])
+        if type_table is None:
+            logger.error("UNKNOWN SHAPE TYPE DETECTED")
+            return
+
+        if layer.id not in next_indices:
+            next_indices[layer.id] = get_next_index(layer)
+        shape_id = data_shape["uuid"]
+        shape_rows.append(
+            {
+                **reduce_data_to_model(Shape, data_shape),
+                "layer": layer.id,
+                "index": next_indices[layer.id],
+            }
+        )
+        next_indices[layer.id] += ORDER_KEY_STEP
+
+        subtype_rows[type_table].append(
+            {
+                **type_table.pre_create(**reduce_data_to_model(type_table, data_shape)),
+                "shape": shape_id,
+            }
+        )
+
+        owners = set()
+        for owner in data_shape["owners"]:
+            user = users.get(owner["user"])
+            if user is None:
+                logger.warning(f"Attempt to add unknown owner {owner['user']}")
                 continue
-            if not data["temporary"]:
-                data["shape"] = shape.as_dict(room_player.player, is_dm)  # type: ignore
-            await sio.emit("Shape.Add", data["shape"], room=psid, namespace=GAME_NS)
+            owners.add(user.id)
+            owner_rows.append(
+                {
+                    "shape": shape_id,
+                    "user": user.id,
+                    "edit_access": owner["edit_access"],
+                    "movement_access": owner["movement_access"],
+                    "vision_access": owner["vision_access"],
+                }
+            )
+        if data_shape.get("default_edit_access") or data_shape.get(
+            "default_vision_access"
+        ):
+            owner_ids[shape_id] = None
+        else:
+            owner_ids[shape_id] = owners
+
+        for tracker in data_shape["trackers"]:
+            tracker_rows.append(
+                {**reduce_data_to_model(Tracker, tracker), "shape": shape_id}
+            )
+        for aura in data_shape["auras"]:
+            aura_rows.append({**reduce_data_to_model(Aura, aura), "shape": shape_id})
+
+    def insert_shapes():
+        insert_rows(Shape, shape_rows)
+        for type_table, rows in subtype_rows.items():
+            insert_rows(type_table, rows)
+        for data_shape in data["shapes"]:
+            type_table = get_table(data_shape["type_"])
+            type_table.post_create(type_table(shape=data_shape["uuid"]), **data_shape)
+        insert_rows(ShapeOwner, owner_rows)
+        insert_rows(Tracker, tracker_rows)
+        insert_rows(Aura, aura_rows)
+
+    shape_ids = [data_shape["uuid"] for data_shape in data["shapes"]]
+    await db_executor.write(insert_shapes)
+
+    # The bulk inserts bypass the model signals
+    for shape_id in shape_ids:
+        permission_cache.invalidate(shape_id)
+
+    def serialize_shapes():
+        prefetch = ShapePrefetch(
+            list({layer.id: layer for layer in shape_layers}.values()), shape_ids
+        )
+        shapes = {
+            shape.uuid: shape
+            for layer_shapes in prefetch.shapes.values()
+            for shape in layer_shapes
+        }
+        return [
+            (
+                layer,
+                prefetch.shape_as_dict(shapes[shape_id], pr.player, True),
+                prefetch.shape_as_dict(shapes[shape_id], None, False),
+                owner_ids[shape_id],
+            )
+            for layer, shape_id in zip(shape_layers, shape_ids)
+        ]
+
+    await send_shapes_by_ownership(
+        "Shapes.Add",
+        pr.active_location,
+        await db_executor.read(serialize_shapes),
+        skip_sid=sid,
+    )
 
 
 @sio.on("Shapes.Position.Update", namespace=GAME_NS)
@@ -111,30 +292,29 @@ async def add_shape(sid: str, data: ShapeAdd):
 async def update_shape_positions(sid: str, data: PositionUpdateList):
     pr: PlayerRoom = game_state.get(sid)
 
-    shapes: List[Tuple[Shape, PositionUpdate]] = []
-
-    for sh in data["shapes"]:
-        shape = Shape.get_or_none(Shape.uuid == sh["uuid"])
-        if shape is not None and not has_ownership(shape, pr, movement=True):
-            logger.warning(
-                f"User {pr.player.name} attempted to move a shape it does not own."
-            )
-            return
-        shapes.append((shape, sh))
+    db_shapes = get_shapes_with_layer(sh["uuid"] for sh in data["shapes"])
+    if len(filter_ownership(db_shapes.values(), pr, movement=True)) != len(db_shapes):
+        logger.warning(
+            f"User {pr.player.name} attempted to move a shape it does not own."
+        )
+        return
 
     if not data["temporary"]:
-        with db.atomic():
-            for db_shape, data_shape in shapes:
-                points = data_shape["position"]["points"]
-                db_shape.x = points[0][0]
-                db_shape.y = points[0][1]
-                db_shape.angle = data_shape["position"]["angle"]
-                db_shape.save()
-
-                if len(points) > 1:
-                    # Subshape
-                    type_instance = db_shape.subtype
-                    type_instance.set_location(points[1:])
+        # The positions are written to the database by the position buffer
+        for data_shape in data["shapes"]:
+            db_shape = db_shapes.get(data_shape["uuid"])
+            if db_shape is None:
+                continue
+            points = data_shape["position"]["points"]
+            vertices = None
+            if len(points) > 1 and db_shape.type_ == "polygon":
+                vertices = points[1:]
+            position = ShapePosition(
+                points[0][0], points[0][1], data_shape["position"]["angle"], vertices
+            )
+            position_buffer.set(db_shape.uuid, position)
+            # Moves keep the cached location data, the new positions are applied when it is served
+            snapshot_cache.move(pr.active_location_id, db_shape.uuid, position)
 
     await sio.emit(
         "Shapes.Position.Update",
@@ -153,6 +333,7 @@ async def send_remove_shapes(
 
 @sio.on("Shapes.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_shapes(sid: str, data: TemporaryShapesList):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -162,33 +343,24 @@ async def remove_shapes(sid: str, data: TemporaryShapesList):
             game_state.remove_temp(sid, shape)
     else:
         # Use the server version of the shapes.
-        try:
-            shapes: List[Shape] = [
-                s for s in Shape.select().where(Shape.uuid << data["uuids"])  # type: ignore
-            ]
-        except Shape.DoesNotExist:
+        shapes = list(get_shapes_with_layer(data["uuids"]).values())
+        if not shapes:
             logger.warning(f"Attempt to update unknown shape by {pr.player.name}")
             return
 
-        layer = shapes[0].layer
+        if len(filter_ownership(shapes, pr)) != len(shapes):
+            logger.warning(
+                f"User {pr.player.name} tried to update a shape it does not own."
+            )
+            return
 
         group_ids = set()
 
         for shape in shapes:
-            if not has_ownership(shape, pr):
-                logger.warning(
-                    f"User {pr.player.name} tried to update a shape it does not own."
-                )
-                return
-
             if shape.group:
                 group_ids.add(shape.group)
 
-            old_index = shape.index
             shape.delete_instance(True)
-            Shape.update(index=Shape.index - 1).where(
-                (Shape.layer == layer) & (Shape.index >= old_index)
-            ).execute()
 
         for group_id in group_ids:
             await remove_group_if_empty(group_id)
@@ -198,6 +370,7 @@ async def remove_shapes(sid: str, data: TemporaryShapesList):
 
 @sio.on("Shapes.Floor.Change", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def change_shape_floor(sid: str, data: ShapeFloorChange):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -208,17 +381,13 @@ async def change_shape_floor(sid: str, data: ShapeFloorChange):
     floor: Floor = Floor.get(location=pr.active_location, name=data["floor"])
     shapes: List[Shape] = [s for s in Shape.select().where(Shape.uuid << data["uuids"])]  # type: ignore
     layer: Layer = Layer.get(floor=floor, name=shapes[0].layer.name)
-    old_layer = shapes[0].layer
 
+    index = get_next_index(layer)
     for shape in shapes:
-        old_index = shape.index
         shape.layer = layer
-        shape.index = layer.shapes.count()
+        shape.index = index
         shape.save()
-
-        Shape.update(index=Shape.index - 1).where(
-            (Shape.layer == old_layer) & (Shape.index >= old_index)
-        ).execute()
+        index += ORDER_KEY_STEP
 
     await sio.emit(
         "Shapes.Floor.Change",
@@ -231,6 +400,7 @@ async def change_shape_floor(sid: str, data: ShapeFloorChange):
 
 @sio.on("Shapes.Layer.Change", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def change_shape_layer(sid: str, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -244,25 +414,16 @@ async def change_shape_layer(sid: str, data: Dict[str, Any]):
     old_layer = shapes[0].layer
 
     if old_layer.player_visible and not layer.player_visible:
-        for room_player in pr.room.players:
-            if room_player.role == Role.DM:
-                continue
-            for psid in game_state.get_sids(
-                player=room_player.player,
-                active_location=pr.active_location,
-                skip_sid=sid,
-            ):
-                await send_remove_shapes(sio, data["uuids"], psid)
+        await send_remove_shapes(
+            sio, data["uuids"], pr.active_location.get_players_path(), sid
+        )
 
+    index = get_next_index(layer)
     for shape in shapes:
-        old_index = shape.index
-
         shape.layer = layer
-        shape.index = layer.shapes.count()
+        shape.index = index
         shape.save()
-        Shape.update(index=Shape.index - 1).where(
-            (Shape.layer == old_layer) & (Shape.index >= old_index)
-        ).execute()
+        index += ORDER_KEY_STEP
 
     if old_layer.player_visible and layer.player_visible:
         await sio.emit(
@@ -273,32 +434,46 @@ async def change_shape_layer(sid: str, data: Dict[str, Any]):
             namespace=GAME_NS,
         )
     else:
-        for room_player in pr.room.players:
-            is_dm = room_player.role == Role.DM
-            for psid in game_state.get_sids(
-                player=room_player.player,
-                active_location=pr.active_location,
-                skip_sid=sid,
-            ):
-                if is_dm:
-                    await sio.emit(
-                        "Shapes.Layer.Change",
-                        data,
-                        room=psid,
-                        skip_sid=sid,
-                        namespace=GAME_NS,
-                    )
-                elif layer.player_visible:
-                    await sio.emit(
-                        "Shapes.Add",
-                        [shape.as_dict(room_player.player, False) for shape in shapes],
-                        room=psid,
-                        namespace=GAME_NS,
-                    )
+        await sio.emit(
+            "Shapes.Layer.Change",
+            data,
+            room=pr.active_location.get_dm_path(),
+            skip_sid=sid,
+            namespace=GAME_NS,
+        )
+        if layer.player_visible:
+            # Players owning some of the shapes each get their own view, all other players share one
+            skip_sids = [sid]
+            owners = (
+                User.select()
+                .join(ShapeOwner)
+                .where(ShapeOwner.shape << [shape.uuid for shape in shapes])
+                .distinct()
+            )
+            for owner in owners:
+                owner_sids = get_player_sids(pr.active_location, owner.id)
+                if not owner_sids:
+                    continue
+                skip_sids.extend(owner_sids)
+                await sio.emit(
+                    "Shapes.Add",
+                    [shape.as_dict(owner, False) for shape in shapes],
+                    room=pr.active_location.get_player_path(owner.id),
+                    skip_sid=sid,
+                    namespace=GAME_NS,
+                )
+            await sio.emit(
+                "Shapes.Add",
+                [shape.as_dict(None, False) for shape in shapes],
+                room=pr.active_location.get_players_path(),
+                skip_sid=skip_sids,
+                namespace=GAME_NS,
+            )
 
 
 @sio.on("Shape.Order.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def move_shape_order(sid: str, data: ShapeOrder):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -312,20 +487,7 @@ async def move_shape_order(sid: str, data: ShapeOrder):
             )
             return
 
-        target = data["index"]
-        sign = 1 if target < shape.index else -1
-        case = Case(
-            None,
-            (
-                (Shape.index == shape.index, target),
-                (
-                    (sign * Shape.index) < (sign * shape.index),
-                    (Shape.index + (sign * 1)),
-                ),
-            ),
-            Shape.index,
-        )
-        Shape.update(index=case).where(Shape.layer == layer).execute()
+        move_to_position(shape, data["index"])
 
     await sio.emit(
         "Shape.Order.Set",
@@ -338,6 +500,7 @@ async def move_shape_order(sid: str, data: ShapeOrder):
 
 @sio.on("Shapes.Location.Move", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def move_shapes(sid: str, data: ServerShapeLocationMove):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -358,9 +521,12 @@ async def move_shapes(sid: str, data: ServerShapeLocationMove):
 
     for shape in shapes:
         shape.layer = floor.layers.where(Layer.name == shape.layer.name)[0]
+        shape.index = get_next_index(shape.layer)
         shape.center_at(x, y)
         shape.save()
 
+    snapshot_cache.bump(location.id)
+
     for psid, player in game_state.get_users(active_location=location):
         await sio.emit(
             "Shapes.Add",
@@ -372,6 +538,7 @@ async def move_shapes(sid: str, data: ServerShapeLocationMove):
 
 @sio.on("Shape.CircularToken.Value.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_circular_token_value(sid: str, data: TextUpdateData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -391,6 +558,7 @@ async def set_circular_token_value(sid: str, data: TextUpdateData):
 
 @sio.on("Shape.Text.Value.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_text_value(sid: str, data: TextUpdateData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -410,6 +578,7 @@ async def set_text_value(sid: str, data: TextUpdateData):
 
 @sio.on("Shape.Rect.Size.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_rect_size(sid: str, data: RectSizeData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -434,6 +603,7 @@ async def update_rect_size(sid: str, data: RectSizeData):
 
 @sio.on("Shape.Circle.Size.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_circle_size(sid: str, data: CircleSizeData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -457,6 +627,7 @@ async def update_circle_size(sid: str, data: CircleSizeData):
 
 @sio.on("Shape.Text.Size.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_text_size(sid: str, data: TextSizeData):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -477,23 +648,23 @@ async def update_text_size(sid: str, data: TextSizeData):
 
 @sio.on("Shapes.Options.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_shape_options(sid: str, data: OptionUpdateList):
     pr: PlayerRoom = game_state.get(sid)
 
-    shapes: List[Tuple[Shape, OptionUpdate]] = []
-
-    for sh in data["options"]:
-        shape = Shape.get_or_none(Shape.uuid == sh["uuid"])
-        if shape is not None and not has_ownership(shape, pr, movement=True):
-            logger.warning(
-                f"User {pr.player.name} attempted to change options for a shape it does not own."
-            )
-            return
-        shapes.append((shape, sh))
+    db_shapes = get_shapes_with_layer(sh["uuid"] for sh in data["options"])
+    if len(filter_ownership(db_shapes.values(), pr, movement=True)) != len(db_shapes):
+        logger.warning(
+            f"User {pr.player.name} attempted to change options for a shape it does not own."
+        )
+        return
 
     if not data["temporary"]:
         with db.atomic():
-            for db_shape, data_shape in shapes:
+            for data_shape in data["options"]:
+                db_shape = db_shapes.get(data_shape["uuid"])
+                if db_shape is None:
+                    continue
                 db_shape.options = data_shape["option"]
                 db_shape.save()
 
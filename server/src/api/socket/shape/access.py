@@ -5,14 +5,16 @@ from ....app import app, sio
 from ....logs import logger
 from ....models import PlayerRoom, Shape, ShapeOwner, User
 from ....models.role import Role
-from ....models.shape.access import has_ownership
+from ....models.shape.access import has_ownership, permission_cache
 from ....state.game import game_state
+from ....state.snapshot import changes_location
 from ..constants import GAME_NS
 from .data_models import ServerShapeDefaultOwner, ServerShapeOwner
 
 
 @sio.on("Shape.Owner.Add", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def add_shape_owner(sid: str, data: ServerShapeOwner):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -49,6 +51,7 @@ async def add_shape_owner(sid: str, data: ServerShapeOwner):
             movement_access=data["movement_access"],
             vision_access=data["vision_access"],
         )
+
     await sio.emit(
         "Shape.Owner.Add",
         data,
@@ -70,6 +73,7 @@ async def add_shape_owner(sid: str, data: ServerShapeOwner):
 
 @sio.on("Shape.Owner.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_shape_owner(sid: str, data: ServerShapeOwner):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -120,6 +124,7 @@ async def update_shape_owner(sid: str, data: ServerShapeOwner):
 
 @sio.on("Shape.Owner.Delete", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def delete_shape_owner(sid: str, data: ServerShapeOwner):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -151,6 +156,9 @@ async def delete_shape_owner(sid: str, data: ServerShapeOwner):
     except Exception:
         logger.warning(f"Could not delete shape-owner relation by {pr.player.name}")
 
+    # Query deletes do not trigger the model signals
+    permission_cache.invalidate(shape.uuid)
+
     await sio.emit(
         "Shape.Owner.Delete",
         data,
@@ -162,6 +170,7 @@ async def delete_shape_owner(sid: str, data: ServerShapeOwner):
 
 @sio.on("Shape.Owner.Default.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_default_shape_owner(sid: str, data: ServerShapeDefaultOwner):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -96,6 +96,11 @@ class ShapeAdd(TypedDict):
     temporary: bool
 
 
+class ShapesAdd(TypedDict):
+    shapes: List[ShapeKeys]
+    temporary: bool
+
+
 class TemporaryShapesList(TypedDict):
     uuids: List[str]
     temporary: bool
@@ -12,8 +12,14 @@ from ....models import Aura, PlayerRoom, ShapeLabel, Tracker
 from ....models.shape import Shape
 from ....models.utils import reduce_data_to_model
 from ....state.game import game_state
+from ....state.snapshot import changes_location
 from ..constants import GAME_NS
-from .utils import get_owner_sids, get_shape_or_none
+from .utils import (
+    get_owner_ids,
+    get_owner_sids,
+    get_shape_or_none,
+    send_by_ownership,
+)
 
 
 class ShapeSetBooleanValue(TypedDict):
@@ -91,20 +97,9 @@ async def send_name(
     await _send_game(sio, "Shape.Options.Name.Set", data, room, skip_sid)
 
 
-async def send_new_tracker(
-    sio: AsyncServer, data: TrackerDelta, room: str, skip_sid: Optional[str] = None
-):
-    await _send_game(sio, "Shape.Options.Tracker.Create", data, room, skip_sid)
-
-
-async def send_new_aura(
-    sio: AsyncServer, data: AuraDelta, room: str, skip_sid: Optional[str] = None
-):
-    await _send_game(sio, "Shape.Options.Aura.Create", data, room, skip_sid)
-
-
 @sio.on("Shape.Options.Invisible.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_invisible(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -126,6 +121,7 @@ async def set_invisible(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.Defeated.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_defeated(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -147,6 +143,7 @@ async def set_defeated(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.Locked.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_locked(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -168,6 +165,7 @@ async def set_locked(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.Token.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_token(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -189,6 +187,7 @@ async def set_token(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.MovementBlock.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_movement_block(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -210,6 +209,7 @@ async def set_movement_block(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.VisionBlock.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_vision_block(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -231,6 +231,7 @@ async def set_vision_block(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.Annotation.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_annotation(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -250,6 +251,7 @@ async def set_annotation(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.AnnotationVisible.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_annotation_visible(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -285,6 +287,7 @@ async def set_annotation_visible(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.Tracker.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_tracker(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -306,6 +309,7 @@ async def remove_tracker(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.Aura.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_aura(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -327,6 +331,7 @@ async def remove_aura(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.Label.Add", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def add_label(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -347,6 +352,7 @@ async def add_label(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.Label.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_label(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -364,6 +370,7 @@ async def remove_label(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.Name.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_name(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -383,6 +390,7 @@ async def set_name(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.NameVisible.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_name_visible(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -415,6 +423,7 @@ async def set_name_visible(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.ShowBadge.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_show_badge(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -436,6 +445,7 @@ async def set_show_badge(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.StrokeColour.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_stroke_colour(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -457,6 +467,7 @@ async def set_stroke_colour(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.FillColour.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_fill_colour(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -478,6 +489,7 @@ async def set_fill_colour(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.Tracker.Create", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def create_tracker(sid: str, data: TrackerDelta):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -489,20 +501,19 @@ async def create_tracker(sid: str, data: TrackerDelta):
     tracker = Tracker.create(**model)
     tracker.save()
 
-    owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
-    for psid in owners:
-        await send_new_tracker(sio, data, psid)
-    if tracker.visible:
-        for psid in game_state.get_sids(
-            active_location=pr.active_location, skip_sid=sid
-        ):
-            if psid in owners:
-                continue
-            await send_new_tracker(sio, data, psid)
+    await send_by_ownership(
+        "Shape.Options.Tracker.Create",
+        pr.active_location,
+        owned=data,
+        other=data if tracker.visible else None,
+        owner_ids=get_owner_ids(shape),
+        skip_sid=sid,
+    )
 
 
 @sio.on("Shape.Options.Tracker.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_tracker(sid: str, data: TrackerDelta):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -515,39 +526,39 @@ async def update_tracker(sid: str, data: TrackerDelta):
     update_model_from_dict(tracker, data)
     tracker.save()
 
-    owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
-    for psid in owners:
+    if not changed_visible:
         await sio.emit(
             "Shape.Options.Tracker.Update",
             data,
-            room=psid,
+            room=pr.active_location.get_path(),
+            skip_sid=sid,
             namespace=GAME_NS,
         )
-    for psid in game_state.get_sids(active_location=pr.active_location, skip_sid=sid):
-        if psid in owners:
-            continue
-        if changed_visible:
-            if tracker.visible:
-                _data = cast(TrackerDelta, {"shape": shape.uuid, **tracker.as_dict()})
-                await send_new_tracker(sio, _data, psid)
-            else:
-                await sio.emit(
-                    "Shape.Options.Tracker.Remove",
-                    {"shape": shape.uuid, "value": tracker.uuid},
-                    room=psid,
-                    namespace=GAME_NS,
-                )
-        else:
-            await sio.emit(
-                "Shape.Options.Tracker.Update",
-                data,
-                room=psid,
-                namespace=GAME_NS,
-            )
+    elif tracker.visible:
+        await send_by_ownership(
+            "Shape.Options.Tracker.Update",
+            pr.active_location,
+            owned=data,
+            other={"shape": shape.uuid, **tracker.as_dict()},
+            owner_ids=get_owner_ids(shape),
+            skip_sid=sid,
+            other_event="Shape.Options.Tracker.Create",
+        )
+    else:
+        await send_by_ownership(
+            "Shape.Options.Tracker.Update",
+            pr.active_location,
+            owned=data,
+            other={"shape": shape.uuid, "value": tracker.uuid},
+            owner_ids=get_owner_ids(shape),
+            skip_sid=sid,
+            other_event="Shape.Options.Tracker.Remove",
+        )
 
 
 @sio.on("Shape.Options.Tracker.Move", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def move_tracker(sid: str, data: TrackerMove):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -570,6 +581,7 @@ async def move_tracker(sid: str, data: TrackerMove):
 
 @sio.on("Shape.Options.Aura.Create", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def create_aura(sid: str, data: AuraDelta):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -581,20 +593,19 @@ async def create_aura(sid: str, data: AuraDelta):
     aura = Aura.create(**model)
     aura.save()
 
-    owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
-    for psid in owners:
-        await send_new_aura(sio, data, psid)
-    if aura.visible:
-        for psid in game_state.get_sids(
-            active_location=pr.active_location, skip_sid=sid
-        ):
-            if psid in owners:
-                continue
-            await send_new_aura(sio, data, psid)
+    await send_by_ownership(
+        "Shape.Options.Aura.Create",
+        pr.active_location,
+        owned=data,
+        other=data if aura.visible else None,
+        owner_ids=get_owner_ids(shape),
+        skip_sid=sid,
+    )
 
 
 @sio.on("Shape.Options.Aura.Update", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def update_aura(sid: str, data: AuraDelta):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -607,39 +618,39 @@ async def update_aura(sid: str, data: AuraDelta):
     update_model_from_dict(aura, data)
     aura.save()
 
-    owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
-    for psid in owners:
+    if not changed_visible:
         await sio.emit(
             "Shape.Options.Aura.Update",
             data,
-            room=psid,
+            room=pr.active_location.get_path(),
+            skip_sid=sid,
             namespace=GAME_NS,
         )
-    for psid in game_state.get_sids(active_location=pr.active_location, skip_sid=sid):
-        if psid in owners:
-            continue
-        if changed_visible:
-            if aura.visible:
-                _data = cast(AuraDelta, {"shape": shape.uuid, **aura.as_dict()})
-                await send_new_aura(sio, _data, psid)
-            else:
-                await sio.emit(
-                    "Shape.Options.Aura.Remove",
-                    {"shape": shape.uuid, "value": aura.uuid},
-                    room=psid,
-                    namespace=GAME_NS,
-                )
-        else:
-            await sio.emit(
-                "Shape.Options.Aura.Update",
-                data,
-                room=psid,
-                namespace=GAME_NS,
-            )
+    elif aura.visible:
+        await send_by_ownership(
+            "Shape.Options.Aura.Update",
+            pr.active_location,
+            owned=data,
+            other={"shape": shape.uuid, **aura.as_dict()},
+            owner_ids=get_owner_ids(shape),
+            skip_sid=sid,
+            other_event="Shape.Options.Aura.Create",
+        )
+    else:
+        await send_by_ownership(
+            "Shape.Options.Aura.Update",
+            pr.active_location,
+            owned=data,
+            other={"shape": shape.uuid, "value": aura.uuid},
+            owner_ids=get_owner_ids(shape),
+            skip_sid=sid,
+            other_event="Shape.Options.Aura.Remove",
+        )
 
 
 @sio.on("Shape.Options.Aura.Move", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def move_aura(sid: str, data: AuraMove):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -662,6 +673,7 @@ async def move_aura(sid: str, data: AuraMove):
 
 @sio.on("Shape.Options.IsDoor.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_is_door(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -708,6 +720,7 @@ def set_options_deep(shape: Shape, key: str, subkey: str, value):
 
 @sio.on("Shape.Options.Door.Permissions.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_door_permissions(sid: str, data):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -728,6 +741,7 @@ async def set_door_permissions(sid: str, data):
 
 @sio.on("Shape.Options.Door.ToggleMode.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_door_toggle_mode(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -748,6 +762,7 @@ async def set_door_toggle_mode(sid: str, data: ShapeSetStringValue):
 
 @sio.on("Shape.Options.IsTeleportZone.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_is_teleport_zone(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -769,6 +784,7 @@ async def set_is_teleport_zone(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.IsImmediateTeleportZone.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_is_immediate_teleport_zone(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -789,6 +805,7 @@ async def set_is_immediate_teleport_zone(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.TeleportZonePermissions.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_tp_permissions(sid: str, data):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -809,6 +826,7 @@ async def set_tp_permissions(sid: str, data):
 
 @sio.on("Shape.Options.TeleportZoneTarget.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_tp_target(sid: str, data):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -829,6 +847,7 @@ async def set_tp_target(sid: str, data):
 
 @sio.on("Shape.Options.SkipDraw.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_skip_draw(sid: str, data: ShapeSetBooleanValue):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -849,6 +868,7 @@ async def set_skip_draw(sid: str, data: ShapeSetBooleanValue):
 
 @sio.on("Shape.Options.SvgAsset.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_svg_asset(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
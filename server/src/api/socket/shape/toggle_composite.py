@@ -9,6 +9,7 @@ from ....app import app, sio
 from ....models import PlayerRoom
 from ....models.shape import CompositeShapeAssociation, ToggleComposite
 from ....state.game import game_state
+from ....state.snapshot import changes_location
 from ..constants import GAME_NS
 from .utils import get_shape_or_none
 
@@ -33,6 +34,7 @@ async def send_new_variant(
 
 @sio.on("ToggleComposite.Variants.Active.Set", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def set_toggle_composite_active_variant(sid: str, data: VariantMessage):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -56,6 +58,7 @@ async def set_toggle_composite_active_variant(sid: str, data: VariantMessage):
 
 @sio.on("ToggleComposite.Variants.Add", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def add_toggle_composite_variant(sid: str, data: NewVariantMessage):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -71,6 +74,7 @@ async def add_toggle_composite_variant(sid: str, data: NewVariantMessage):
 
 @sio.on("ToggleComposite.Variants.Rename", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def rename_toggle_composite_variant(sid: str, data: NewVariantMessage):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -91,6 +95,7 @@ async def rename_toggle_composite_variant(sid: str, data: NewVariantMessage):
 
 @sio.on("ToggleComposite.Variants.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio, "game")
+@changes_location
 async def remove_toggle_composite_variant(sid: str, data: VariantMessage):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -1,9 +1,12 @@
-from typing import Generator, Union
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, Tuple, Union
 
+from ....app import sio
 from ....logs import logger
-from ....models import PlayerRoom, Shape
-from ....models.shape.access import has_ownership
+from ....models import Layer, Location, PlayerRoom, Shape
+from ....models.role import Role
+from ....models.shape.access import has_ownership, permission_cache
 from ....state.game import game_state
+from ..constants import GAME_NS
 
 
 def get_shape_or_none(pr: PlayerRoom, shape_id: str, action: str) -> Union[Shape, None]:
@@ -24,11 +27,182 @@ def get_shape_or_none(pr: PlayerRoom, shape_id: str, action: str) -> Union[Shape
     return shape
 
 
+def get_shapes_with_layer(shape_ids: Iterable[str]) -> Dict[str, Shape]:
+    """
+    Loads the shapes together with their layer, keyed by their uuid.
+    Unknown ids are ignored, these are usually temporary shapes.
+    """
+    return {
+        shape.uuid: shape
+        for shape in Shape.select(Shape, Layer)
+        .join(Layer)
+        .where(Shape.uuid << list(shape_ids))
+    }
+
+
 def get_owner_sids(
     pr: PlayerRoom, shape: Shape, skip_sid=None
 ) -> Generator[str, None, None]:
-    for psid in game_state.get_sids(
-        active_location=pr.active_location, skip_sid=skip_sid
-    ):
-        if has_ownership(shape, game_state.get(psid)):
-            yield psid
+    location_sids = set(
+        game_state.get_sids(active_location=pr.active_location, skip_sid=skip_sid)
+    )
+    owner_ids = get_owner_ids(shape)
+    if owner_ids is None:
+        yield from location_sids
+        return
+
+    owner_sids = set(
+        game_state.get_sids(active_location=pr.active_location, role=Role.DM)
+    )
+    for owner_id in owner_ids:
+        owner_sids.update(
+            game_state.get_sids(active_location=pr.active_location, player=owner_id)
+        )
+    yield from location_sids & owner_sids
+
+
+def get_player_sids(location: Location, player_id: int) -> List[str]:
+    """
+    Returns the sids of a user on the location, if that user is not a dm.
+    These are the members of the player's room of the location.
+    """
+    return [
+        psid
+        for psid in game_state.get_sids(player=player_id, active_location=location)
+        if game_state.get(psid).role != Role.DM
+    ]
+
+
+def get_owner_ids(shape: Shape) -> Optional[Set[int]]:
+    """
+    Returns the ids of the players that have ownership of the shape according to `has_ownership`.
+
+    None is returned if every player has ownership.
+    """
+    access = permission_cache.get(shape)
+    if not access.player_editable:
+        return set()
+    if access.default_edit_access:
+        return None
+    return set(access.owners)
+
+
+async def send_by_ownership(
+    event: str,
+    location: Location,
+    *,
+    owned: Any,
+    other: Any,
+    owner_ids: Optional[Iterable[int]],
+    skip_sid: Optional[str] = None,
+    other_event: Optional[str] = None,
+) -> None:
+    """
+    Sends `owned` to the dms and the players in `owner_ids` on the location
+    and `other` to the remaining players, unless it is None.
+    The remaining players can receive a different event by providing `other_event`.
+
+    Every audience is reached with a single emit to one of the location rooms.
+    An `owner_ids` of None gives every player ownership.
+    """
+    if owner_ids is None:
+        await sio.emit(
+            event,
+            owned,
+            room=location.get_path(),
+            skip_sid=skip_sid,
+            namespace=GAME_NS,
+        )
+        return
+
+    await sio.emit(
+        event,
+        owned,
+        room=location.get_dm_path(),
+        skip_sid=skip_sid,
+        namespace=GAME_NS,
+    )
+
+    skip_sids = [skip_sid]
+    for owner_id in owner_ids:
+        owner_sids = get_player_sids(location, owner_id)
+        if not owner_sids:
+            continue
+        skip_sids.extend(owner_sids)
+        await sio.emit(
+            event,
+            owned,
+            room=location.get_player_path(owner_id),
+            skip_sid=skip_sid,
+            namespace=GAME_NS,
+        )
+
+    if other is not None:
+        await sio.emit(
+            other_event or event,
+            other,
+            room=location.get_players_path(),
+            skip_sid=skip_sids,
+            namespace=GAME_NS,
+        )
+
+
+async def send_shapes_by_ownership(
+    event: str,
+    location: Location,
+    shapes: List[Tuple[Layer, Any, Any, Optional[Iterable[int]]]],
+    *,
+    skip_sid: Optional[str] = None,
+) -> None:
+    """
+    Batched version of `send_by_ownership` for a list of shapes.
+
+    Every shape is given as a tuple of its layer, its `owned` and `other` payloads and its `owner_ids`.
+    Each audience receives a single list of all the shapes it can see,
+    shapes on layers that are not visible to players are only sent to the dms.
+    """
+    await sio.emit(
+        event,
+        [owned for _, owned, _, _ in shapes],
+        room=location.get_dm_path(),
+        skip_sid=skip_sid,
+        namespace=GAME_NS,
+    )
+
+    visible = [
+        (owned, other, owner_ids)
+        for layer, owned, other, owner_ids in shapes
+        if layer.player_visible
+    ]
+    if not visible:
+        return
+
+    player_ids: Set[int] = set()
+    for _, _, owner_ids in visible:
+        if owner_ids is not None:
+            player_ids.update(owner_ids)
+
+    skip_sids = [skip_sid]
+    for player_id in player_ids:
+        player_sids = get_player_sids(location, player_id)
+        if not player_sids:
+            continue
+        skip_sids.extend(player_sids)
+        await sio.emit(
+            event,
+            [
+                owned if owner_ids is None or player_id in owner_ids else other
+                for owned, other, owner_ids in visible
+            ],
+            room=location.get_player_path(player_id),
+            skip_sid=skip_sid,
+            namespace=GAME_NS,
+        )
+
+    await sio.emit(
+        event,
+        [owned if owner_ids is None else other for owned, other, owner_ids in visible],
+        room=location.get_players_path(),
+        skip_sid=skip_sids,
+        namespace=GAME_NS,
+    )
@@ -0,0 +1,190 @@
+import asyncio
+import math
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Set
+
+from .config import config
+from .logs import logger
+from .models import (
+    Asset,
+    AssetRect,
+    Floor,
+    LocationOptions,
+    Shape,
+    UnreferencedAssetFile,
+)
+from .models.db import db, db_executor
+from .utils import ASSETS_DIR
+
+# Asset files are referenced by their hash in urls, svg options and floor patterns
+HASH_RE = re.compile(r"[0-9a-f]{40}")
+ASSET_URL = "/static/assets/"
+# Number of marks that are added or removed per query
+MARK_BATCH_SIZE = 500
+
+
+class Collection(NamedTuple):
+    files: int
+    size: int
+
+
+def find_references() -> Set[str]:
+    """Returns the hashes of all asset files that are in use."""
+    references = {
+        file_hash
+        for (file_hash,) in Asset.select(Asset.file_hash)
+        .where(Asset.file_hash.is_null(False))
+        .distinct()
+        .tuples()
+    }
+    # Shapes keep showing their image when the asset they were created from is removed
+    for (src,) in AssetRect.select(AssetRect.src).tuples():
+        if ASSET_URL in src:
+            references.add(src.rsplit(ASSET_URL, 1)[1].split("?")[0])
+    for field in (
+        Shape.options,
+        Floor.background_color,
+        LocationOptions.air_map_background,
+        LocationOptions.ground_map_background,
+        LocationOptions.underground_map_background,
+    ):
+        for (text,) in field.model.select(field).where(field.is_null(False)).tuples():
+            references.update(HASH_RE.findall(text))
+    return references
+
+
+class AssetCollector:
+    """
+    Removes the asset files that are no longer used by any asset, shape or floor.
+
+    This is a mark and sweep over the database and the assets folder,
+    so files left behind by failed uploads and imports are reclaimed as well.
+    Every run records the unused files it finds together with the time it first found them,
+    a file is only removed once it has stayed unused for `grace_period` seconds.
+    Files that are used again lose their mark, files that are rewritten or reused after they were marked are marked anew,
+    they can belong to an upload or import that has not created its assets yet.
+    Variants and compressed copies of a file are removed together with it.
+    """
+
+    def __init__(self, interval: float, grace_period: float) -> None:
+        self.interval = interval
+        self.grace_period = grace_period
+
+    def scan(self) -> Dict[str, List[Path]]:
+        """Returns the files of the assets folder per asset hash."""
+        groups: Dict[str, List[Path]] = defaultdict(list)
+        if not ASSETS_DIR.exists():
+            return groups
+        for path in ASSETS_DIR.iterdir():
+            # Sibling files share the hash of their asset as the first part of their name
+            file_hash = path.name.split(".", 1)[0]
+            if HASH_RE.fullmatch(file_hash):
+                groups[file_hash].append(path)
+        return groups
+
+    def mark(
+        self, references: Set[str], groups: Dict[str, List[Path]]
+    ) -> Dict[str, float]:
+        """
+        Updates the marks of the unused files and returns the files that have been unused for longer than the grace period,
+        with the time they were marked. This has to run in a transaction.
+        """
+        now = time.time()
+        cutoff = now - self.grace_period
+        marks: Dict[str, float] = dict(
+            UnreferencedAssetFile.select(
+                UnreferencedAssetFile.file_hash, UnreferencedAssetFile.since
+            ).tuples()
+        )
+        unreferenced = set(groups) - references
+
+        # Files that are used again or that no longer exist
+        stale = [file_hash for file_hash in marks if file_hash not in unreferenced]
+        for i in range(0, len(stale), MARK_BATCH_SIZE):
+            UnreferencedAssetFile.delete().where(
+                UnreferencedAssetFile.file_hash.in_(stale[i : i + MARK_BATCH_SIZE])
+            ).execute()
+
+        expired: Dict[str, float] = {}
+        new: List[str] = []
+        for file_hash in unreferenced:
+            since = marks.get(file_hash)
+            if since is None or _modified(groups[file_hash]) > since:
+                new.append(file_hash)
+            elif since <= cutoff:
+                expired[file_hash] = since
+        for i in range(0, len(new), MARK_BATCH_SIZE):
+            UnreferencedAssetFile.insert_many(
+                [(file_hash, now) for file_hash in new[i : i + MARK_BATCH_SIZE]],
+                fields=[UnreferencedAssetFile.file_hash, UnreferencedAssetFile.since],
+            ).on_conflict_replace().execute()
+        return expired
+
+    def sweep(
+        self, groups: Dict[str, List[Path]], expired: Dict[str, float]
+    ) -> Collection:
+        """Removes the files of the expired hashes, unless they were rewritten or reused since they were marked."""
+        files = size = 0
+        for file_hash, since in expired.items():
+            paths = groups[file_hash]
+            try:
+                stats = [path.stat() for path in paths]
+            except FileNotFoundError:
+                continue
+            if any(st.st_mtime > since for st in stats):
+                continue
+            for path, st in zip(paths, stats):
+                if not path.is_file():
+                    continue
+                path.unlink(missing_ok=True)
+                files += 1
+                size += st.st_size
+        return Collection(files, size)
+
+    def collect(self) -> Collection:
+        groups = self.scan()
+        references = find_references()
+        with db.atomic():
+            expired = self.mark(references, groups)
+        return self.sweep(groups, expired)
+
+    async def collect_async(self) -> Collection:
+        loop = asyncio.get_running_loop()
+        groups = await loop.run_in_executor(None, self.scan)
+        references = await db_executor.read(find_references)
+        expired = await db_executor.write(self.mark, references, groups)
+        collection = await loop.run_in_executor(None, self.sweep, groups, expired)
+        if collection.files:
+            logger.info(
+                f"Removed {collection.files} unused asset file(s), reclaiming {collection.size} bytes"
+            )
+        return collection
+
+    async def run(self) -> None:
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect_async()
+            except Exception:
+                logger.exception("Could not collect unused asset files")
+
+
+def _modified(paths: List[Path]) -> float:
+    """Returns when any of the files was last written, or infinity if one of them no longer exists."""
+    try:
+        return max(path.stat().st_mtime for path in paths)
+    except FileNotFoundError:
+        return math.inf
+
+
+asset_collector = AssetCollector(
+    config.getfloat("General", "asset_collection_interval_in_seconds", fallback=86400),
+    config.getfloat(
+        "General", "asset_collection_grace_period_in_seconds", fallback=3600
+    ),
+)
@@ -0,0 +1,202 @@
+"""
+Asset files are stored in `ASSETS_DIR` under the sha1 of their content, without a file extension.
+
+Files of compressible types get a precompressed `.gz` sibling when they are stored,
+so that they can be served compressed without compressing them on every request.
+
+Uploaded images also get downscaled webp variants, from a thumbnail up to a size that is still sharp on large screens,
+so that clients can download the level of detail they need instead of the full image.
+The variants are created in worker processes, as decoding and scaling large maps takes a while.
+"""
+
+import gzip
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from .config import config
+from .logs import logger
+from .utils import ASSETS_DIR
+
+# File signatures of the formats that are used as assets
+SIGNATURES: Tuple[Tuple[bytes, str], ...] = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"\x1a\x45\xdf\xa3", "video/webm"),
+    (b"OggS", "audio/ogg"),
+    (b"ID3", "audio/mpeg"),
+)
+
+COMPRESSIBLE_TYPES = {"image/svg+xml", "image/bmp"}
+
+# Content encodings and the suffix of the sibling holding the file in that encoding, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+VARIANT_TYPES = {"image/png", "image/jpeg", "image/webp", "image/bmp"}
+# The largest dimension of every variant, variants are only created if they are smaller than the image
+VARIANT_SIZES = (256, 512, 1024, 2048, 4096)
+VARIANT_CONTENT_TYPE = "image/webp"
+
+
+def create_variant_executor() -> ProcessPoolExecutor:
+    # Workers are spawned instead of forked, the server process has running threads that forking does not copy
+    return ProcessPoolExecutor(
+        max_workers=config.getint("General", "image_processing_processes", fallback=1),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+variant_executor = create_variant_executor()
+
+
+@lru_cache(maxsize=4096)
+def get_content_type(file_hash: str) -> str:
+    """Determines the type of an asset from its content, asset files never change so the result is cached."""
+    with open(ASSETS_DIR / file_hash, "rb") as f:
+        header = f.read(1024)
+    for signature, content_type in SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header.lstrip().startswith(b"<") and b"<svg" in header:
+        return "image/svg+xml"
+    return "application/octet-stream"
+
+
+def precompress(file_hash: str) -> None:
+    """Writes the `.gz` sibling of an asset file if its type is compressible."""
+    if get_content_type(file_hash) not in COMPRESSIBLE_TYPES:
+        return
+    path = ASSETS_DIR / file_hash
+    sibling = path.with_name(f"{file_hash}.gz")
+    if sibling.exists():
+        return
+    partial = path.with_name(f"{file_hash}.gz.part")
+    with open(path, "rb") as f, gzip.open(partial, "wb", compresslevel=9) as out:
+        shutil.copyfileobj(f, out)
+    os.replace(partial, sibling)
+
+
+def get_encoded_path(file_hash: str, accept_encoding: str) -> Tuple[Path, str]:
+    """Returns the path of the preferred variant of an asset file the client accepts and its content encoding."""
+    path = ASSETS_DIR / file_hash
+    accepted = set()
+    for entry in accept_encoding.split(","):
+        encoding, _, params = entry.partition(";")
+        quality = params.strip().partition("q=")[2]
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding.strip().lower())
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted:
+            sibling = path.with_name(f"{file_hash}{suffix}")
+            if sibling.is_file():
+                return sibling, encoding
+    return path, "identity"
+
+
+def get_variant_path(file_hash: str, size: int) -> Path:
+    return ASSETS_DIR / f"{file_hash}.{size}.webp"
+
+
+def find_variant(file_hash: str, size: int) -> Optional[Tuple[Path, int]]:
+    """Returns the path and size of the smallest variant of an asset that is at least `size` pixels large, if any."""
+    for variant_size in VARIANT_SIZES:
+        if variant_size < size:
+            continue
+        path = get_variant_path(file_hash, variant_size)
+        if path.is_file():
+            return path, variant_size
+    return None
+
+
+def create_variants(file_hash: str) -> None:
+    """Writes the variants of an image asset, this runs in a worker process."""
+    if get_content_type(file_hash) not in VARIANT_TYPES:
+        return
+    with Image.open(ASSETS_DIR / file_hash) as image:
+        if getattr(image, "is_animated", False):
+            return
+        sizes = [size for size in reversed(VARIANT_SIZES) if size < max(image.size)]
+        # The largest variant is the last one to be moved in place
+        if not sizes or get_variant_path(file_hash, sizes[0]).exists():
+            return
+        # Jpeg images can be decoded at a fraction of their size, which is a lot faster
+        image.draft("RGB", (sizes[0], sizes[0]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        # Every variant is scaled down from the next larger one, which is cheaper than starting from the image
+        written = []
+        try:
+            for size in sizes:
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                path = get_variant_path(file_hash, size)
+                partial_path = path.with_name(f"{path.name}.part")
+                written.append((partial_path, path))
+                image.save(partial_path, "WEBP", quality=80, method=4)
+        except Exception:
+            for partial_path, _ in written:
+                partial_path.unlink(missing_ok=True)
+            raise
+
+    # Smaller variants appear first, so a variant found by `find_variant` is the one it will keep finding
+    for partial_path, path in reversed(written):
+        os.replace(partial_path, path)
+
+
+def _log_variant_failure(file_hash: str, future: Future) -> None:
+    exception = future.exception()
+    if exception is not None:
+        logger.warning(
+            f"Could not create the variants of asset {file_hash}: {exception}"
+        )
+
+
+def schedule_variants(file_hash: str) -> None:
+    """
+    Starts creating the variants of an asset in a worker process, without waiting for them.
+
+    Variants are optional, a failure to schedule them is logged and never fails the upload of the asset.
+    """
+    global variant_executor
+
+    try:
+        try:
+            future = variant_executor.submit(create_variants, file_hash)
+        except BrokenProcessPool:
+            # A worker that died, e.g. when it was killed for running out of memory on a huge map,
+            # breaks the pool for good, it has to be replaced by a new one.
+            logger.warning(
+                "An image processing worker stopped unexpectedly, restarting the workers"
+            )
+            variant_executor.shutdown(wait=False)
+            variant_executor = create_variant_executor()
+            future = variant_executor.submit(create_variants, file_hash)
+    except Exception:
+        logger.exception(f"Could not schedule the variants of asset {file_hash}")
+        return
+    future.add_done_callback(partial(_log_variant_failure, file_hash))
+
+
+def reuse_asset_file(file_hash: str) -> bool:
+    """Returns whether the asset file exists, an existing file is marked as new so that it is not collected while being reused."""
+    try:
+        os.utime(ASSETS_DIR / file_hash)
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,107 @@
+"""
+Campaign archives (.pac) are tar files compressed as a sequence of independent gzip members.
+
+Concatenated gzip members are a valid gzip file, so the archives can be read by tarfile and any other gzip aware tool,
+but every member can be compressed on its own.
+The tar stream is therefore cut into blocks that are compressed in parallel and written out in order.
+Blocks holding files that are already compressed, like most images, are only stored.
+"""
+
+import gzip
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque
+
+from ..config import config
+
+BLOCK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# File signatures of formats that do not get any smaller by compressing them again
+COMPRESSED_SIGNATURES = (
+    b"\x89PNG",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",  # gif
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bz2
+    b"PK\x03\x04",  # zip
+    b"\xfd7zXZ\x00",  # xz
+    b"\x1a\x45\xdf\xa3",  # webm
+    b"OggS",  # ogg
+)
+
+
+def is_compressed(path: Path) -> bool:
+    with open(path, "rb") as f:
+        header = f.read(12)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return True
+    return header.startswith(COMPRESSED_SIGNATURES)
+
+
+COMPRESSION_THREADS = config.getint(
+    "General", "export_compression_threads", fallback=os.cpu_count() or 1
+)
+# zlib releases the GIL while compressing, so threads are sufficient to use all cores
+compression_executor = ThreadPoolExecutor(
+    max_workers=COMPRESSION_THREADS, thread_name_prefix="pac-compress"
+)
+
+
+class ParallelGzipWriter:
+    """
+    Write-only file object that compresses everything written to it as gzip members of `BLOCK_SIZE` bytes.
+
+    The compressed members are passed to `sink` in the order they were written.
+    At most two members per compression thread are held in memory, `write` blocks until `sink` catches up.
+
+    Setting `store` starts a new member, all data written while it is set is stored without compression.
+    """
+
+    def __init__(self, sink: Callable[[bytes], object]) -> None:
+        self.sink = sink
+        self._store = False
+        self._buffer = bytearray()
+        self._offset = 0
+        self._pending: Deque[Future] = deque()
+        self._max_pending = 2 * COMPRESSION_THREADS
+
+    @property
+    def store(self) -> bool:
+        return self._store
+
+    @store.setter
+    def store(self, value: bool) -> None:
+        if value != self._store:
+            self._submit()
+            self._store = value
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._offset += len(data)
+        if len(self._buffer) >= BLOCK_SIZE:
+            self._submit()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def close(self) -> None:
+        self._submit()
+        while self._pending:
+            self.sink(self._pending.popleft().result())
+
+    def _submit(self) -> None:
+        if not self._buffer:
+            return
+        level = 0 if self._store else COMPRESSION_LEVEL
+        self._pending.append(
+            compression_executor.submit(
+                gzip.compress, bytes(self._buffer), level, mtime=0
+            )
+        )
+        self._buffer.clear()
+        while len(self._pending) > self._max_pending:
+            self.sink(self._pending.popleft().result())
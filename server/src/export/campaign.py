@@ -1,23 +1,28 @@
 import asyncio
+import json
 import os
 import secrets
 import shutil
 import tarfile
+import threading
 import uuid
 from functools import partial
 from io import BytesIO
+from pathlib import Path
 from time import time
-from typing import Dict, List, Optional, cast
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Type
+from weakref import WeakValueDictionary
 
-from playhouse.shortcuts import model_to_dict
+from peewee import AutoField
 from playhouse.sqlite_ext import SqliteExtDatabase
 
 from ..api.socket.constants import DASHBOARD_NS
 from ..app import sio
-from ..config import SAVE_FILE
+from ..assets import precompress, reuse_asset_file
 from ..logs import logger
 from ..models import ALL_MODELS
 from ..models.asset import Asset
+from ..models.base import BaseModel
 from ..models.campaign import (
     Floor,
     Layer,
@@ -54,10 +59,42 @@ from ..models.shape import (
 from ..models.typed import SelectSequence
 from ..models.user import User, UserOptions
 from ..save import SAVE_VERSION, upgrade_save
+from ..state.position import position_buffer
+from ..state.snapshot import snapshot_cache
 from ..utils import ASSETS_DIR, STATIC_DIR, TEMP_DIR
+from .archive import ParallelGzipWriter, is_compressed
+from .manifest import (
+    MANIFEST_NAME,
+    Manifest,
+    apply_delta,
+    create_manifest,
+    order_archives,
+    remove_unchanged,
+)
 
 debug_log = False
 
+# Number of archive blocks that can be waiting to be sent when streaming an export
+STREAM_QUEUE_SIZE = 8
+
+# Imports of the same user take turns, e.g. when a retried upload imports the same archive again
+_import_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
+
+# Tables whose rows get a new key when they are copied
+MAPPED_MODELS = (
+    Asset,
+    Floor,
+    Group,
+    Label,
+    Layer,
+    Location,
+    LocationOptions,
+    Room,
+    Shape,
+    User,
+    UserOptions,
+)
+
 
 async def export_campaign(
     filename: str,
@@ -65,11 +102,14 @@ async def export_campaign(
     *,
     sid: Optional[str] = None,
     export_all_assets=False,
+    base: Optional[Manifest] = None,
 ):
+    # The export reads the database directly, pending moves have to be written first
+    await position_buffer.flush()
     loop = asyncio.get_running_loop()
     task = loop.run_in_executor(
         None,
-        partial(__export_campaign, export_all_assets=export_all_assets),
+        partial(__export_campaign, export_all_assets=export_all_assets, base=base),
         filename,
         rooms,
     )
@@ -77,44 +117,130 @@ async def export_campaign(
     await sio.emit("Campaign.Export.Done", filename, room=sid, namespace=DASHBOARD_NS)
 
 
-async def import_campaign(user: User, pac: BytesIO):
+async def stream_campaign(
+    filename: str,
+    rooms: List[Room],
+    write: Callable[[bytes], Awaitable[None]],
+    *,
+    base: Optional[Manifest] = None,
+):
+    """Exports the rooms and passes the archive to `write` while it is being built."""
+    await position_buffer.flush()
     loop = asyncio.get_running_loop()
-    task = loop.run_in_executor(None, __import_campaign, user, pac)
-    await asyncio.wait([task])
+    queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
 
+    def sink(data: bytes):
+        if cancelled.is_set():
+            raise ExportCancelled()
+        asyncio.run_coroutine_threadsafe(queue.put(data), loop).result()
 
-def __export_campaign(name: str, rooms: List[Room], *, export_all_assets=False):
+    def export():
+        exporter = None
+        try:
+            # Concurrent downloads of the same campaign should not share the export database
+            exporter = CampaignExporter(
+                f"{filename}-{uuid.uuid4().hex}", rooms, base=base
+            )
+            exporter.pack(sink)
+        except ExportCancelled:
+            pass
+        finally:
+            if exporter is not None:
+                exporter.sqlite_path.unlink(missing_ok=True)
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    task = loop.run_in_executor(None, export)
     try:
-        CampaignExporter(name, rooms, export_all_assets=export_all_assets).pack()
+        while True:
+            data = await queue.get()
+            if data is None:
+                break
+            await write(data)
+    except:
+        cancelled.set()
+        # Unblock the export thread, so that it notices the cancellation
+        while await queue.get() is not None:
+            pass
+        raise
+    finally:
+        await task
+
+
+async def import_campaign(user: User, pacs: List[Path]):
+    loop = asyncio.get_running_loop()
+    lock = _import_locks.setdefault(user.id, asyncio.Lock())
+    async with lock:
+        await loop.run_in_executor(None, __import_campaign, user, pacs)
+
+
+def __export_campaign(
+    name: str,
+    rooms: List[Room],
+    *,
+    export_all_assets=False,
+    base: Optional[Manifest] = None,
+):
+    try:
+        CampaignExporter(
+            name, rooms, export_all_assets=export_all_assets, base=base
+        ).pack()
     except:
         logger.exception("Export Failed")
 
 
-def __import_campaign(user: User, pac: BytesIO):
+def __import_campaign(user: User, pacs: List[Path]):
     try:
-        CampaignImporter(user, pac)
+        CampaignImporter(user, pacs).migrate()
     except:
         logger.exception("Import Failed")
 
 
+class ExportCancelled(Exception):
+    pass
+
+
 class CampaignExporter:
     def __init__(
-        self, name: str, rooms: List[Room], *, export_all_assets=False
+        self,
+        name: str,
+        rooms: List[Room],
+        *,
+        export_all_assets=False,
+        base: Optional[Manifest] = None,
     ) -> None:
         self.filename = name
-        self.copy_name = TEMP_DIR / f"{str(uuid.uuid4())}.sqlite"
 
         self.generate_empty_db(rooms)
-        for room in self.migrator.rooms:
-            self.export_users(room)
-            self.migrator.migrate_room(room)
-            self.migrator.migrate_label_selections(room)
-            self.migrator.migrate_locations(room)
-            self.migrator.migrate_players(room)
-            self.migrator.migrate_notes(room)
-
-        if export_all_assets:
-            self.migrator.migrate_all_assets()
+        # The server database is only read within this transaction,
+        # so the export is a consistent snapshot even if the server is writing in the meantime.
+        with self.db.atomic():
+            for room in self.migrator.rooms:
+                self.export_users(room)
+                self.migrator.migrate_room(room)
+                self.migrator.migrate_label_selections(room)
+                self.migrator.migrate_locations(room)
+                self.migrator.migrate_players(room)
+                self.migrator.migrate_notes(room)
+
+            if export_all_assets:
+                self.migrator.migrate_all_assets()
+
+        self.manifest = create_manifest(self.db)
+        self.asset_files = self.manifest["assets"]
+        if base is not None:
+            if base["save_version"] != SAVE_VERSION:
+                logger.warning(
+                    "The base export has a different save version, exporting the complete campaign instead"
+                )
+            else:
+                remove_unchanged(self.db, self.manifest, base)
+                known_assets = set(base["assets"])
+                self.asset_files = [
+                    file_hash
+                    for file_hash in self.asset_files
+                    if file_hash not in known_assets
+                ]
 
     def generate_empty_db(self, rooms: List[Room]):
         self.output_folder = TEMP_DIR
@@ -127,8 +253,6 @@ class CampaignExporter:
         self.db = open_db(self.sqlite_path)
         self.db.foreign_keys = False
 
-        shutil.copyfile(SAVE_FILE, self.copy_name)
-
         # Base model creation
         with self.db.bind_ctx(ALL_MODELS):
             self.db.create_tables(ALL_MODELS)
@@ -138,13 +262,39 @@ class CampaignExporter:
                 secret_token=secrets.token_bytes(32),
                 api_token=secrets.token_hex(32),
             )
-            self.migrator = CampaignMigrator(open_db(self.copy_name), self.db, rooms)
+            # The keys of the server are kept, so that rows can be compared with those of earlier exports
+            self.migrator = CampaignMigrator(ACTIVE_DB, self.db, rooms, keep_keys=True)
 
-    def pack(self):
+    def pack(self, sink: Optional[Callable[[bytes], object]] = None):
+        """
+        Packs the manifest, the export database and the files of its assets into a .pac archive.
+
+        The archive is written to the temp folder, together with a copy of the manifest for later differential exports,
+        unless a `sink` is provided, which then receives the archive while it is being built.
+        """
+        self.migrator.close()
         self.db.close()
 
         tarname = f"{self.filename}.pac"
         tarpath = self.output_folder / tarname
+        manifest = json.dumps(self.manifest).encode()
+
+        if sink is None:
+            with open(tarpath, "wb") as f:
+                self.write_archive(f.write, manifest)
+            with open(self.output_folder / f"{self.filename}.manifest.json", "wb") as f:
+                f.write(manifest)
+        else:
+            self.write_archive(sink, manifest)
+
+        return tarpath, tarname
+
+    def write_archive(self, sink: Callable[[bytes], object], manifest: bytes):
+        # The manifest comes first, so that it can be read without decompressing the entire archive
+        manifest_info = tarfile.TarInfo(MANIFEST_NAME)
+        manifest_info.mode = 0o644
+        manifest_info.size = len(manifest)
+        manifest_info.mtime = time()  # type: ignore
 
         assets_dir_info = tarfile.TarInfo("assets")
         assets_dir_info.type = tarfile.DIRTYPE
@@ -156,81 +306,119 @@ class CampaignExporter:
         sqlite_info.size = self.sqlite_path.stat().st_size
         sqlite_info.mtime = time()  # type: ignore
 
-        try:
-            import bz2
-
-            write_mode = "w:bz2"
-        except ImportError:
-            write_mode = "w:gz"
-
-        with tarfile.open(tarpath, write_mode) as tar:
-            tar.addfile(sqlite_info, open(self.sqlite_path, "rb"))
+        writer = ParallelGzipWriter(sink)
+        with tarfile.open(fileobj=writer, mode="w") as tar:  # type: ignore
+            tar.addfile(manifest_info, BytesIO(manifest))
+            with open(self.sqlite_path, "rb") as f:
+                tar.addfile(sqlite_info, f)
             tar.addfile(assets_dir_info)
 
-            for asset_id in self.migrator.asset_mapping.keys():
-                asset: Asset = Asset[asset_id]
-                if not asset.file_hash:
-                    continue
+            for file_hash in self.asset_files:
                 try:
-                    file_path = ASSETS_DIR / asset.file_hash
+                    file_path = ASSETS_DIR / file_hash
                     info = tar.gettarinfo(str(file_path))
-                    info.name = f"assets/{asset.file_hash}"
+                    info.name = f"assets/{file_hash}"
                     info.mtime = time()  # type: ignore
                     info.mode = 0o755
-                    tar.addfile(info, open(file_path, "rb"))  # type: ignore
+                    writer.store = is_compressed(file_path)
+                    with open(file_path, "rb") as f:
+                        tar.addfile(info, f)
                 except FileNotFoundError:
                     pass
-
-        self.migrator.from_db.close()
-        self.copy_name.unlink()
-
-        return tarpath, tarname
+            writer.store = False
+        writer.close()
 
     def export_users(self, room: Room):
-        for player_room in room.players:
-            user = cast(User, player_room.player)
-            if user.id in self.migrator.user_mapping:
-                continue
-
-            user_data = model_to_dict(user, recurse=False)
-            user_options_data = model_to_dict(user.default_options, recurse=False)
-            del user_data["id"]
-            del user_options_data["id"]
-
-            with self.db.bind_ctx([UserOptions, User]):
-                uo = UserOptions.create(**user_options_data)
-                user_data["default_options"] = uo
-                new_user = User.create(**user_data)
-                new_user.set_password("PA_EXPORT")
-                new_user.save()
-                self.migrator.user_mapping[user.id] = new_user.id
-
-            self.migrator.migrate_labels(new_user.id, user.labels)
+        export_user = User()
+        export_user.set_password("PA_EXPORT")
+        self.migrator.migrate_users(room, export_user.password_hash)
 
 
 class CampaignImporter:
-    def __init__(self, user: User, pac: BytesIO) -> None:
+    def __init__(self, user: User, pacs: Sequence[Path]) -> None:
+        """
+        Unpacks the campaign in the archives, `migrate` then copies it into the server database.
+
+        These are a full export, optionally followed by differential exports based on it.
+        """
         print("Starting campaign import")
         self.root_user = user
         self.location_mapping: Dict[int, int] = {}
 
         self.target_db = ACTIVE_DB
 
-        self.unpack(pac)
-        # with self.migrator.to_db.atomic():
-        for room in self.migrator.rooms:
-            self.import_users(room)
-            self.migrator.migrate_room(room)
-            self.migrator.migrate_label_selections(room)
-            self.migrator.migrate_locations(room)
-            self.migrator.migrate_players(room)
-            self.migrator.migrate_notes(room)
+        self.db_path = TEMP_DIR / f"import-{uuid.uuid4().hex}.sqlite"
+        self.db = open_db(self.db_path)
+        try:
+            self.unpack(pacs)
+        except:
+            self.close()
+            raise
+
+    def migrate(self):
+        """
+        Copies the unpacked rooms into the server database.
+
+        This runs off the event loop, on the connection of the calling thread, every room is copied in its own transaction.
+        """
+        try:
+            self.migrator = CampaignMigrator(self.db, self.target_db)
+            try:
+                for room in self.migrator.rooms:
+                    # The mapping assigns ids after the current largest ids,
+                    # no other connection may write to the server database until the room is copied.
+                    with self.target_db.atomic("IMMEDIATE"):
+                        self.migrate_room(room)
+
+                # SQLite can reuse the ids of removed locations, make sure no cached data of an old location is served
+                for location_id in self.migrator.get_new_keys(Location):
+                    snapshot_cache.bump(location_id)
+            finally:
+                self.migrator.close()
+        finally:
+            self.close()
+            # The executor thread is shared, its connection is not needed after the import
+            self.target_db.close()
         print("Completed campaign import")
+
+    def migrate_room(self, room: Room):
+        self.import_users(room)
+        self.migrator.migrate_room(room)
+        self.migrator.migrate_label_selections(room)
+        self.migrator.migrate_locations(room)
+        self.migrator.migrate_players(room)
+        self.migrator.create_missing_location_user_options(room)
+        self.migrator.migrate_notes(room)
+
+    def close(self):
         self.db.close()
+        self.db_path.unlink(missing_ok=True)
+
+    def unpack(self, pacs: Sequence[Path]):
+        archives = order_archives(pacs)
+
+        self.extract(archives[0][0], self.db_path)
+        self.db.foreign_keys = False
 
-    def unpack(self, pac: BytesIO):
-        with tarfile.open(fileobj=pac, mode="r") as tar:
+        # Differential exports always have a manifest and follow the export they are based on
+        base = archives[0][1]
+        for pac, manifest in archives[1:]:
+            print(f"Applying differential export {pac.name}")
+            delta_path = TEMP_DIR / f"import-{uuid.uuid4().hex}.sqlite"
+            try:
+                self.extract(pac, delta_path)
+                apply_delta(self.db, delta_path, manifest, base)  # type: ignore
+            finally:
+                delta_path.unlink(missing_ok=True)
+            base = manifest
+
+        upgrade_save(self.db, is_import=True)
+
+    def extract(self, pac: Path, sqlite_path: Path):
+        """Extracts the assets of the archive that are not known yet and writes its database to `sqlite_path`."""
+        with tarfile.open(pac, mode="r") as tar:
             assets = []
+            found_sqlite = False
             for member in tar.getmembers():
                 # security checks
                 if member.islnk() or member.issym():
@@ -249,7 +437,7 @@ class CampaignImporter:
                     if len(filehash) % 2 != 0:
                         continue
 
-                    if (ASSETS_DIR / filehash).exists():
+                    if reuse_asset_file(filehash):
                         continue
 
                     assets.append(member)
@@ -257,18 +445,18 @@ class CampaignImporter:
                     sqlite_f = tar.extractfile(member)
                     if sqlite_f is None:
                         raise Exception("Faulty sqlite file")
-                    with open(TEMP_DIR / f"import-{member.name}", "wb") as f:
-                        f.write(sqlite_f.read())
-                    self.db = open_db(TEMP_DIR / f"import-{member.name}")
-                    self.db.foreign_keys = False
-
-                    upgrade_save(self.db, is_import=True)
+                    with open(sqlite_path, "wb") as f:
+                        shutil.copyfileobj(sqlite_f, f)
+                    found_sqlite = True
 
-                    self.migrator = CampaignMigrator(self.db, ACTIVE_DB)
+            if not found_sqlite:
+                raise Exception(f"No campaign database in {pac.name}")
 
             if len(assets) > 0:
                 print(f"Extracting {len(assets)} asset(s)")
                 tar.extractall(path=STATIC_DIR, members=assets)
+                for member in assets:
+                    precompress(member.name[len("assets/") :])
 
     def import_users(self, room: Room):
         # Different modes should be available
@@ -279,483 +467,512 @@ class CampaignImporter:
         # ideally this becomes a multi-step UI heavy thing
         # where user options can also be diffed etc (user default_options todo!)
         # todo: Labels
-        with self.db.bind_ctx([Room, User]):
-            creator = cast(User, room.creator)
-            self.migrator.user_mapping[creator.id] = self.root_user.id
-
-            with self.migrator.from_db.bind_ctx([Room, User, Label]):
-                self.migrator.migrate_labels(self.root_user.id, room.creator.labels)
+        self.migrator.map_user(room.creator_id, self.root_user.id)
+        self.migrator.migrate_labels(room.creator_id)
 
 
 class CampaignMigrator:
+    """
+    Copies campaigns from one database into another.
+
+    The source database is attached to the connection of the target database
+    and every table is copied with a single INSERT ... SELECT per room,
+    so the time taken depends on the number of tables rather than the number of rows.
+
+    New keys are assigned up front in temporary mapping tables (`temp.map_<table>`),
+    which the copies join against to rewrite their references.
+    Every mapping is tagged with a batch, so that each copy only inserts the rows that were mapped for it.
+
+    With `keep_keys` all rows keep their key instead, which requires the target database to be empty.
+    """
+
     def __init__(
         self,
         from_db: SqliteExtDatabase,
         to_db: SqliteExtDatabase,
         rooms: Optional[List[Room]] = None,
+        *,
+        keep_keys=False,
     ) -> None:
         self.from_db = from_db
         self.to_db = to_db
         self.rooms = rooms if rooms else self.__rooms
+        self.keep_keys = keep_keys
 
-        self.asset_mapping: Dict[int, int] = {}
-        self.aura_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.group_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.label_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.layer_mapping: Dict[int, int] = {}
-        self.location_mapping: Dict[int, int] = {}
-        self.note_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.room_mapping: Dict[int, int] = {}
-        self.shape_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.tracker_mapping: Dict[uuid.UUID, uuid.UUID] = {}
-        self.user_mapping: Dict[int, int] = {}
+        self._batch = 0
+
+        connection = self.to_db.connection()
+        connection.create_function("new_uuid", 0, lambda: str(uuid.uuid4()))
+        self._execute("ATTACH DATABASE ? AS src", (str(self.from_db.database),))
+        for model in MAPPED_MODELS:
+            self._execute(
+                f'CREATE TEMP TABLE "map_{model._meta.table_name}" (old PRIMARY KEY, new, batch)'
+            )
 
     @property
     def __rooms(self) -> SelectSequence[Room]:
         with self.from_db.bind_ctx([Room]):
             return Room.select()
 
-    def migrate_asset(self, asset_id: int) -> Optional[int]:
-        if asset_id in self.asset_mapping:
-            return self.asset_mapping[asset_id]
+    def close(self):
+        for model in MAPPED_MODELS:
+            self._execute(f'DROP TABLE temp."map_{model._meta.table_name}"')
+        self._execute("DETACH DATABASE src")
 
-        with self.from_db.bind_ctx([Asset]):
-            try:
-                asset = Asset.get_by_id(asset_id)
-            except Asset.DoesNotExist:
-                return None
-
-            asset_data = model_to_dict(asset, recurse=False)
-            del asset_data["id"]
-            asset_data["owner"] = self.user_mapping[asset_data["owner"]]
-
-            if asset.parent is not None:
-                self.migrate_asset(asset_data["parent"])
-                asset_data["parent"] = self.asset_mapping[asset_data["parent"]]
-
-        with self.to_db.bind_ctx([Asset]):
-            asset = Asset.create(**asset_data)
-            self.asset_mapping[asset_id] = asset.id
-        return asset.id
+    def get_new_keys(self, model: Type[BaseModel]) -> List[Any]:
+        return [
+            key
+            for (key,) in self.to_db.execute_sql(
+                f'SELECT new FROM temp."map_{model._meta.table_name}"'
+            )
+        ]
+
+    def _execute(self, sql: str, params: Sequence[Any] = ()):
+        self.to_db.execute_sql(sql, params)
+
+    def _map(self, model: Type[BaseModel], keys: str, params: Sequence[Any] = ()):
+        """
+        Assigns new keys to the rows selected by the `keys` query, which has to select a single `old` column.
+
+        Rows that were already mapped keep their mapping.
+        Returns the batch of the new mappings.
+        """
+        self._batch += 1
+        table = model._meta.table_name
+        if self.keep_keys:
+            new_key = "k.old"
+        elif isinstance(model._meta.primary_key, AutoField):
+            # New rows are appended after the existing rows of the target table
+            new_key = f'(SELECT IFNULL(MAX(id), 0) FROM main."{table}") + ROW_NUMBER() OVER (ORDER BY k.old)'
+        else:
+            new_key = "new_uuid()"
+        self._execute(
+            f'INSERT OR IGNORE INTO temp."map_{table}" (old, new, batch) '
+            f"SELECT k.old, {new_key}, {self._batch} FROM ({keys}) AS k WHERE k.old IS NOT NULL",
+            params,
+        )
+        return self._batch
+
+    def _insert(
+        self,
+        model: Type[BaseModel],
+        source: str,
+        params: Sequence[Any] = (),
+        **values: str,
+    ):
+        """
+        Inserts the rows selected by `source`, a FROM clause aliasing the source table as `t`.
+
+        Columns are copied as is, unless an SQL expression is provided for them in `values`.
+        Auto incremented ids that are not provided are assigned by the target database, unless keys are kept.
+        """
+        columns = []
+        expressions = []
+        for field in model._meta.sorted_fields:
+            column = field.column_name
+            if column in values:
+                expressions.append(values[column])
+            elif isinstance(field, AutoField) and not self.keep_keys:
+                continue
+            else:
+                expressions.append(f't."{column}"')
+            columns.append(f'"{column}"')
+        self._execute(
+            f'INSERT INTO main."{model._meta.table_name}" ({", ".join(columns)}) '
+            f'SELECT {", ".join(expressions)} {source}',
+            params,
+        )
+
+    def _copy(self, model: Type[BaseModel], batch: int, **values: str):
+        """Inserts the rows of `model` that were mapped in `batch` under their new key."""
+        table = model._meta.table_name
+        key = model._meta.primary_key.column_name
+        values.setdefault(key, "m.new")
+        self._insert(
+            model,
+            f'FROM temp."map_{table}" AS m JOIN src."{table}" AS t ON t."{key}" = m.old WHERE m.batch = ?',
+            (batch,),
+            **values,
+        )
+
+    def _new_uuid(self, column: str) -> str:
+        """SQL expression for a uuid column that is not referenced by other tables, these are regenerated unless keys are kept."""
+        return f't."{column}"' if self.keep_keys else "new_uuid()"
+
+    def map_user(self, user_id: int, new_user_id: int):
+        self._execute(
+            "INSERT OR REPLACE INTO temp.map_user (old, new, batch) VALUES (?, ?, 0)",
+            (user_id, new_user_id),
+        )
+
+    def migrate_assets(self, keys: str, params: Sequence[Any] = ()):
+        """Copies the assets selected by the `keys` query together with the folders they are in."""
+        batch = self._map(
+            Asset,
+            f"""
+            WITH RECURSIVE needed(id) AS (
+                {keys}
+                UNION SELECT a.parent_id FROM src.asset AS a JOIN needed AS n ON a.id = n.id
+            )
+            SELECT a.id AS old FROM needed AS n
+            JOIN src.asset AS a ON a.id = n.id
+            JOIN temp.map_user AS u ON u.old = a.owner_id
+            """,
+            params,
+        )
+        self._copy(
+            Asset,
+            batch,
+            owner_id=_mapped(User, "owner_id"),
+            parent_id=_mapped(Asset, "parent_id"),
+        )
 
     def migrate_all_assets(self):
-        with self.from_db.bind_ctx([Asset]):
-            for asset in Asset.filter(owner=self.rooms[0].creator):
-                self.migrate_asset(asset.id)
-
-    def migrate_labels(self, new_user_id: int, labels: List[Label]):
-        with self.from_db.bind_ctx([Label]):
-            for label in labels:
-                label_data = model_to_dict(label, recurse=False)
-                label_data["user"] = new_user_id
-                new_uuid = uuid.uuid4()
-                self.label_mapping[label_data["uuid"]] = new_uuid
-                label_data["uuid"] = new_uuid
-
-                with self.to_db.bind_ctx([Label]):
-                    Label.create(**label_data)
+        self.migrate_assets(
+            "SELECT id AS old FROM src.asset WHERE owner_id = ?",
+            (self.rooms[0].creator_id,),
+        )
+
+    def migrate_users(self, room: Room, password_hash: str):
+        """Copies the players of the room and their labels, all their passwords are replaced by `password_hash`."""
+        players = """
+            FROM src.player_room AS t
+            JOIN src.user AS u ON u.id = t.player_id
+            WHERE t.room_id = ?
+        """
+        options = self._map(
+            UserOptions, f"SELECT u.default_options_id AS old {players}", (room.id,)
+        )
+        self._copy(UserOptions, options)
+
+        users = self._map(User, f"SELECT u.id AS old {players}", (room.id,))
+        self._copy(
+            User,
+            users,
+            default_options_id=_mapped(UserOptions, "default_options_id"),
+        )
+        self._execute(
+            "UPDATE main.user SET password_hash = ? WHERE id IN (SELECT new FROM temp.map_user WHERE batch = ?)",
+            (password_hash, users),
+        )
+
+        labels = self._map(
+            Label,
+            """
+            SELECT t.uuid AS old FROM src.label AS t
+            JOIN temp.map_user AS u ON u.old = t.user_id
+            WHERE u.batch = ?
+            """,
+            (users,),
+        )
+        self._copy(Label, labels, user_id=_mapped(User, "user_id"))
+
+    def migrate_labels(self, user_id: int):
+        batch = self._map(
+            Label, "SELECT uuid AS old FROM src.label WHERE user_id = ?", (user_id,)
+        )
+        self._copy(Label, batch, user_id=_mapped(User, "user_id"))
 
     def migrate_room(self, room: Room):
         if debug_log:
             print(f"[ROOM] {room.name}")
-        with self.from_db.bind_ctx([LocationOptions, Room]):
-            room_options_data = model_to_dict(room.default_options, recurse=False)
-            del room_options_data["id"]
-
-            room_data = model_to_dict(room, recurse=False)
-            del room_data["id"]
-
-        with self.to_db.bind_ctx([LocationOptions, Room]):
-            lo = LocationOptions.create(**room_options_data)
-
-            room_data["creator"] = self.user_mapping[room_data["creator"]]
-            room_data["default_options"] = lo
-            room_data["logo"] = self.migrate_asset(room_data["logo"])
-            room_data["invitation_code"] = uuid.uuid4()
-
-            self.room_mapping[room.id] = Room.create(**room_data).id
+        options = self._map(
+            LocationOptions,
+            "SELECT default_options_id AS old FROM src.room WHERE id = ?",
+            (room.id,),
+        )
+        self._copy(LocationOptions, options)
+
+        self.migrate_assets(
+            "SELECT logo_id AS old FROM src.room WHERE id = ?", (room.id,)
+        )
+
+        batch = self._map(
+            Room, "SELECT id AS old FROM src.room WHERE id = ?", (room.id,)
+        )
+        self._copy(
+            Room,
+            batch,
+            creator_id=_mapped(User, "creator_id"),
+            invitation_code="new_uuid()",
+            default_options_id=_mapped(LocationOptions, "default_options_id"),
+            logo_id=_mapped(Asset, "logo_id"),
+        )
 
     def migrate_label_selections(self, room: Room):
-        with self.from_db.bind_ctx([LabelSelection]):
-            for label_selection in LabelSelection.filter(room=room):
-                label_selection_data = model_to_dict(label_selection, recurse=False)
-                del label_selection_data["id"]
-                target_user = self.user_mapping.get(label_selection_data["user"])
-                if target_user is None:
-                    continue
-                label_selection_data["label"] = self.label_mapping[
-                    label_selection_data["label"]
-                ]
-                label_selection_data["user"] = target_user
-                label_selection_data["room"] = self.room_mapping[room.id]
-
-                with self.to_db.bind_ctx([LabelSelection]):
-                    LabelSelection.create(**label_selection_data)
+        self._insert(
+            LabelSelection,
+            """
+            FROM src.label_selection AS t
+            JOIN temp.map_user AS u ON u.old = t.user_id
+            JOIN temp.map_label AS l ON l.old = t.label_id
+            WHERE t.room_id = ?
+            """,
+            (room.id,),
+            label_id="l.new",
+            user_id="u.new",
+            room_id=_mapped(Room, "room_id"),
+        )
 
     def migrate_locations(self, room: Room):
-        with self.from_db.bind_ctx([Location, LocationOptions]):
-            for location in room.locations:
-                if debug_log:
-                    print(f" [LOC] {location.name}")
-                location_data = model_to_dict(location, recurse=False)
-                del location_data["id"]
-                location_data["room"] = self.room_mapping[room.id]
-
-                location_options_data = None
-                if location.options:
-                    location_options_data = model_to_dict(
-                        location.options, recurse=False
-                    )
-                    del location_options_data["id"]
-
-                # signals trigger on this, so to be sure we bind extra
-                with self.to_db.bind_ctx(
-                    [Location, LocationOptions, PlayerRoom, Room, User]
-                ):
-                    if location_options_data:
-                        lo = LocationOptions.create(**location_options_data)
-                        location_data["options"] = lo
-                    new_location = Location.create(**location_data).id
-                    self.location_mapping[location.id] = new_location
-
-                self.migrate_floors(new_location, location.floors)
-
-                if len(location.initiative) > 0:
-                    self.migrate_initiative(new_location, location.initiative[0])
-
-                self.migrate_location_user_options(new_location, location.user_options)
-                self.migrate_markers(new_location, location.markers)
-
-    def migrate_floors(self, location_id: int, floors: SelectSequence[Floor]):
-        with self.from_db.bind_ctx([Floor]):
-            for floor in floors:
-                if debug_log:
-                    print(f"  [FL] {floor.name}")
-                floor_data = model_to_dict(floor, recurse=False)
-                del floor_data["id"]
-                floor_data["location"] = location_id
-
-                with self.to_db.bind_ctx([Floor]):
-                    new_floor = Floor.create(**floor_data)
-
-                self.migrate_layers(new_floor.id, floor.layers)
-
-    def migrate_layers(self, floor_id: int, layers: SelectSequence[Layer]):
-        with self.from_db.bind_ctx([Layer]):
-            for layer in layers:
-                if debug_log:
-                    print(f"   [LAY] {layer.name}")
-                layer_data = model_to_dict(layer, recurse=False)
-                del layer_data["id"]
-                layer_data["floor"] = floor_id
-
-                with self.to_db.bind_ctx([Layer]):
-                    new_layer = Layer.create(**layer_data)
-                    self.layer_mapping[layer.id] = new_layer.id
-
-                self.migrate_shapes(new_layer.id, layer.shapes)
-
-    def migrate_shapes(self, layer_id: int, shapes: SelectSequence[Shape]):
-        with self.from_db.bind_ctx([Shape]):
-            for shape in shapes:
-                shape_data = model_to_dict(shape, recurse=False)
-                new_uuid = uuid.uuid4()
-                self.shape_mapping[shape_data["uuid"]] = new_uuid
-                shape_data["uuid"] = new_uuid
-                shape_data["layer"] = layer_id
-                if shape_data["asset"]:
-                    shape_data["asset"] = self.migrate_asset(shape_data["asset"])
-                if shape_data["group"]:
-                    shape_data["group"] = self.migrate_group(shape_data["group"])
-
-                with self.to_db.bind_ctx([Shape]):
-                    Shape.create(**shape_data)
-
-                self.migrate_shape_labels(shape.labels)
-                self.migrate_trackers(shape.trackers)
-                self.migrate_auras(shape.auras)
-                self.migrate_shape_owners(shape.owners)
-                self.migrate_assetrect(shape.assetrect_set)
-                self.migrate_circle(shape.circle_set)
-                self.migrate_circulartoken(shape.circulartoken_set)
-                self.migrate_line(shape.line_set)
-                self.migrate_polygon(shape.polygon_set)
-                self.migrate_rect(shape.rect_set)
-                self.migrate_text(shape.text_set)
-                self.migrate_togglecomposite(shape.togglecomposite_set)
-                self.migrate_composite_shape_associations(shape.shape_variants)
-
-    def migrate_group(self, group_id: str):
-        if group_id in self.group_mapping:
-            return self.group_mapping[group_id]
-
-        with self.from_db.bind_ctx([Group]):
-            group = Group.get_by_id(group_id)
-            group_data = model_to_dict(group, recurse=False)
-            new_uuid = uuid.uuid4()
-            self.group_mapping[group_data["uuid"]] = new_uuid
-            group_data["uuid"] = new_uuid
-
-        with self.to_db.bind_ctx([Group]):
-            Group.create(**group_data)
-
-        return new_uuid
-
-    def migrate_shape_labels(self, labels: SelectSequence[ShapeLabel]):
-        with self.from_db.bind_ctx([ShapeLabel]):
-            for label in labels:
-                label_data = model_to_dict(label, recurse=False)
-                del label_data["id"]
-                label_data["shape"] = self.shape_mapping[label_data["shape"]]
-                label_data["label"] = self.label_mapping[label_data["label"]]
-
-                with self.to_db.bind_ctx([ShapeLabel]):
-                    ShapeLabel.create(**label_data)
-
-    def migrate_trackers(self, trackers: SelectSequence[Tracker]):
-        with self.from_db.bind_ctx([Tracker]):
-            for tracker in trackers:
-                tracker_data = model_to_dict(tracker, recurse=False)
-                new_uuid = uuid.uuid4()
-                self.tracker_mapping[tracker_data["uuid"]] = new_uuid
-                tracker_data["uuid"] = new_uuid
-                tracker_data["shape"] = self.shape_mapping[tracker_data["shape"]]
-
-                with self.to_db.bind_ctx([Tracker]):
-                    Tracker.create(**tracker_data)
-
-    def migrate_auras(self, auras: SelectSequence[Aura]):
-        with self.from_db.bind_ctx([Aura]):
-            for aura in auras:
-                aura_data = model_to_dict(aura, recurse=False)
-                new_uuid = uuid.uuid4()
-                self.aura_mapping[aura_data["uuid"]] = new_uuid
-                aura_data["uuid"] = new_uuid
-                aura_data["shape"] = self.shape_mapping[aura_data["shape"]]
-
-                with self.to_db.bind_ctx([Aura]):
-                    Aura.create(**aura_data)
-
-    def migrate_shape_owners(self, owners: SelectSequence[ShapeOwner]):
-        with self.from_db.bind_ctx([ShapeOwner]):
-            for owner in owners:
-                owner_data = model_to_dict(owner, recurse=False)
-                del owner_data["id"]
-                owner_data["shape"] = self.shape_mapping[owner_data["shape"]]
-                owner_data["user"] = self.user_mapping.get(owner_data["user"])
-                if owner_data["user"] is None:
-                    continue
-
-                with self.to_db.bind_ctx([ShapeOwner]):
-                    ShapeOwner.create(**owner_data)
-
-    def migrate_composite_shape_associations(
-        self, associations: SelectSequence[CompositeShapeAssociation]
-    ):
-        with self.from_db.bind_ctx([CompositeShapeAssociation]):
-            for association in associations:
-                association_data = model_to_dict(association, recurse=False)
-                del association_data["id"]
-                association_data["variant"] = self.shape_mapping.get(
-                    association_data["variant"]
-                )
-                association_data["parent"] = self.shape_mapping.get(
-                    association_data["parent"]
-                )
-                if (
-                    association_data["variant"] is None
-                    or association_data["parent"] is None
-                ):
-                    continue
-
-                with self.to_db.bind_ctx([CompositeShapeAssociation]):
-                    CompositeShapeAssociation.create(**association_data)
-
-    def migrate_assetrect(self, rects: SelectSequence[AssetRect]):
-        with self.from_db.bind_ctx([AssetRect]):
-            for rect in rects:
-                rect_data = model_to_dict(rect, recurse=False)
-                rect_data["shape"] = self.shape_mapping[rect_data["shape"]]
-
-                with self.to_db.bind_ctx([AssetRect]):
-                    AssetRect.create(**rect_data)
-
-    def migrate_circle(self, circles: SelectSequence[Circle]):
-        with self.from_db.bind_ctx([Circle]):
-            for circle in circles:
-                circle_data = model_to_dict(circle, recurse=False)
-                circle_data["shape"] = self.shape_mapping[circle_data["shape"]]
-
-                with self.to_db.bind_ctx([Circle]):
-                    Circle.create(**circle_data)
-
-    def migrate_circulartoken(self, circulartokens: SelectSequence[CircularToken]):
-        with self.from_db.bind_ctx([CircularToken]):
-            for circulartoken in circulartokens:
-                circulartoken_data = model_to_dict(circulartoken, recurse=False)
-                circulartoken_data["shape"] = self.shape_mapping[
-                    circulartoken_data["shape"]
-                ]
-
-                with self.to_db.bind_ctx([CircularToken]):
-                    CircularToken.create(**circulartoken_data)
-
-    def migrate_line(self, lines: SelectSequence[Line]):
-        with self.from_db.bind_ctx([Line]):
-            for line in lines:
-                line_data = model_to_dict(line, recurse=False)
-                line_data["shape"] = self.shape_mapping[line_data["shape"]]
-
-                with self.to_db.bind_ctx([Line]):
-                    Line.create(**line_data)
-
-    def migrate_polygon(self, polygons: SelectSequence[Polygon]):
-        with self.from_db.bind_ctx([Polygon]):
-            for polygon in polygons:
-                polygon_data = model_to_dict(polygon, recurse=False)
-                polygon_data["shape"] = self.shape_mapping[polygon_data["shape"]]
-
-                with self.to_db.bind_ctx([Polygon]):
-                    Polygon.create(**polygon_data)
-
-    def migrate_rect(self, rects: SelectSequence[Rect]):
-        with self.from_db.bind_ctx([Rect]):
-            for rect in rects:
-                rect_data = model_to_dict(rect, recurse=False)
-                rect_data["shape"] = self.shape_mapping[rect_data["shape"]]
-
-                with self.to_db.bind_ctx([Rect]):
-                    Rect.create(**rect_data)
-
-    def migrate_text(self, texts: SelectSequence[Text]):
-        with self.from_db.bind_ctx([Text]):
-            for text in texts:
-                text_data = model_to_dict(text, recurse=False)
-                text_data["shape"] = self.shape_mapping[text_data["shape"]]
-
-                with self.to_db.bind_ctx([Text]):
-                    Text.create(**text_data)
-
-    def migrate_togglecomposite(
-        self, togglecomposites: SelectSequence[ToggleComposite]
-    ):
-        with self.from_db.bind_ctx([ToggleComposite]):
-            for togglecomposite in togglecomposites:
-                togglecomposite_data = model_to_dict(togglecomposite, recurse=False)
-                togglecomposite_data["shape"] = self.shape_mapping[
-                    togglecomposite_data["shape"]
-                ]
-                togglecomposite_data["active_variant"] = self.shape_mapping[
-                    togglecomposite_data["active_variant"]
-                ]
-
-                with self.to_db.bind_ctx([ToggleComposite]):
-                    ToggleComposite.create(**togglecomposite_data)
-
-    def migrate_initiative(self, location_id: int, initiative: Initiative):
-        with self.from_db.bind_ctx([Initiative]):
-            initiative_data = model_to_dict(initiative, recurse=False)
-            del initiative_data["id"]
-            initiative_data["location"] = location_id
-
-            with self.to_db.bind_ctx([Initiative]):
-                Initiative.create(**initiative_data)
-
-    def migrate_location_user_options(
-        self, new_location_id: int, user_options: List[LocationUserOption]
-    ):
-        with self.from_db.bind_ctx([LocationUserOption]):
-            for user_option in user_options:
-                user_option_data = model_to_dict(user_option, recurse=False)
-
-                user = self.user_mapping.get(user_option_data["user"])
-                if user is None:
-                    continue
-
-                del user_option_data["id"]
-                user_option_data["location"] = new_location_id
-                user_option_data["user"] = user
-                if user_option_data["active_layer"]:
-                    user_option_data["active_layer"] = self.layer_mapping[
-                        user_option_data["active_layer"]
-                    ]
-
-                with self.to_db.bind_ctx([LocationUserOption]):
-                    q = LocationUserOption.select().where(
-                        (LocationUserOption.location == new_location_id)
-                        & (LocationUserOption.user == user)
-                    )
-                    if q.exists():
-                        q[0].update(**user_option_data).where(
-                            (LocationUserOption.location == new_location_id)
-                            & (LocationUserOption.user == user)
-                        ).execute()
-                    else:
-                        LocationUserOption.create(**user_option_data)
-
-    def migrate_markers(self, new_location_id: int, markers: SelectSequence[Marker]):
-        with self.from_db.bind_ctx([Marker]):
-            for marker in markers:
-                marker_data = model_to_dict(marker, recurse=False)
-
-                user = self.user_mapping.get(marker_data["user"])
-                if user is None:
-                    continue
-
-                del marker_data["id"]
-                marker_data["location"] = new_location_id
-                marker_data["user"] = user
-                marker_data["shape"] = self.shape_mapping.get(marker_data["shape"])
-                if marker_data["shape"] is None:
-                    # Technically possible, but not intended
-                    # This happens when a marker is set to shape that is later moved to a different location
-                    continue
+        options = self._map(
+            LocationOptions,
+            "SELECT options_id AS old FROM src.location WHERE room_id = ?",
+            (room.id,),
+        )
+        self._copy(LocationOptions, options)
+
+        locations = self._map(
+            Location, "SELECT id AS old FROM src.location WHERE room_id = ?", (room.id,)
+        )
+        self._copy(
+            Location,
+            locations,
+            room_id=_mapped(Room, "room_id"),
+            options_id=_mapped(LocationOptions, "options_id"),
+        )
+
+        floors = self.migrate_floors(locations)
+        layers = self.migrate_layers(floors)
+        self.migrate_shapes(layers)
+
+        self.migrate_initiatives(locations)
+        self.migrate_location_user_options(locations)
+        self.migrate_markers(locations)
+
+    def migrate_floors(self, locations: int):
+        batch = self._map(
+            Floor,
+            """
+            SELECT t.id AS old FROM src.floor AS t
+            JOIN temp.map_location AS l ON l.old = t.location_id
+            WHERE l.batch = ?
+            """,
+            (locations,),
+        )
+        self._copy(Floor, batch, location_id=_mapped(Location, "location_id"))
+        return batch
+
+    def migrate_layers(self, floors: int):
+        batch = self._map(
+            Layer,
+            """
+            SELECT t.id AS old FROM src.layer AS t
+            JOIN temp.map_floor AS f ON f.old = t.floor_id
+            WHERE f.batch = ?
+            """,
+            (floors,),
+        )
+        self._copy(Layer, batch, floor_id=_mapped(Floor, "floor_id"))
+        return batch
+
+    def migrate_shapes(self, layers: int):
+        batch = self._map(
+            Shape,
+            """
+            SELECT t.uuid AS old FROM src.shape AS t
+            JOIN temp.map_layer AS l ON l.old = t.layer_id
+            WHERE l.batch = ?
+            """,
+            (layers,),
+        )
+
+        groups = self._map(
+            Group,
+            """
+            SELECT DISTINCT t.group_id AS old FROM src.shape AS t
+            JOIN temp.map_shape AS m ON m.old = t.uuid
+            WHERE m.batch = ?
+            """,
+            (batch,),
+        )
+        self._copy(Group, groups)
+
+        self.migrate_assets(
+            """
+            SELECT t.asset_id AS old FROM src.shape AS t
+            JOIN temp.map_shape AS m ON m.old = t.uuid
+            WHERE m.batch = ?
+            """,
+            (batch,),
+        )
+
+        self._copy(
+            Shape,
+            batch,
+            layer_id=_mapped(Layer, "layer_id"),
+            asset_id=_mapped(Asset, "asset_id"),
+            group_id=_mapped(Group, "group_id"),
+        )
+
+        # All tables that only belong to a single shape
+        shape_rows = """
+            FROM src."{table}" AS t
+            JOIN temp.map_shape AS m ON m.old = t.shape_id
+            {joins}
+            WHERE m.batch = ?
+        """
+        for model, joins, values in (
+            (
+                ShapeLabel,
+                "JOIN temp.map_label AS l ON l.old = t.label_id",
+                {"label_id": "l.new"},
+            ),
+            (Tracker, "", {"uuid": self._new_uuid("uuid")}),
+            (Aura, "", {"uuid": self._new_uuid("uuid")}),
+            (
+                ShapeOwner,
+                "JOIN temp.map_user AS u ON u.old = t.user_id",
+                {"user_id": "u.new"},
+            ),
+            (AssetRect, "", {}),
+            (Circle, "", {}),
+            (CircularToken, "", {}),
+            (Line, "", {}),
+            (Polygon, "", {}),
+            (Rect, "", {}),
+            (Text, "", {}),
+            (
+                ToggleComposite,
+                "",
+                {"active_variant": _mapped(Shape, "active_variant")},
+            ),
+        ):
+            self._insert(
+                model,
+                shape_rows.format(table=model._meta.table_name, joins=joins),
+                (batch,),
+                shape_id="m.new",
+                **values,
+            )
 
-                with self.to_db.bind_ctx([Marker]):
-                    Marker.create(**marker_data)
+        self._insert(
+            CompositeShapeAssociation,
+            """
+            FROM src.composite_shape_association AS t
+            JOIN temp.map_shape AS m ON m.old = t.parent_id
+            JOIN temp.map_shape AS v ON v.old = t.variant_id
+            WHERE m.batch = ?
+            """,
+            (batch,),
+            parent_id="m.new",
+            variant_id="v.new",
+        )
+
+        return batch
+
+    def migrate_initiatives(self, locations: int):
+        self._insert(
+            Initiative,
+            """
+            FROM src.initiative AS t
+            JOIN temp.map_location AS l ON l.old = t.location_id
+            WHERE l.batch = ?
+            AND t.id IN (SELECT MIN(id) FROM src.initiative GROUP BY location_id)
+            """,
+            (locations,),
+            location_id="l.new",
+        )
+
+    def migrate_location_user_options(self, locations: int):
+        self._insert(
+            LocationUserOption,
+            """
+            FROM src.location_user_option AS t
+            JOIN temp.map_location AS l ON l.old = t.location_id
+            JOIN temp.map_user AS u ON u.old = t.user_id
+            WHERE l.batch = ?
+            """,
+            (locations,),
+            location_id="l.new",
+            user_id="u.new",
+            active_layer_id=_mapped(Layer, "active_layer_id"),
+        )
+
+    def migrate_markers(self, locations: int):
+        # Markers on shapes that have not been copied are skipped
+        # This happens when a marker is set to shape that is later moved to a different location
+        self._insert(
+            Marker,
+            """
+            FROM src.marker AS t
+            JOIN temp.map_location AS l ON l.old = t.location_id
+            JOIN temp.map_user AS u ON u.old = t.user_id
+            JOIN temp.map_shape AS s ON s.old = t.shape_id
+            WHERE l.batch = ?
+            """,
+            (locations,),
+            location_id="l.new",
+            user_id="u.new",
+            shape_id="s.new",
+        )
 
     def migrate_players(self, room: Room):
-        with self.from_db.bind_ctx([PlayerRoom, User, UserOptions]):
-            for player_room in room.players:
-                if player_room.player.id not in self.user_mapping:
-                    continue
-
-                player_data = model_to_dict(player_room, recurse=False)
-                del player_data["id"]
-
-                player_options_data = None
-                if player_room.user_options:
-                    player_options_data = model_to_dict(
-                        player_room.user_options, recurse=False
-                    )
-                    del player_options_data["id"]
-
-                player_data["room"] = self.room_mapping[room.id]
-                player_data["player"] = self.user_mapping[player_data["player"]]
-                player_data["active_location"] = self.location_mapping[
-                    player_data["active_location"]
-                ]
-
-                with self.to_db.bind_ctx([PlayerRoom, UserOptions]):
-                    if player_options_data:
-                        player_data["user_options"] = UserOptions.create(
-                            **player_options_data
-                        )
-                    PlayerRoom.create(**player_data)
+        players = """
+            FROM src.player_room AS t
+            JOIN temp.map_user AS u ON u.old = t.player_id
+            WHERE t.room_id = ?
+        """
+        options = self._map(
+            UserOptions, f"SELECT t.user_options_id AS old {players}", (room.id,)
+        )
+        self._copy(UserOptions, options)
+
+        self._insert(
+            PlayerRoom,
+            players,
+            (room.id,),
+            player_id="u.new",
+            room_id=_mapped(Room, "room_id"),
+            active_location_id=_mapped(Location, "active_location_id"),
+            user_options_id=_mapped(UserOptions, "user_options_id"),
+        )
+
+    def create_missing_location_user_options(self, room: Room):
+        """
+        Every player of a room has options for every location of the room.
+
+        These are normally created by the model signals, which are not triggered by the bulk copies.
+        Only imports create them, in an export the created rows would not have a stable key.
+        """
+        missing = self.to_db.execute_sql(
+            """
+            SELECT l.id, p.user_id FROM main.location AS l
+            JOIN (
+                SELECT room_id, player_id AS user_id FROM main.player_room
+                UNION SELECT id, creator_id FROM main.room
+            ) AS p ON p.room_id = l.room_id
+            WHERE l.room_id = (SELECT new FROM temp.map_room WHERE old = ?)
+            AND NOT EXISTS (
+                SELECT 1 FROM main.location_user_option AS o
+                WHERE o.location_id = l.id AND o.user_id = p.user_id
+            )
+            """,
+            (room.id,),
+        ).fetchall()
+        if not missing:
+            return
+        with self.to_db.bind_ctx([LocationUserOption]):
+            LocationUserOption.insert_many(
+                [{"location": location, "user": user} for location, user in missing]
+            ).execute()
 
     def migrate_notes(self, room: Room):
-        with self.from_db.bind_ctx([Note]):
-            for note in Note.filter(room=room):
-                note_data = model_to_dict(note, recurse=False)
-                new_uuid = uuid.uuid4()
-                self.note_mapping[note_data["uuid"]] = new_uuid
-                note_data["uuid"] = new_uuid
-                note_data["room"] = self.room_mapping[room.id]
-                note_data["user"] = self.user_mapping.get(note_data["user"])
-                if note_data["user"] is None:
-                    continue
-                if note_data["location"]:
-                    note_data["location"] = self.location_mapping[note_data["location"]]
-
-                with self.to_db.bind_ctx([Note]):
-                    Note.create(**note_data)
+        self._insert(
+            Note,
+            """
+            FROM src.note AS t
+            JOIN temp.map_user AS u ON u.old = t.user_id
+            WHERE t.room_id = ?
+            """,
+            (room.id,),
+            uuid=self._new_uuid("uuid"),
+            room_id=_mapped(Room, "room_id"),
+            location_id=_mapped(Location, "location_id"),
+            user_id="u.new",
+        )
+
+
+def _mapped(model: Type[BaseModel], column: str) -> str:
+    """SQL expression for the new key of the row the source column refers to, NULL if it was not copied."""
+    return f'(SELECT new FROM temp."map_{model._meta.table_name}" WHERE old = t."{column}")'
@@ -0,0 +1,232 @@
+"""
+Every campaign archive starts with a manifest that lists a checksum for every exported row and the files of all exported assets.
+
+When the manifest of an earlier export is passed to a new export, the new archive is differential:
+it only contains the rows that were added or changed since, the keys of the rows that were removed
+and the asset files that are not part of the earlier export.
+The manifest of a differential export still describes the complete campaign,
+so it can be used as the base of the next differential export.
+
+Differential archives are imported together with the archives they are based on,
+their changes are applied in order to the database of the full export before it is imported.
+"""
+
+import hashlib
+import json
+import tarfile
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from playhouse.sqlite_ext import SqliteExtDatabase
+from typing_extensions import TypedDict
+
+from ..models import ALL_MODELS
+from ..models.campaign import Room
+from ..models.general import Constants
+from ..models.user import User
+from ..save import SAVE_VERSION
+
+MANIFEST_NAME = "manifest.json"
+
+# Columns that get a new value on every export, they are not compared between exports
+VOLATILE_COLUMNS = {Room: ("invitation_code",), User: ("password_hash",)}
+
+
+class Manifest(TypedDict):
+    id: str
+    # Id of the manifest of the export this export is based on, if it is differential
+    base: Optional[str]
+    save_version: int
+    # The primary key and checksum of every row per table
+    rows: Dict[str, List[Tuple[Any, str]]]
+    assets: List[str]
+    # The primary keys of the rows of the base export that have been removed per table
+    removed: Dict[str, List[Any]]
+
+
+def _checksum(*values: Any) -> str:
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+
+def create_manifest(db: SqliteExtDatabase) -> Manifest:
+    """Lists the rows and asset files of an export database."""
+    db.connection().create_function("row_checksum", -1, _checksum, deterministic=True)
+
+    rows: Dict[str, List[Tuple[Any, str]]] = {}
+    for model in ALL_MODELS:
+        if model is Constants:
+            continue
+        table = model._meta.table_name
+        key = model._meta.primary_key.column_name
+        volatile = VOLATILE_COLUMNS.get(model, ())
+        columns = ", ".join(
+            f't."{field.column_name}"'
+            for field in model._meta.sorted_fields
+            if field.column_name not in volatile
+        )
+        entries = db.execute_sql(
+            f'SELECT t."{key}", row_checksum({columns}) FROM "{table}" AS t'
+        ).fetchall()
+        if entries:
+            rows[table] = entries
+
+    assets = [
+        file_hash
+        for (file_hash,) in db.execute_sql(
+            "SELECT DISTINCT file_hash FROM asset WHERE file_hash IS NOT NULL"
+        )
+    ]
+    return {
+        "id": uuid.uuid4().hex,
+        "base": None,
+        "save_version": SAVE_VERSION,
+        "rows": rows,
+        "assets": assets,
+        "removed": {},
+    }
+
+
+def check_manifest(data: Any) -> Manifest:
+    """Raises a ValueError if `data` is not a manifest."""
+    try:
+        valid = (
+            isinstance(data["id"], str)
+            and isinstance(data["save_version"], int)
+            and all(
+                isinstance(table, str)
+                and all(
+                    len(entry) == 2 and isinstance(entry[0], (str, int))
+                    for entry in entries
+                )
+                for table, entries in data["rows"].items()
+            )
+            and all(isinstance(file_hash, str) for file_hash in data["assets"])
+            and (data["base"] is None or isinstance(data["base"], str))
+            and all(
+                isinstance(table, str)
+                and isinstance(keys, list)
+                and all(isinstance(key, (str, int)) for key in keys)
+                for table, keys in data["removed"].items()
+            )
+        )
+    except (KeyError, TypeError, AttributeError):
+        valid = False
+    if not valid:
+        raise ValueError("Invalid export manifest")
+    return data
+
+
+def remove_unchanged(db: SqliteExtDatabase, manifest: Manifest, base: Manifest):
+    """
+    Turns the export database into a differential export by removing the rows that are the same in `base`.
+
+    Foreign keys have to be disabled, unchanged rows are removed even if changed rows reference them.
+    """
+    manifest["base"] = base["id"]
+    for model in ALL_MODELS:
+        if model is Constants:
+            continue
+        table = model._meta.table_name
+        previous = dict(base["rows"].get(table, []))
+        current = dict(manifest["rows"].get(table, []))
+        unchanged = [
+            key for key, checksum in current.items() if previous.get(key) == checksum
+        ]
+        if unchanged:
+            _delete(db, table, model._meta.primary_key.column_name, unchanged)
+        removed = [key for key in previous if key not in current]
+        if removed:
+            manifest["removed"][table] = removed
+    # Release the space of the removed rows, so that the archive only grows with the changes
+    db.execute_sql("VACUUM")
+
+
+def read_manifest(pac: Path) -> Optional[Manifest]:
+    """Returns the manifest of the archive, archives of older versions do not have one."""
+    with tarfile.open(pac, "r") as tar:
+        member = tar.next()
+        if member is None or member.name != MANIFEST_NAME:
+            return None
+        manifest_f = tar.extractfile(member)
+        if manifest_f is None:
+            return None
+        return check_manifest(json.load(manifest_f))
+
+
+def order_archives(pacs: Sequence[Path]) -> List[Tuple[Path, Optional[Manifest]]]:
+    """
+    Orders the archives of an import, starting with the only full export,
+    followed by the differential exports each directly after the export they are based on.
+    """
+    archives = [(pac, read_manifest(pac)) for pac in pacs]
+    full = [entry for entry in archives if entry[1] is None or entry[1]["base"] is None]
+    if len(full) != 1:
+        raise Exception("A campaign import requires exactly one full export")
+
+    differential = {
+        manifest["base"]: (pac, manifest)
+        for pac, manifest in archives
+        if manifest is not None and manifest["base"] is not None
+    }
+    chain = full
+    while True:
+        manifest = chain[-1][1]
+        if manifest is None or manifest["id"] not in differential:
+            break
+        chain.append(differential.pop(manifest["id"]))
+
+    if len(chain) != len(archives):
+        raise Exception("Not every differential export is based on the other archives")
+    if len({manifest["save_version"] for _, manifest in chain if manifest}) > 1:
+        raise Exception("The archives of an import are from different save versions")
+    return chain
+
+
+def check_delta(manifest: Manifest, base: Manifest):
+    """Raises a ValueError if the differential export is not based on `base` or removes rows that `base` does not have."""
+    if manifest["base"] != base["id"]:
+        raise ValueError("The differential export is based on another export")
+    for table, keys in manifest["removed"].items():
+        known = {entry[0] for entry in base["rows"].get(table, [])}
+        if not known.issuperset(keys):
+            raise ValueError(
+                f"The differential export removes unknown rows from {table}"
+            )
+
+
+def apply_delta(
+    db: SqliteExtDatabase, delta_path: Path, manifest: Manifest, base: Manifest
+):
+    """Applies a differential export to the database of the export `base` it is based on."""
+    check_delta(manifest, base)
+    db.execute_sql("ATTACH DATABASE ? AS delta", (str(delta_path),))
+    try:
+        tables = [
+            table
+            for (table,) in db.execute_sql(
+                "SELECT name FROM delta.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%'"
+            )
+            if table != Constants._meta.table_name
+        ]
+        with db.atomic():
+            for table in tables:
+                # The schema can be older than that of the server, the upgrade happens after all changes are applied
+                info = db.execute_sql(f'PRAGMA delta.table_info("{table}")').fetchall()
+                columns = ", ".join(f'"{column[1]}"' for column in info)
+                removed = manifest["removed"].get(table)
+                if removed:
+                    key = next(column[1] for column in info if column[5])
+                    _delete(db, table, key, removed)
+                db.execute_sql(
+                    f'INSERT OR REPLACE INTO main."{table}" ({columns}) SELECT {columns} FROM delta."{table}"'
+                )
+    finally:
+        db.execute_sql("DETACH DATABASE delta")
+
+
+def _delete(db: SqliteExtDatabase, table: str, key: str, keys: List[Any]):
+    db.execute_sql(
+        f'DELETE FROM main."{table}" WHERE "{key}" IN (SELECT value FROM json_each(?))',
+        (json.dumps(keys),),
+    )
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Awaitable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+from .config import config
+from .logs import logger
+
+T = TypeVar("T")
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+SIZE_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+SLOW_EVENT_LOG_SIZE = 10
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # The last counter holds the observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        bucket_labels = f"{labels}," if labels else ""
+        total_labels = f"{{{labels}}}" if labels else ""
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{bucket_labels}le="{bucket}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{total_labels} {self.sum}")
+        lines.append(f"{name}_count{total_labels} {self.count}")
+        return lines
+
+
+class EventRecord:
+    """Resources used while handling a single socket event."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.size = 0
+
+
+class SlowEvent(NamedTuple):
+    duration: float
+    event: str
+    queries: int
+    size: int
+
+
+class EventMetrics:
+    """
+    Collects the handler time, the number of SQL statements and the number of bytes sent per socket event.
+
+    The statements and bytes are attributed to the event whose handler caused them,
+    this includes work done on the database threads and in tasks started by the handler.
+
+    The slowest events are periodically written to the log.
+    """
+
+    def __init__(self, log_interval: float) -> None:
+        self.log_interval = log_interval
+        self._durations: Dict[str, Histogram] = {}
+        self._queries: Dict[str, Histogram] = {}
+        self._sizes: Dict[str, Histogram] = {}
+        self._slowest: List[SlowEvent] = []
+        self._current: ContextVar[Optional[EventRecord]] = ContextVar(
+            "current_event", default=None
+        )
+
+    def record_query(self) -> None:
+        record = self._current.get()
+        if record is not None:
+            record.queries += 1
+
+    def record_send(self, size: int) -> None:
+        record = self._current.get()
+        if record is not None:
+            record.size += size
+
+    async def track(
+        self, event: str, handler: Awaitable[T], sid: Optional[str] = None
+    ) -> T:
+        # The event and sid are read from this frame by the loop watchdog
+        record = EventRecord()
+        token = self._current.set(record)
+        start = time.perf_counter()
+        try:
+            return await handler
+        finally:
+            duration = time.perf_counter() - start
+            self._current.reset(token)
+            self._observe(event, duration, record)
+
+    def _observe(self, event: str, duration: float, record: EventRecord) -> None:
+        if event not in self._durations:
+            self._durations[event] = Histogram(DURATION_BUCKETS)
+            self._queries[event] = Histogram(QUERY_BUCKETS)
+            self._sizes[event] = Histogram(SIZE_BUCKETS)
+        self._durations[event].observe(duration)
+        self._queries[event].observe(record.queries)
+        self._sizes[event].observe(record.size)
+
+        slow_event = SlowEvent(duration, event, record.queries, record.size)
+        if len(self._slowest) < SLOW_EVENT_LOG_SIZE:
+            heapq.heappush(self._slowest, slow_event)
+        elif duration > self._slowest[0].duration:
+            heapq.heapreplace(self._slowest, slow_event)
+
+    def render(self) -> str:
+        """Returns the collected metrics in the Prometheus text format."""
+        lines = []
+        for name, description, histograms in (
+            (
+                "planarally_socket_event_duration_seconds",
+                "Time spent in socket event handlers.",
+                self._durations,
+            ),
+            (
+                "planarally_socket_event_queries",
+                "SQL statements executed per socket event.",
+                self._queries,
+            ),
+            (
+                "planarally_socket_event_sent_bytes",
+                "Bytes sent to clients per socket event.",
+                self._sizes,
+            ),
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for event, histogram in sorted(histograms.items()):
+                lines.extend(histogram.render(name, f'event="{_escape(event)}"'))
+        return "\n".join(lines) + "\n"
+
+    def log_slowest(self) -> None:
+        slowest, self._slowest = self._slowest, []
+        if not slowest:
+            return
+        logger.info(f"Slowest socket events of the last {self.log_interval}s:")
+        for slow_event in sorted(slowest, reverse=True):
+            logger.info(
+                f"  {slow_event.event}: {slow_event.duration * 1000:.1f}ms, {slow_event.queries} queries, {slow_event.size} bytes sent"
+            )
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.log_interval)
+            self.log_slowest()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+event_metrics = EventMetrics(
+    config.getfloat("General", "slow_event_log_interval_in_seconds", fallback=300)
+)
@@ -1,14 +1,17 @@
 import json
-from typing import Any, Dict, List, Optional, Union, cast
+import operator
+from collections import defaultdict
+from functools import reduce
+from typing import Any, Dict, List, Optional, Sequence, Union, cast
 from typing_extensions import TypedDict
 
-from peewee import ForeignKeyField, TextField
+from peewee import FloatField, ForeignKeyField, TextField
 from playhouse.shortcuts import model_to_dict
 
 from .base import BaseModel
 from .user import User
 
-__all__ = ["Asset"]
+__all__ = ["Asset", "UnreferencedAssetFile"]
 
 
 class FileStructure(TypedDict):
@@ -24,6 +27,10 @@ class FileStructureElement(TypedDict):
 AssetStructure = Union[FileStructure, Dict[str, "AssetStructure"]]
 
 
+def join_path(folder_path: str, name: str) -> str:
+    return f"{'' if folder_path == '/' else folder_path}/{name}"
+
+
 class Asset(BaseModel):
     id: int
 
@@ -33,8 +40,12 @@ class Asset(BaseModel):
         ForeignKeyField("self", backref="children", null=True, on_delete="CASCADE"),
     )
     name = cast(str, TextField())
-    file_hash = cast(Optional[str], TextField(null=True))
+    file_hash = cast(Optional[str], TextField(null=True, index=True))
     options = cast(Optional[str], TextField(null=True))
+    # The names leading from the root folder to the asset, e.g. /maps/caves/entrance
+    # this is kept up to date by the save signal of the model, assets without a parent have "/" as path
+    # paths are not unique, assets in the same folder can share a name and names can contain a "/"
+    path = cast(str, TextField(default="/"))
 
     def __repr__(self):
         return f"<Asset {self.owner.name} - {self.name}>"
@@ -46,21 +57,104 @@ class Asset(BaseModel):
         self.options = json.dumps([[k, v] for k, v in options.items()])
 
     def as_dict(self, children=False, recursive=False):
-        asset = model_to_dict(self, exclude=[Asset.owner, Asset.parent])
         if children:
-            asset["children"] = [
-                child.as_dict(children=children and recursive, recursive=recursive)
-                for child in Asset.select().where(
-                    (Asset.owner == self.owner) & (Asset.parent == self)
-                )
-            ]
-        return asset
+            return Asset.as_dicts([self], recursive=recursive)[0]
+        return model_to_dict(self, exclude=[Asset.owner, Asset.parent, Asset.path])
+
+    @classmethod
+    def as_dicts(cls, assets: Sequence["Asset"], recursive=False):
+        """Returns the assets with their children, or their whole subtrees when recursive, loaded with a single query."""
+        tree = cls.get_tree(assets, recursive=recursive)
+
+        def to_dict(asset: "Asset", depth: int):
+            data = model_to_dict(asset, exclude=[Asset.owner, Asset.parent, Asset.path])
+            if recursive or depth == 0:
+                data["children"] = [
+                    to_dict(child, depth + 1) for child in tree[asset.id]
+                ]
+            return data
 
-    def get_child(self, name: str) -> "Asset":
-        return Asset.get(
-            (Asset.owner == self.owner) & (Asset.parent == self) & (Asset.name == name)
+        return [to_dict(asset, 0) for asset in assets]
+
+    @classmethod
+    def in_subtree(cls, owner_id: int, path: str):
+        """Expression that selects the assets below the folder at `path` by a range of paths, which can use the path index."""
+        prefix = join_path(path, "")
+        # "0" is the character following "/"
+        return (
+            (cls.owner == owner_id)
+            & (cls.path >= prefix)
+            & (cls.path < f"{prefix[:-1]}0")
         )
 
+    @classmethod
+    def get_tree(
+        cls, roots: Sequence["Asset"], recursive=True
+    ) -> Dict[int, List["Asset"]]:
+        """
+        Loads the children of the given assets with a single query, grouped by the id of their parent.
+
+        When recursive, the children of those children are loaded as well, all the way down, selected by their path.
+        Assets of a folder that shares its path with one of the roots are loaded along, but they are not reachable from the roots.
+        Only children with the same owner as their parent are part of the tree.
+        """
+        children: Dict[int, List[Asset]] = defaultdict(list)
+        if not roots:
+            return children
+
+        if recursive:
+            query = Asset.select().where(
+                reduce(
+                    operator.or_,
+                    [cls.in_subtree(root.owner_id, root.path) for root in roots],
+                )
+            )
+        else:
+            Parent = Asset.alias()
+            query = (
+                Asset.select()
+                .join(
+                    Parent,
+                    on=((Asset.parent == Parent.id) & (Asset.owner == Parent.owner)),
+                )
+                .where(Parent.id.in_([root.id for root in roots]))
+            )
+
+        for asset in query.order_by(Asset.id):
+            children[asset.parent_id].append(asset)
+        return children
+
+    def get_descendants_by_path(self, path: str) -> List["Asset"]:
+        """
+        Returns the assets along a path relative to this folder, ending with the asset the path leads to.
+
+        They are looked up by their path with a single query, raises `Asset.DoesNotExist` if the path does not exist.
+        """
+        paths: List[str] = []
+        for name in path.strip("/").split("/"):
+            paths.append(join_path(paths[-1] if paths else self.path, name))
+
+        candidates: Dict[str, List[Asset]] = defaultdict(list)
+        for asset in (
+            Asset.select()
+            .where((Asset.owner == self.owner_id) & Asset.path.in_(paths))
+            .order_by(Asset.id)
+        ):
+            candidates[asset.path].append(asset)
+
+        # Assets in the same folder can have the same name, the first one is used like a lookup by name would
+        descendants: List[Asset] = []
+        parent = self
+        for asset_path in paths:
+            for asset in candidates[asset_path]:
+                if asset.parent_id == parent.id:
+                    parent = asset
+                    break
+            else:
+                raise Asset.DoesNotExist(f"No asset at {path}")
+            descendants.append(parent)
+        return descendants
+
     @classmethod
     def get_root_folder(cls, user):
         try:
@@ -73,15 +167,28 @@ class Asset(BaseModel):
     def get_user_structure(cls, user, parent=None):
         if parent is None:
             parent = cls.get_root_folder(user)
-        # ideally we change this to a single query to get all assets and process them as such
-        data: AssetStructure = {"__files": []}
-        for asset in Asset.select().where(
-            (Asset.owner == user) & (Asset.parent == parent)
-        ):
-            if asset.file_hash:
-                data["__files"].append(
-                    {"id": asset.id, "name": asset.name, "hash": asset.file_hash}
-                )
-            else:
-                data[asset.name] = cls.get_user_structure(user, asset)
-        return data
+        tree = cls.get_tree([parent])
+
+        def to_structure(folder: Asset) -> AssetStructure:
+            data: AssetStructure = {"__files": []}
+            for asset in tree[folder.id]:
+                if asset.file_hash:
+                    data["__files"].append(
+                        {"id": asset.id, "name": asset.name, "hash": asset.file_hash}
+                    )
+                else:
+                    data[asset.name] = to_structure(asset)
+            return data
+
+        return to_structure(parent)
+
+    class Meta:
+        indexes = ((("owner", "parent"), False), (("owner", "path"), False))
+
+
+class UnreferencedAssetFile(BaseModel):
+    """An asset file that was not used by any asset, shape or floor when the asset collector last ran."""
+
+    file_hash = cast(str, TextField(primary_key=True))
+    # When the collector first found the file unreferenced
+    since = cast(float, FloatField())
@@ -1,6 +1,6 @@
 import uuid
 from datetime import date
-from typing import List, Optional, Set, TYPE_CHECKING, cast
+from typing import List, Optional, TYPE_CHECKING, cast
 
 from peewee import (
     DateField,
@@ -17,10 +17,10 @@ if TYPE_CHECKING:
     from .initiative import Initiative
     from .marker import Marker
     from .shape import Shape
+    from .shape.prefetch import ShapePrefetch
 
 from .asset import Asset
 from .base import BaseModel
-from .groups import Group
 from .typed import SelectSequence
 from .user import User, UserOptions
 
@@ -107,6 +107,7 @@ class Room(BaseModel):
 
 class Location(BaseModel):
     id: int
+    room_id: int
     floors: SelectSequence["Floor"]
     initiative: List["Initiative"]
     markers: SelectSequence["Marker"]
@@ -128,6 +129,15 @@ class Location(BaseModel):
     def get_path(self):
         return f"{self.room.get_path()}/{self.name}"
 
+    def get_dm_path(self):
+        return f"{self.get_path()}#dm"
+
+    def get_players_path(self):
+        return f"{self.get_path()}#players"
+
+    def get_player_path(self, user_id: int):
+        return f"{self.get_path()}#player-{user_id}"
+
     def as_dict(self):
         data = model_to_dict(
             self,
@@ -208,6 +218,9 @@ class Location(BaseModel):
 
 
 class PlayerRoom(BaseModel):
+    active_location_id: int
+    player_id: int
+
     role = cast(int, IntegerField(default=0))
     player = cast(
         User, ForeignKeyField(User, backref="rooms_joined", on_delete="CASCADE")
@@ -245,9 +258,13 @@ class Note(BaseModel):
             self, recurse=False, exclude=[Note.room, Note.location, Note.user]
         )
 
+    class Meta:
+        indexes = ((("user", "room"), False),)
+
 
 class Floor(BaseModel):
     id: int
+    location_id: int
     layers: SelectSequence["Layer"]
 
     location = ForeignKeyField(Location, backref="floors", on_delete="CASCADE")
@@ -260,17 +277,22 @@ class Floor(BaseModel):
     def __repr__(self):
         return f"<Floor {self.name} {[self.index]}>"
 
-    def as_dict(self, user: User, dm: bool):
+    def as_dict(
+        self, user: User, dm: bool, *, prefetch: Optional["ShapePrefetch"] = None
+    ):
+        """
+        A prefetch of all layers of this floor can be provided to reuse it for multiple users.
+        """
+        from .shape.prefetch import ShapePrefetch
+
         data = model_to_dict(self, recurse=False, exclude=[Floor.id, Floor.location])
-        if dm:
-            data["layers"] = [
-                l.as_dict(user, True) for l in self.layers.order_by(Layer.index)
-            ]
-        else:
-            data["layers"] = [
-                l.as_dict(user, False)
-                for l in self.layers.order_by(Layer.index).where(Layer.player_visible)
-            ]
+        if prefetch is None:
+            prefetch = ShapePrefetch.for_floor(self, player_visible=not dm)
+        data["layers"] = [
+            prefetch.layer_as_dict(l, user, dm)
+            for l in prefetch.layers
+            if dm or l.player_visible
+        ]
         return data
 
 
@@ -294,22 +316,9 @@ class Layer(BaseModel):
         return f"{self.floor.location.get_path()}/{self.name}"
 
     def as_dict(self, user: User, dm: bool):
-        from .shape import Shape
+        from .shape.prefetch import ShapePrefetch
 
-        data = model_to_dict(
-            self,
-            recurse=False,
-            backrefs=False,
-            exclude=[Layer.id, Layer.player_visible],
-        )
-        groups_added: Set[Group] = set()
-        data["groups"] = []
-        data["shapes"] = []
-        for shape in self.shapes.order_by(Shape.index):
-            data["shapes"].append(shape.as_dict(user, dm))
-            if shape.group and shape.group.uuid not in groups_added:
-                data["groups"].append(model_to_dict(shape.group))
-        return data
+        return ShapePrefetch([self]).layer_as_dict(self, user, dm)
 
     class Meta:
         indexes = ((("floor", "name"), True), (("floor", "index"), True))
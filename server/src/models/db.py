@@ -1,14 +1,126 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, TypeVar
 
 from playhouse.sqlite_ext import SqliteExtDatabase
 
-from ..config import SAVE_FILE
+from ..config import SAVE_FILE, config
+from ..metrics import event_metrics
+
+T = TypeVar("T")
+
+
+class PlanarDatabase(SqliteExtDatabase):
+    def execute_sql(self, *args, **kwargs):
+        event_metrics.record_query()
+        return super().execute_sql(*args, **kwargs)
 
 
 def open_db(path: Path) -> SqliteExtDatabase:
-    return SqliteExtDatabase(
+    return PlanarDatabase(
         path, pragmas={"foreign_keys": 1, "journal_mode": "wal", "synchronous": 0}
     )
 
 
+class DatabaseExecutor:
+    """
+    Runs database work on worker threads so that it does not block the event loop.
+
+    Peewee keeps a separate connection for every thread.
+    Writes are queued for a single writer thread, which runs each of them in its own transaction
+    and hands the result back through a future of the loop that queued it.
+    Reads run on a small pool of threads with read-only connections,
+    which in WAL mode neither block nor are blocked by the writer.
+    The work runs in a copy of the caller's context, so it is attributed to the socket event that caused it.
+
+    Handlers that have not been moved to the executor still write on the connection of the event loop thread.
+    SQLite allows one writer at a time, such a write waits for the writer thread to finish its current transaction.
+    Model signals of writes on the writer thread run on that thread,
+    the in-memory state they update is guarded by locks.
+    """
+
+    def __init__(self, database: SqliteExtDatabase, readers: int) -> None:
+        self.database = database
+        self._writes: "queue.SimpleQueue[Optional[_Write]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(
+            target=self._run_writer, name="db-write", daemon=True
+        )
+        self._writer.start()
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="db-read",
+            initializer=self._init_reader,
+        )
+
+    def _init_reader(self) -> None:
+        self.database.connect(reuse_if_open=True)
+        self.database.execute_sql("PRAGMA query_only = 1")
+
+    async def read(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Runs `fn` on one of the reader threads, it is not allowed to write to the database."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._readers, partial(context.run, fn, *args, **kwargs)
+        )
+
+    async def write(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Runs `fn` in a single transaction on the writer thread.
+
+        Writes run in the order they are queued, a cancelled caller does not cancel its queued write.
+        """
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[T]" = loop.create_future()
+        context = contextvars.copy_context()
+        self._writes.put(
+            _Write(loop, future, partial(context.run, fn, *args, **kwargs))
+        )
+        return await future
+
+    def _run_writer(self) -> None:
+        while True:
+            write = self._writes.get()
+            if write is None:
+                break
+            try:
+                with self.database.atomic():
+                    result = write.fn()
+            except BaseException as e:
+                write.loop.call_soon_threadsafe(_set_exception, write.future, e)
+            else:
+                write.loop.call_soon_threadsafe(_set_result, write.future, result)
+        self.database.close()
+
+    def shutdown(self) -> None:
+        """Waits for the queued writes and stops the threads, writes queued afterwards are never run."""
+        self._writes.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+
+
+class _Write(NamedTuple):
+    loop: asyncio.AbstractEventLoop
+    future: "asyncio.Future[Any]"
+    fn: Callable[[], Any]
+
+
+def _set_result(future: "asyncio.Future[T]", result: T) -> None:
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future: "asyncio.Future[Any]", exception: BaseException) -> None:
+    if not future.cancelled():
+        future.set_exception(exception)
+
+
 db = open_db(SAVE_FILE)
+db_executor = DatabaseExecutor(
+    db, config.getint("General", "database_read_threads", fallback=4)
+)
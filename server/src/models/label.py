@@ -19,7 +19,8 @@ class Label(BaseModel):
     user = ForeignKeyField(User, backref="labels", on_delete="CASCADE")
     category = TextField(null=True)
     name = TextField()
-    visible = cast(bool, BooleanField())
+    # Labels are loaded by their owner or by being visible, the OR needs an index on both
+    visible = cast(bool, BooleanField(index=True))
 
     def as_dict(self):
         d = model_to_dict(self, recurse=False)
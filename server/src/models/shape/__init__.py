@@ -51,6 +51,9 @@ class Shape(BaseModel):
     composite_parent: SelectSequence["CompositeShapeAssociation"]
     shape_variants: SelectSequence["CompositeShapeAssociation"]
 
+    layer_id: int
+    group_id: Optional[str]
+
     uuid = cast(str, TextField(primary_key=True))
     layer = cast(Layer, ForeignKeyField(Layer, backref="shapes", on_delete="CASCADE"))
     type_ = cast(str, TextField())
@@ -105,7 +108,38 @@ class Shape(BaseModel):
         self.options = json.dumps([[k, v] for k, v in options.items()])
 
     # todo: Change this API to accept a PlayerRoom instead
-    def as_dict(self, user: User, dm: bool) -> "ShapeKeys":
+    # A user of None serializes the shape for a player without explicit ownership
+    def as_dict(self, user: Optional[User], dm: bool) -> "ShapeKeys":
+        subtype = self.subtype
+        return self.build_dict(
+            user,
+            dm,
+            layer=self.layer,
+            owners=[owner.as_dict() for owner in self.owners],
+            trackers=[t for t in self.trackers],
+            auras=[a for a in self.auras],
+            labels=[l for l in self.labels.join(Label)],
+            subtype=subtype.as_dict(exclude=[subtype.__class__.shape]),
+        )
+
+    def build_dict(
+        self,
+        user: Optional[User],
+        dm: bool,
+        *,
+        layer: Layer,
+        owners: List["ServerShapeOwner"],
+        trackers: List["Tracker"],
+        auras: List["Aura"],
+        labels: List["ShapeLabel"],
+        subtype: Dict[str, Any],
+    ) -> "ShapeKeys":
+        """
+        Serializes the shape from already loaded related data.
+
+        This contains the actual visibility logic of `as_dict`
+        and allows bulk loaders to serialize shapes without issuing extra queries.
+        """
         data = cast(
             "ShapeKeys",
             {
@@ -117,33 +151,38 @@ class Shape(BaseModel):
             },
         )
         # Owner query > list of usernames
-        data["owners"] = [owner.as_dict() for owner in self.owners]
+        data["owners"] = owners
         # Layer query > layer name
-        data["layer"] = self.layer.name
-        data["floor"] = self.layer.floor.name
+        data["layer"] = layer.name
+        data["floor"] = layer.floor.name
         # Aura and Tracker queries > json
         owned = (
             dm
             or self.default_edit_access
             or self.default_vision_access
-            or any(user.name == o["user"] for o in data["owners"])
+            or (
+                user is not None and any(user.name == o["user"] for o in data["owners"])
+            )
         )
-        tracker_query = self.trackers
-        aura_query = self.auras
-        label_query = self.labels.join(Label)
         if not owned:
             if not self.annotation_visible:
                 data["annotation"] = ""
-            tracker_query = tracker_query.where(Tracker.visible)
-            aura_query = aura_query.where(Aura.visible)
-            label_query = label_query.where(Label.visible)
+            trackers = [t for t in trackers if t.visible]
+            auras = [a for a in auras if a.visible]
+            labels = [l for l in labels if l.label.visible]
             if not self.name_visible:
                 data["name"] = "?"
-        data["trackers"] = [t.as_dict() for t in tracker_query]
-        data["auras"] = [a.as_dict() for a in aura_query]
-        data["labels"] = [l.as_dict() for l in label_query]
+        data["trackers"] = [t.as_dict() for t in trackers]
+        data["auras"] = [a.as_dict() for a in auras]
+        data["labels"] = [l.as_dict() for l in labels]
         # Subtype
-        data.update(**self.subtype.as_dict(exclude=[self.subtype.__class__.shape]))
+        data.update(**subtype)
+        # Moves are written to the database periodically, pending positions take precedence
+        from ...state.position import position_buffer
+
+        position = position_buffer.get(self.uuid)
+        if position is not None:
+            position.apply(cast(Dict[str, Any], data))
         return data
 
     def center_at(self, x: int, y: int) -> None:
@@ -205,6 +244,9 @@ class Shape(BaseModel):
 
         return new_shape
 
+    class Meta:
+        indexes = ((("layer", "index"), False),)
+
 
 class ShapeLabel(BaseModel):
     shape = ForeignKeyField(Shape, backref="labels", on_delete="CASCADE")
@@ -267,6 +309,9 @@ class Aura(BaseModel):
 
 
 class ShapeOwner(BaseModel):
+    shape_id: str
+    user_id: int
+
     shape = ForeignKeyField(Shape, backref="owners", on_delete="CASCADE")
     user = cast(User, ForeignKeyField(User, backref="shapes", on_delete="CASCADE"))
     edit_access = BooleanField()
@@ -280,7 +325,7 @@ class ShapeOwner(BaseModel):
         return cast(
             "ServerShapeOwner",
             {
-                "shape": self.shape.uuid,
+                "shape": self.shape_id,
                 "user": self.user.name,
                 "edit_access": self.edit_access,
                 "movement_access": self.movement_access,
@@ -294,8 +339,13 @@ class ShapeOwner(BaseModel):
         _dict["user"] = self.user
         type(self).create(**_dict)
 
+    class Meta:
+        indexes = ((("shape", "user"), False),)
+
 
 class ShapeType(BaseModel):
+    shape_id: str
+
     shape = ForeignKeyField(Shape, primary_key=True, on_delete="CASCADE")
 
     @staticmethod
@@ -405,16 +455,21 @@ class ToggleComposite(ShapeType):
                 parent=subshape, variant=variant["uuid"], name=variant["name"]
             )
 
-    def as_dict(self, *args, **kwargs):
+    def as_dict(self, *args, variants=None, **kwargs):
         model = model_to_dict(self, *args, **kwargs)
-        model["variants"] = [
-            {"uuid": sv.variant.uuid, "name": sv.name}
-            for sv in self.shape.shape_variants
-        ]
+        if variants is None:
+            variants = [
+                {"uuid": sv.variant_id, "name": sv.name}
+                for sv in self.shape.shape_variants
+            ]
+        model["variants"] = variants
         return model
 
 
 class CompositeShapeAssociation(BaseModel):
+    parent_id: str
+    variant_id: str
+
     variant = ForeignKeyField(Shape, backref="composite_parent", on_delete="CASCADE")
     parent = ForeignKeyField(Shape, backref="shape_variants", on_delete="CASCADE")
     name = TextField()
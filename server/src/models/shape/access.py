@@ -1,8 +1,114 @@
-from ..campaign import PlayerRoom
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, NamedTuple
+
+from ...config import config
+from ..campaign import Layer, PlayerRoom
 from ..role import Role
 from . import Shape, ShapeOwner
 
 
+class OwnerAccess(NamedTuple):
+    edit_access: bool
+    movement_access: bool
+    vision_access: bool
+
+
+class ShapeAccess(NamedTuple):
+    player_editable: bool
+    default_edit_access: bool
+    default_movement_access: bool
+    default_vision_access: bool
+    owners: Dict[int, OwnerAccess]
+
+    def allows(self, user_id: int, movement=False) -> bool:
+        if not self.player_editable:
+            return False
+
+        if self.default_edit_access:
+            return True
+
+        if movement and self.default_movement_access:
+            return True
+
+        return user_id in self.owners
+
+
+class PermissionCache:
+    """
+    In-memory index of the access rules of shapes.
+
+    Entries are loaded lazily the first time a shape is checked and have to be invalidated
+    whenever the layer, the default access or the owners of the shape change.
+    The model signals take care of this for regular saves and deletes.
+
+    The cache holds at most `max_size` shapes, the least recently checked ones are evicted first.
+    Checks can run on the database threads, so the entries are guarded by a lock.
+    Rules loaded while an invalidation happened are returned but not stored, they can be outdated.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._access: "OrderedDict[str, ShapeAccess]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, shape: Shape) -> ShapeAccess:
+        return self.get_many([shape])[shape.uuid]
+
+    def get_many(self, shapes: Iterable[Shape]) -> Dict[str, ShapeAccess]:
+        result: Dict[str, ShapeAccess] = {}
+        missing: Dict[str, Shape] = {}
+        with self._lock:
+            generation = self._generation
+            for shape in shapes:
+                access = self._access.get(shape.uuid)
+                if access is None:
+                    missing[shape.uuid] = shape
+                else:
+                    self._access.move_to_end(shape.uuid)
+                    result[shape.uuid] = access
+
+        if missing:
+            owners: Dict[str, Dict[int, OwnerAccess]] = defaultdict(dict)
+            for owner in ShapeOwner.select().where(ShapeOwner.shape << list(missing)):
+                owners[owner.shape_id][owner.user_id] = OwnerAccess(
+                    owner.edit_access, owner.movement_access, owner.vision_access
+                )
+            for shape_id, shape in missing.items():
+                result[shape_id] = ShapeAccess(
+                    shape.layer.player_editable,
+                    shape.default_edit_access,
+                    shape.default_movement_access,
+                    shape.default_vision_access,
+                    owners[shape_id],
+                )
+
+            with self._lock:
+                if generation == self._generation:
+                    for shape_id in missing:
+                        self._access[shape_id] = result[shape_id]
+                    while len(self._access) > self.max_size:
+                        self._access.popitem(last=False)
+
+        return result
+
+    def invalidate(self, shape_id: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._access.pop(shape_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._access.clear()
+
+
+permission_cache = PermissionCache(
+    config.getint("General", "permission_cache_size", fallback=100_000)
+)
+
+
 def has_ownership(shape: Shape, pr: PlayerRoom, movement=False) -> bool:
     if shape is None:
         return False
@@ -10,13 +116,38 @@ def has_ownership(shape: Shape, pr: PlayerRoom, movement=False) -> bool:
     if pr.role == Role.DM:
         return True
 
-    if not shape.layer.player_editable:
-        return False
+    return permission_cache.get(shape).allows(pr.player_id, movement)
 
-    if shape.default_edit_access:
-        return True
 
-    if movement and shape.default_movement_access:
-        return True
+def filter_ownership(
+    shapes: Iterable[Shape], pr: PlayerRoom, movement=False
+) -> List[Shape]:
+    """
+    Bulk version of `has_ownership`, returns the shapes the player has ownership of.
+
+    The shapes are expected to be loaded together with their layer,
+    uncached access rules are loaded for all shapes at once.
+    """
+    shapes = list(shapes)
+    if pr.role == Role.DM:
+        return shapes
+
+    access = permission_cache.get_many(shapes)
+    return [
+        shape for shape in shapes if access[shape.uuid].allows(pr.player_id, movement)
+    ]
+
+
+def get_owned_shapes(
+    shape_ids: Iterable[str], pr: PlayerRoom, movement=False
+) -> List[Shape]:
+    """
+    Returns the shapes out of `shape_ids` the player has ownership of, unknown ids are ignored.
 
-    return ShapeOwner.get_or_none(shape=shape, user=pr.player) is not None
+    This requires one query for the shapes and at most one for their owners, regardless of the number of shapes.
+    """
+    return filter_ownership(
+        Shape.select(Shape, Layer).join(Layer).where(Shape.uuid << list(shape_ids)),
+        pr,
+        movement,
+    )
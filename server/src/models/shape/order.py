@@ -0,0 +1,93 @@
+"""
+Shapes are ordered within their layer by `Shape.index`.
+
+The keys are sparse, only their relative order matters and gaps are expected.
+Inserting, moving or removing a shape therefore only writes the shape itself,
+the keys of a layer are respread when a shape has to be placed between two adjacent keys.
+Clients never see the keys, they address shapes by their position in the layer.
+"""
+
+from typing import List
+
+from peewee import fn
+
+from ..campaign import Layer
+from ..db import db
+from . import Shape
+
+# Distance between the order keys of neighbouring shapes after appending or rebalancing.
+ORDER_KEY_STEP = 1024
+
+
+def get_next_index(layer: Layer) -> int:
+    """Returns an order key that places a shape on top of all shapes of the layer."""
+    index = Shape.select(fn.Max(Shape.index)).where(Shape.layer == layer).scalar()
+    if index is None:
+        return 0
+    return index + ORDER_KEY_STEP
+
+
+def move_to_position(shape: Shape, position: int) -> None:
+    """
+    Changes the order key of the shape so that it ends up at `position` in its layer.
+
+    Positions outside of the layer are clamped to the bottom or top of the layer.
+    """
+    position = max(position, 0)
+    neighbours = _get_neighbours(shape, position)
+    if not neighbours and position > 0:
+        # Past the top of the layer
+        position = (
+            Shape.select()
+            .where((Shape.layer == shape.layer_id) & (Shape.uuid != shape.uuid))
+            .count()
+        )
+        neighbours = _get_neighbours(shape, position)
+
+    if len(neighbours) == 2 and neighbours[1] - neighbours[0] < 2:
+        rebalance_layer(shape.layer_id)
+        neighbours = _get_neighbours(shape, position)
+
+    if not neighbours:
+        index = 0
+    elif position == 0:
+        index = neighbours[0] - ORDER_KEY_STEP
+    elif len(neighbours) == 1:
+        index = neighbours[0] + ORDER_KEY_STEP
+    else:
+        index = (neighbours[0] + neighbours[1]) // 2
+
+    Shape.update(index=index).where(Shape.uuid == shape.uuid).execute()
+    shape.index = index
+
+
+def rebalance_layer(layer_id: int) -> None:
+    """Respreads the order keys of all shapes in the layer without changing their order."""
+    shape_ids = [
+        shape_id
+        for (shape_id,) in Shape.select(Shape.uuid)
+        .where(Shape.layer == layer_id)
+        .order_by(Shape.index)
+        .tuples()
+    ]
+    with db.atomic():
+        for i, shape_id in enumerate(shape_ids):
+            Shape.update(index=i * ORDER_KEY_STEP).where(
+                Shape.uuid == shape_id
+            ).execute()
+
+
+def _get_neighbours(shape: Shape, position: int) -> List[int]:
+    """
+    Returns the keys of the shapes that will be directly below and above the shape at `position`.
+
+    At the bottom of the layer only the key above is returned, at the top only the key below.
+    """
+    query = (
+        Shape.select(Shape.index)
+        .where((Shape.layer == shape.layer_id) & (Shape.uuid != shape.uuid))
+        .order_by(Shape.index)
+    )
+    if position == 0:
+        return [i for (i,) in query.limit(1).tuples()]
+    return [i for (i,) in query.offset(position - 1).limit(2).tuples()]
@@ -0,0 +1,153 @@
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from playhouse.shortcuts import model_to_dict
+
+if TYPE_CHECKING:
+    from ...api.socket.shape.data_models import ServerShapeOwner, ShapeKeys
+
+from ..campaign import Floor, Layer
+from ..groups import Group
+from ..label import Label
+from ..user import User
+from ..utils import get_table
+from . import (
+    Aura,
+    CompositeShapeAssociation,
+    Shape,
+    ShapeLabel,
+    ShapeOwner,
+    ShapeType,
+    ToggleComposite,
+    Tracker,
+)
+
+
+class ShapePrefetch:
+    """
+    Loads all shapes of a set of layers together with their related rows.
+
+    Every related table is queried once for the whole set of layers,
+    so the number of queries does not depend on the number of shapes.
+    Serializing through this class gives the same result as `Layer.as_dict` and `Shape.as_dict`
+    and the loaded data can be reused to serialize the layers for multiple users.
+
+    The layers are expected to be loaded together with their floor.
+    Providing `shape_ids` limits the loaded shapes to those shapes.
+    """
+
+    def __init__(self, layers: List[Layer], shape_ids: Optional[List[str]] = None):
+        self.layers = layers
+        self.layer_map = {layer.id: layer for layer in layers}
+        layer_ids = [layer.id for layer in layers]
+        shape_filter = Shape.layer << layer_ids
+        if shape_ids is not None:
+            shape_filter &= Shape.uuid << shape_ids
+        shape_query = Shape.select(Shape.uuid).where(shape_filter)
+
+        self.shapes: Dict[int, List[Shape]] = defaultdict(list)
+        self.owners: Dict[str, List["ServerShapeOwner"]] = defaultdict(list)
+        self.trackers: Dict[str, List[Tracker]] = defaultdict(list)
+        self.auras: Dict[str, List[Aura]] = defaultdict(list)
+        self.labels: Dict[str, List[ShapeLabel]] = defaultdict(list)
+        self.variants: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+        self.subtypes: Dict[str, ShapeType] = {}
+        self.groups: Dict[str, Dict[str, Any]] = {}
+
+        types = set()
+        for shape in Shape.select().where(shape_filter).order_by(Shape.index):
+            self.shapes[shape.layer_id].append(shape)
+            types.add(shape.type_)
+
+        for owner in (
+            ShapeOwner.select(ShapeOwner, User)
+            .join(User)
+            .where(ShapeOwner.shape << shape_query)
+        ):
+            self.owners[owner.shape_id].append(owner.as_dict())
+
+        for tracker in Tracker.select().where(Tracker.shape << shape_query):
+            self.trackers[tracker.shape_id].append(tracker)
+
+        for aura in Aura.select().where(Aura.shape << shape_query):
+            self.auras[aura.shape_id].append(aura)
+
+        for shape_label in (
+            ShapeLabel.select(ShapeLabel, Label, User)
+            .join(Label)
+            .join(User)
+            .where(ShapeLabel.shape << shape_query)
+        ):
+            self.labels[shape_label.shape_id].append(shape_label)
+
+        for type_ in types:
+            type_table = get_table(type_)
+            if type_table is None:
+                continue
+            for subtype in type_table.select().where(type_table.shape << shape_query):
+                self.subtypes[subtype.shape_id] = subtype
+
+        if "togglecomposite" in types:
+            for sv in CompositeShapeAssociation.select().where(
+                CompositeShapeAssociation.parent << shape_query
+            ):
+                self.variants[sv.parent_id].append(
+                    {"uuid": sv.variant_id, "name": sv.name}
+                )
+
+        for group in Group.select().where(
+            Group.uuid
+            << Shape.select(Shape.group).where(
+                shape_filter & Shape.group.is_null(False)
+            )
+        ):
+            self.groups[group.uuid] = model_to_dict(group)
+
+    @classmethod
+    def for_floor(cls, floor: Floor, *, player_visible=False) -> "ShapePrefetch":
+        layers = (
+            Layer.select(Layer, Floor)
+            .join(Floor)
+            .where(Layer.floor == floor)
+            .order_by(Layer.index)
+        )
+        if player_visible:
+            layers = layers.where(Layer.player_visible)
+        return cls([l for l in layers])
+
+    def shape_as_dict(self, shape: Shape, user: User, dm: bool) -> "ShapeKeys":
+        subtype = self.subtypes[shape.uuid]
+        if isinstance(subtype, ToggleComposite):
+            subtype_data = subtype.as_dict(
+                exclude=[ToggleComposite.shape], variants=self.variants[shape.uuid]
+            )
+        else:
+            subtype_data = subtype.as_dict(exclude=[subtype.__class__.shape])
+
+        return shape.build_dict(
+            user,
+            dm,
+            layer=self.layer_map[shape.layer_id],
+            owners=self.owners[shape.uuid],
+            trackers=self.trackers[shape.uuid],
+            auras=self.auras[shape.uuid],
+            labels=self.labels[shape.uuid],
+            subtype=subtype_data,
+        )
+
+    def layer_as_dict(self, layer: Layer, user: User, dm: bool):
+        data = model_to_dict(
+            layer,
+            recurse=False,
+            backrefs=False,
+            exclude=[Layer.id, Layer.player_visible],
+        )
+        groups_added = set()
+        data["groups"] = []
+        data["shapes"] = []
+        for shape in self.shapes[layer.id]:
+            data["shapes"].append(self.shape_as_dict(shape, user, dm))
+            if shape.group_id and shape.group_id not in groups_added:
+                groups_added.add(shape.group_id)
+                data["groups"].append(self.groups[shape.group_id])
+        return data
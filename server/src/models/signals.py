@@ -1,7 +1,13 @@
-from playhouse.signals import post_save, pre_delete
+import json
 
-from .campaign import Location, LocationUserOption, PlayerRoom
+from peewee import Value, fn
+from playhouse.signals import post_delete, post_save, pre_delete, pre_save
+
+from .asset import Asset, join_path
+from .campaign import Floor, Layer, Location, LocationUserOption, PlayerRoom, Room
 from .db import db
+from .shape import Polygon, Shape, ShapeOwner
+from .shape.access import permission_cache
 from .user import User
 
 
@@ -12,6 +18,11 @@ __all__ = []  # type: ignore
 def on_location_save(model_class, instance, created):
     if not created:
         return
+    # SQLite can reuse the id of a removed location, make sure no cached data of the old location is served
+    from ..state.snapshot import snapshot_cache
+
+    snapshot_cache.bump(instance.id)
+
     players = User.select().where(
         (User.id << instance.room.players.select(PlayerRoom.player))
         | (User.id == instance.room.creator)
@@ -37,3 +48,128 @@ def on_player_leave(model_class, instance):
             LocationUserOption.get(
                 location=location, user=instance.player
             ).delete_instance()
+
+
+@pre_delete(sender=Asset)
+@pre_delete(sender=User)
+def on_shape_reference_delete(model_class, instance):
+    # Removing these cascades into shapes of arbitrary locations
+    from ..state.snapshot import snapshot_cache
+
+    snapshot_cache.clear()
+    permission_cache.clear()
+
+
+@pre_save(sender=Asset)
+def on_asset_save(model_class, instance, created):
+    if not created and not instance._dirty & {"name", "parent"}:
+        return
+
+    # The instance can be older than the path in the database, when an ancestor was moved since it was loaded
+    previous_path = (
+        None
+        if created
+        else Asset.select(Asset.path).where(Asset.id == instance.id).scalar()
+    )
+    if instance.parent_id is None:
+        instance.path = "/"
+    else:
+        parent_path = Asset.select(Asset.path).where(Asset.id == instance.parent_id)
+        instance.path = join_path(parent_path.scalar(), instance.name)
+
+    # The assets below a renamed or moved folder move along with it.
+    # They are found by their parents, as siblings with the same name share their path.
+    if previous_path is not None and instance.path != previous_path:
+        Child = Asset.alias()
+        descendants = (
+            Asset.select(Asset.id)
+            .where(Asset.parent == instance.id)
+            .cte("descendants", recursive=True, columns=("id",))
+        )
+        descendants = descendants.union_all(
+            Child.select(Child.id).join(
+                descendants, on=(Child.parent == descendants.c.id)
+            )
+        )
+        Asset.update(
+            path=Value(instance.path).concat(
+                fn.SUBSTR(Asset.path, len(previous_path) + 1)
+            )
+        ).where(Asset.id.in_(descendants.select_from(descendants.c.id))).execute()
+
+
+@pre_delete(sender=Room)
+@pre_delete(sender=Location)
+@pre_delete(sender=Floor)
+def on_shape_container_delete(model_class, instance):
+    # Recursive deletes remove the contained shapes without sending their signals
+    permission_cache.clear()
+
+
+@pre_save(sender=Shape)
+def on_shape_save(model_class, instance, created):
+    # Moves are written to the database periodically,
+    # a pending position is kept for all fields that are not explicitly changed by this save
+    from ..state.position import ShapePosition, position_buffer
+
+    position = position_buffer.pop(instance.uuid)
+    if position is None:
+        return
+
+    for field in ("x", "y", "angle"):
+        if field not in instance._dirty:
+            setattr(instance, field, getattr(position, field))
+
+    if position.vertices is not None:
+        position_buffer.set(
+            instance.uuid,
+            ShapePosition(instance.x, instance.y, instance.angle, position.vertices),
+        )
+
+
+@pre_save(sender=Polygon)
+def on_polygon_save(model_class, instance, created):
+    from ..state.position import position_buffer
+
+    position = position_buffer.get(instance.shape_id)
+    if position is None or position.vertices is None:
+        return
+
+    if "vertices" not in instance._dirty:
+        instance.vertices = json.dumps(position.vertices)
+    position_buffer.set(instance.shape_id, position._replace(vertices=None))
+
+
+@pre_delete(sender=Shape)
+def on_shape_delete(model_class, instance):
+    from ..state.position import position_buffer
+
+    position_buffer.pop(instance.uuid)
+    permission_cache.invalidate(instance.uuid)
+
+
+@pre_save(sender=Shape)
+def on_shape_access_save(model_class, instance, created):
+    if created or instance._dirty & {
+        "layer",
+        "default_edit_access",
+        "default_movement_access",
+        "default_vision_access",
+    }:
+        permission_cache.invalidate(instance.uuid)
+
+
+@post_save(sender=ShapeOwner)
+def on_shape_owner_save(model_class, instance, created):
+    permission_cache.invalidate(instance.shape_id)
+
+
+@post_delete(sender=ShapeOwner)
+def on_shape_owner_delete(model_class, instance):
+    permission_cache.invalidate(instance.shape_id)
+
+
+@post_save(sender=Layer)
+def on_layer_save(model_class, instance, created):
+    if not created:
+        permission_cache.clear()
@@ -8,3 +8,27 @@ def get_table(name: str):
 
 def reduce_data_to_model(model, data):
     return {k: data[k] for k in model._meta.fields.keys() if k in data}
+
+
+# The lowest limit on the number of bound parameters of a single statement across SQLite versions.
+SQLITE_MAX_VARIABLES = 999
+
+
+def insert_rows(model, rows):
+    """
+    Inserts the rows with as few statements as SQLite's parameter limit allows.
+
+    Rows do not need to share their keys, missing values fall back to the field's default or NULL.
+    Model signals are not sent for the inserted rows.
+    """
+    fields = []
+    for row in rows:
+        for key in row:
+            if key not in fields:
+                fields.append(key)
+    if not fields:
+        return
+
+    batch_size = max(1, SQLITE_MAX_VARIABLES // len(model._meta.fields))
+    for start in range(0, len(rows), batch_size):
+        model.insert_many(rows[start : start + batch_size], fields=fields).execute()
@@ -25,6 +25,10 @@ from .api import http
 from . import routes
 from .state.asset import asset_state
 from .state.game import game_state
+from .state.imports import import_spool
+from .state.uploads import asset_uploads
+from .asset_collector import asset_collector
+from .state.position import position_buffer
 
 # Force loading of socketio routes
 from .api.socket import load_socket_commands
@@ -32,7 +36,10 @@ from .api.socket.constants import GAME_NS
 from .app import admin_app, app as main_app, runners, setup_runner, sio
 from .config import config
 from .logs import logger
+from .metrics import event_metrics
+from .watchdog import loop_watchdog
 from .models import User, Room
+from .models.db import db_executor
 
 load_socket_commands()
 
@@ -50,6 +57,8 @@ if sys.platform.startswith("win"):
 async def on_shutdown(_):
     for sid in [*game_state._sid_map.keys(), *asset_state._sid_map.keys()]:
         await sio.disconnect(sid, namespace=GAME_NS)
+    await position_buffer.flush()
+    db_executor.shutdown()
 
 
 async def start_http(app: web.Application, host, port):
@@ -150,6 +159,12 @@ def server_main(args):
         save.upgrade_save()
 
     loop.create_task(start_servers())
+    loop.create_task(position_buffer.run())
+    loop.create_task(import_spool.run())
+    loop.create_task(asset_uploads.run())
+    loop.create_task(asset_collector.run())
+    loop.create_task(event_metrics.run())
+    loop.create_task(loop_watchdog.run())
 
     try:
         main_app.on_shutdown.append(on_shutdown)
@@ -218,6 +233,14 @@ def reset_password_main(args):
     user.save()
 
 
+def collect_assets_main(args):
+    """Remove the asset files that are no longer used."""
+    collection = asset_collector.collect()
+    print(
+        f"Removed {collection.files} unused asset file(s), reclaiming {collection.size} bytes"
+    )
+
+
 def add_subcommand(name, func, parent_parser, args):
     sub_parser = parent_parser.add_parser(name, help=func.__doc__)
     for arg in args:
@@ -287,6 +310,8 @@ def main():
         ],
     )
 
+    add_subcommand("collect-assets", collect_assets_main, subparsers, [])
+
     options = parser.parse_args()
     options.func(options)
 
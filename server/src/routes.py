@@ -6,8 +6,9 @@ import aiohttp
 from aiohttp import web
 
 from .api import http
-from .api.http.admin import campaigns
+from .api.http.admin import campaigns, stats
 from .api.http.admin import users as admin_users
+from .api.http import assets
 from .api.http import auth
 from .api.http import notifications
 from .api.http import rooms
@@ -56,6 +57,11 @@ async def root_dev(request, admin_api=False):
 
 # MAIN ROUTES
 
+# Asset files are served separately from the other static files, as they never change
+main_app.router.add_get(
+    f"{subpath}/static/assets/{{file_hash:[0-9a-f]+}}", assets.get_asset
+)
+main_app.on_response_prepare.append(assets.set_asset_etag)
 main_app.router.add_static(f"{subpath}/static", STATIC_DIR)
 main_app.router.add_get(f"{subpath}/api/auth", auth.is_authed)
 main_app.router.add_post(f"{subpath}/api/users/email", users.set_email)
@@ -80,6 +86,9 @@ main_app.router.add_patch(
 main_app.router.add_get(
     f"{subpath}/api/rooms/{{creator}}/{{roomname}}/export", rooms.export
 )
+main_app.router.add_post(
+    f"{subpath}/api/rooms/{{creator}}/{{roomname}}/export", rooms.export
+)
 main_app.router.add_get(f"{subpath}/api/rooms/{{creator}}/export", rooms.export_all)
 main_app.router.add_post(f"{subpath}/api/rooms/import/{{name}}", rooms.import_info)
 main_app.router.add_post(
@@ -99,6 +108,9 @@ api_app.router.add_get(f"{subpath}/users", admin_users.collect)
 api_app.router.add_post(f"{subpath}/users/reset", admin_users.reset)
 api_app.router.add_post(f"{subpath}/users/remove", admin_users.remove)
 api_app.router.add_get(f"{subpath}/campaigns", campaigns.collect)
+api_app.router.add_get(f"{subpath}/stats/events", stats.get_events)
+api_app.router.add_get(f"{subpath}/stats/loop", stats.get_loop)
+api_app.router.add_get(f"{subpath}/stats/positions", stats.get_positions)
 
 admin_app.router.add_static(f"{subpath}/static", STATIC_DIR)
 admin_app.add_subapp("/api/", api_app)
@@ -13,7 +13,7 @@ When writing migrations make sure that these things are respected:
     - e.g. a column added to Circle also needs to be added to CircularToken
 """
 
-SAVE_VERSION = 74
+SAVE_VERSION = 77
 
 import json
 import logging
@@ -203,6 +203,66 @@ def upgrade(db: SqliteExtDatabase, version: int):
                 'INSERT INTO "shape" ("uuid", "layer_id", "type_", "x", "y", "name", "name_visible", "fill_colour", "stroke_colour", "vision_obstruction", "movement_obstruction", "is_token", "annotation", "draw_operator", "index", "options", "badge", "show_badge", "default_edit_access", "default_vision_access", "is_invisible", "default_movement_access", "is_locked", "angle", "stroke_width", "asset_id", "group_id", "annotation_visible", "ignore_zoom_size", "is_defeated", "is_door", "is_teleport_zone") SELECT "uuid", "layer_id", "type_", "x", "y", "name", "name_visible", "fill_colour", "stroke_colour", "vision_obstruction", "movement_obstruction", "is_token", "annotation", "draw_operator", "index", "options", "badge", "show_badge", "default_edit_access", "default_vision_access", "is_invisible", "default_movement_access", "is_locked", "angle", "stroke_width", "asset_id", "group_id", "annotation_visible", "ignore_zoom_size", "is_defeated", "is_door", "is_teleport_zone" FROM _shape_73'
             )
             db.execute_sql("DROP TABLE _shape_73")
+    elif version == 74:
+        # Add indices for the lookups of the socket handlers
+        # and restore the foreign key indices that were lost when tables were recreated in earlier migrations
+        with db.atomic():
+            for index in (
+                'CREATE INDEX IF NOT EXISTS "shape_layer_id" ON "shape" ("layer_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_asset_id" ON "shape" ("asset_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_group_id" ON "shape" ("group_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_layer_id_index" ON "shape" ("layer_id", "index")',
+                'CREATE INDEX IF NOT EXISTS "shape_owner_shape_id" ON "shape_owner" ("shape_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_owner_user_id" ON "shape_owner" ("user_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_owner_shape_id_user_id" ON "shape_owner" ("shape_id", "user_id")',
+                'CREATE INDEX IF NOT EXISTS "tracker_shape_id" ON "tracker" ("shape_id")',
+                'CREATE INDEX IF NOT EXISTS "aura_shape_id" ON "aura" ("shape_id")',
+                'CREATE INDEX IF NOT EXISTS "shape_label_shape_id" ON "shape_label" ("shape_id")',
+                'CREATE INDEX IF NOT EXISTS "composite_shape_association_parent_id" ON "composite_shape_association" ("parent_id")',
+                'CREATE INDEX IF NOT EXISTS "asset_owner_id" ON "asset" ("owner_id")',
+                'CREATE INDEX IF NOT EXISTS "asset_parent_id" ON "asset" ("parent_id")',
+                'CREATE INDEX IF NOT EXISTS "asset_owner_id_parent_id" ON "asset" ("owner_id", "parent_id")',
+                'CREATE INDEX IF NOT EXISTS "asset_file_hash" ON "asset" ("file_hash")',
+                'CREATE INDEX IF NOT EXISTS "note_user_id_room_id" ON "note" ("user_id", "room_id")',
+                'CREATE INDEX IF NOT EXISTS "marker_user_id_location_id" ON "marker" ("user_id", "location_id")',
+                'CREATE INDEX IF NOT EXISTS "room_creator_id" ON "room" ("creator_id")',
+                'CREATE INDEX IF NOT EXISTS "room_default_options_id" ON "room" ("default_options_id")',
+                'CREATE INDEX IF NOT EXISTS "room_logo_id" ON "room" ("logo_id")',
+                'CREATE INDEX IF NOT EXISTS "location_user_option_location_id" ON "location_user_option" ("location_id")',
+                'CREATE INDEX IF NOT EXISTS "location_user_option_user_id" ON "location_user_option" ("user_id")',
+                'CREATE INDEX IF NOT EXISTS "location_user_option_active_layer_id" ON "location_user_option" ("active_layer_id")',
+                'CREATE INDEX IF NOT EXISTS "label_visible" ON "label" ("visible")',
+            ):
+                db.execute_sql(index)
+    elif version == 75:
+        # Add Asset.path, the path of an asset from the root folder of its owner
+        with db.atomic():
+            db.execute_sql(
+                "ALTER TABLE asset ADD COLUMN path TEXT NOT NULL DEFAULT '/'"
+            )
+            db.execute_sql(
+                """CREATE TEMPORARY TABLE _asset_path_75 AS
+                WITH RECURSIVE tree(id, path) AS (
+                    SELECT id, '/' FROM asset WHERE parent_id IS NULL
+                    UNION ALL
+                    SELECT a.id, CASE t.path WHEN '/' THEN '' ELSE t.path END || '/' || a.name FROM asset AS a JOIN tree AS t ON a.parent_id = t.id
+                )
+                SELECT id, path FROM tree"""
+            )
+            db.execute_sql('CREATE INDEX _asset_path_75_id ON _asset_path_75 ("id")')
+            db.execute_sql(
+                "UPDATE asset SET path = (SELECT p.path FROM _asset_path_75 AS p WHERE p.id = asset.id) WHERE id IN (SELECT id FROM _asset_path_75)"
+            )
+            db.execute_sql("DROP TABLE _asset_path_75")
+            db.execute_sql(
+                'CREATE INDEX IF NOT EXISTS "asset_owner_id_path" ON "asset" ("owner_id", "path")'
+            )
+    elif version == 76:
+        # Add UnreferencedAssetFile, the asset files the asset collector found unused
+        with db.atomic():
+            db.execute_sql(
+                'CREATE TABLE IF NOT EXISTS "unreferenced_asset_file" ("file_hash" TEXT NOT NULL PRIMARY KEY, "since" REAL NOT NULL)'
+            )
     else:
         raise UnknownVersionException(
             f"No upgrade code for save format {version} was found."
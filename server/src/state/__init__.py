@@ -1,5 +1,17 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Generator, Generic, Tuple, TypeVar
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Generic,
+    Hashable,
+    List,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from peewee import ForeignKeyField, Model
 
 from ..models import User
 
@@ -8,15 +20,39 @@ T = TypeVar("T")
 
 
 class State(ABC, Generic[T]):
+    # Attributes of the stored values that get_sids can look up without scanning all sids.
+    # Foreign keys are indexed by their raw id, so building the index never loads the related row.
+    indexed_options: Tuple[str, ...] = ()
+
     def __init__(self) -> None:
         self._sid_map: Dict[str, T] = {}
+        self._indices: Dict[str, Dict[Hashable, Set[str]]] = {
+            option: {} for option in self.indexed_options
+        }
+        self._sid_keys: Dict[str, Dict[str, Hashable]] = {}
 
     async def add_sid(self, sid: str, value: T) -> None:
+        if sid in self._sid_map:
+            self._unindex(sid)
         self._sid_map[sid] = value
+        self._index(sid)
 
     async def remove_sid(self, sid: str) -> None:
+        self._unindex(sid)
         del self._sid_map[sid]
 
+    def update_sid(self, sid: str) -> None:
+        """
+        Refreshes the indices of a sid.
+
+        This has to be called whenever one of the indexed attributes of the stored value changes,
+        e.g. when a player changes location.
+        """
+        if sid not in self._sid_map:
+            return
+        self._unindex(sid)
+        self._index(sid)
+
     def has_sid(self, sid: str) -> bool:
         return sid in self._sid_map
 
@@ -28,13 +64,28 @@ class State(ABC, Generic[T]):
         pass
 
     def get_sids(self, skip_sid=None, **options) -> Generator[str, None, None]:
-        for sid, value in dict(self._sid_map).items():
-            if skip_sid == sid:
+        candidates: List[str]
+        indexed = [option for option in options if option in self._indices]
+        if indexed:
+            matches = sorted(
+                (
+                    self._indices[option].get(_lookup_key(options[option]), set())
+                    for option in indexed
+                ),
+                key=len,
+            )
+            candidates = list(matches[0].intersection(*matches[1:]))
+        else:
+            candidates = list(self._sid_map)
+
+        for sid in candidates:
+            if skip_sid == sid or sid not in self._sid_map:
                 continue
 
             if all(
                 getattr(self.get(sid), option, None) == value
                 for option, value in options.items()
+                if option not in self._indices
             ):
                 yield sid
 
@@ -45,3 +96,31 @@ class State(ABC, Generic[T]):
     def get_users(self, **options) -> Generator[Tuple[str, User], None, None]:
         for sid in self.get_sids(**options):
             yield sid, self.get_user(sid)
+
+    def _index(self, sid: str) -> None:
+        value = self._sid_map[sid]
+        keys = {option: _value_key(value, option) for option in self.indexed_options}
+        for option, key in keys.items():
+            self._indices[option].setdefault(key, set()).add(sid)
+        self._sid_keys[sid] = keys
+
+    def _unindex(self, sid: str) -> None:
+        for option, key in self._sid_keys.pop(sid, {}).items():
+            sids = self._indices[option][key]
+            sids.discard(sid)
+            if not sids:
+                del self._indices[option][key]
+
+
+def _value_key(value: Any, option: str) -> Hashable:
+    if isinstance(value, Model):
+        field = value._meta.fields.get(option)
+        if isinstance(field, ForeignKeyField):
+            return value.__data__.get(option)
+    return _lookup_key(getattr(value, option, None))
+
+
+def _lookup_key(value: Any) -> Hashable:
+    if isinstance(value, Model):
+        return value.get_id()
+    return value
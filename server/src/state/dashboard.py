@@ -4,6 +4,8 @@ from . import State
 
 
 class DashboardState(State[User]):
+    indexed_options = ("id",)
+
     def __init__(self) -> None:
         super().__init__()
 
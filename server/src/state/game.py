@@ -3,11 +3,14 @@ from typing import Dict, Set
 from ..api.socket.constants import GAME_NS
 from ..app import app, sio
 from ..data_types.location import LocationOptions
-from ..models import PlayerRoom, User
+from ..models import Location, PlayerRoom, User
+from ..models.role import Role
 from . import State
 
 
 class GameState(State[PlayerRoom]):
+    indexed_options = ("room", "active_location", "player", "role")
+
     def __init__(self) -> None:
         super().__init__()
         self.client_temporaries: Dict[str, Set[str]] = {}
@@ -21,6 +24,39 @@ class GameState(State[PlayerRoom]):
         del self.client_locations[sid]
         await super().remove_sid(sid)
 
+    def enter_location(self, sid: str, location: Location) -> None:
+        """
+        Adds the sid to the socket.io rooms of a location.
+
+        Next to the room of the location itself, the sid joins either the dm or the players room
+        and a room shared with the other sessions of the same user on that location.
+        These allow sending visibility dependent data with one emit per audience.
+        """
+        pr = self.get(sid)
+        sio.enter_room(sid, location.get_path(), namespace=GAME_NS)
+        if pr.role == Role.DM:
+            sio.enter_room(sid, location.get_dm_path(), namespace=GAME_NS)
+        else:
+            sio.enter_room(sid, location.get_players_path(), namespace=GAME_NS)
+        sio.enter_room(sid, location.get_player_path(pr.player_id), namespace=GAME_NS)
+
+    def leave_location(self, sid: str, location: Location) -> None:
+        pr = self.get(sid)
+        for room in (
+            location.get_path(),
+            location.get_dm_path(),
+            location.get_players_path(),
+            location.get_player_path(pr.player_id),
+        ):
+            sio.leave_room(sid, room, namespace=GAME_NS)
+
+    def set_role(self, sid: str, role: Role) -> None:
+        pr = self.get(sid)
+        self.leave_location(sid, pr.active_location)
+        pr.role = role
+        self.update_sid(sid)
+        self.enter_location(sid, pr.active_location)
+
     async def clear_temporaries(self, sid: str) -> None:
         if sid in self.client_temporaries:
             await sio.emit(
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..config import config
+from ..logs import logger
+from ..utils import TEMP_DIR
+
+SPOOL_PREFIX = "import-"
+SPOOL_SUFFIX = ".pac.part"
+
+
+class PendingImport:
+    def __init__(
+        self, path: Path, total_chunks: int, chunk_size: int, group: Sequence[str]
+    ) -> None:
+        self.path = path
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+        # Names of all files that are imported together with this one
+        self.group = group
+        self.checksums: Dict[int, str] = {}
+        self.last_activity = time.monotonic()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.checksums) == self.total_chunks
+
+    def accepts(self, chunk: int, size: int) -> bool:
+        if not (0 <= chunk < self.total_chunks):
+            return False
+        if chunk == self.total_chunks - 1:
+            return 0 < size <= self.chunk_size
+        return size == self.chunk_size
+
+    def write(self, chunk: int, data: bytes) -> str:
+        """Writes the chunk at its offset in the spool file and returns its checksum."""
+        with open(self.path, "r+b") as f:
+            f.seek(chunk * self.chunk_size)
+            f.write(data)
+        checksum = hashlib.sha256(data).hexdigest()
+        self.checksums[chunk] = checksum
+        self.last_activity = time.monotonic()
+        return checksum
+
+
+class ImportSpool:
+    """
+    Campaign uploads are received in chunks, possibly out of order and spread over multiple attempts.
+
+    Every chunk is written to a spool file in the temp folder at its offset as soon as it arrives,
+    so an upload is never held in memory.
+    The checksums of the received chunks are kept,
+    which allows clients to resume an interrupted upload by only sending the chunks that are missing or damaged.
+
+    Files that belong together, like a differential export and the exports it is based on,
+    are uploaded as a group and only handed over once every file of the group is complete.
+
+    Uploads whose group has not received a chunk for `ttl` seconds are removed,
+    as are spool files left behind by a previous run of the server.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._imports: Dict[Tuple[int, str], PendingImport] = {}
+
+    def start(
+        self,
+        user_id: int,
+        name: str,
+        total_chunks: int,
+        chunk_size: int,
+        group: Sequence[str],
+    ) -> PendingImport:
+        """
+        Returns the pending upload of the file, a new one is started if there is no upload with the same layout yet.
+        """
+        key = (user_id, name)
+        pending = self._imports.get(key)
+        if pending is not None:
+            if (
+                pending.total_chunks == total_chunks
+                and pending.chunk_size == chunk_size
+            ):
+                pending.group = group
+                pending.last_activity = time.monotonic()
+                return pending
+            self.discard(user_id, name)
+
+        path = TEMP_DIR / f"{SPOOL_PREFIX}{uuid.uuid4().hex}{SPOOL_SUFFIX}"
+        TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        path.touch()
+        pending = self._imports[key] = PendingImport(
+            path, total_chunks, chunk_size, group
+        )
+        return pending
+
+    def get(self, user_id: int, name: str) -> Optional[PendingImport]:
+        return self._imports.get((user_id, name))
+
+    def finish(self, user_id: int, name: str) -> Optional[List[Path]]:
+        """
+        Returns the spool files of the group of the complete upload if all of them are complete, None otherwise.
+
+        The group is no longer tracked, the caller becomes responsible for removing the spool files.
+        """
+        group = self._imports[(user_id, name)].group
+        members = [self._imports.get((user_id, member)) for member in group]
+        paths = []
+        for pending in members:
+            if pending is None or not pending.complete:
+                return None
+            paths.append(pending.path)
+        for member in group:
+            del self._imports[(user_id, member)]
+        return paths
+
+    def discard(self, user_id: int, name: str) -> None:
+        pending = self._imports.pop((user_id, name), None)
+        if pending is not None:
+            pending.path.unlink(missing_ok=True)
+
+    def remove_stale(self) -> None:
+        now = time.monotonic()
+        for (user_id, name), pending in list(self._imports.items()):
+            # Complete uploads are kept while other files of their group are still being received
+            last_activity = max(
+                member.last_activity
+                for member in (
+                    self._imports.get((user_id, other), pending)
+                    for other in pending.group
+                )
+            )
+            if now - last_activity > self.ttl:
+                logger.info(f"Removing stale campaign upload {name}")
+                self.discard(user_id, name)
+
+        tracked = {pending.path for pending in self._imports.values()}
+        for path in TEMP_DIR.glob(f"{SPOOL_PREFIX}*{SPOOL_SUFFIX}"):
+            if path not in tracked and time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+
+    async def run(self) -> None:
+        while True:
+            self.remove_stale()
+            await asyncio.sleep(self.ttl / 2)
+
+
+import_spool = ImportSpool(
+    config.getfloat("General", "stale_import_timeout_in_seconds", fallback=3600)
+)
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from ..config import config
+from ..logs import logger
+from ..metrics import DURATION_BUCKETS, Histogram
+from ..models.db import db_executor
+from ..models.shape import Polygon, Shape
+
+
+class ShapePosition(NamedTuple):
+    x: float
+    y: float
+    angle: float
+    vertices: Optional[List[List[float]]] = None
+
+    def apply(self, data: Dict[str, Any]) -> None:
+        """Overwrites the position in serialized shape data."""
+        data["x"] = self.x
+        data["y"] = self.y
+        data["angle"] = self.angle
+        if self.vertices is not None and "vertices" in data:
+            data["vertices"] = self.vertices
+
+
+class PositionBuffer:
+    """
+    Write-behind store for shape positions.
+
+    Position updates are kept in memory and written to the database in a single transaction
+    every `interval` seconds and when the server shuts down.
+    Repeated moves of the same shape in between flushes result in a single write.
+
+    A pending position is the authoritative position of its shape,
+    it is applied when the shape is serialized or saved before the buffer is flushed.
+    Flushes run on the database writer thread, positions that are being written are still served until they are committed.
+    When a flush fails its positions are kept for the next one, unless the shape has moved again since.
+
+    Model signals of writes on the writer thread use the buffer as well, so it is guarded by a lock.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.flush_duration = Histogram(DURATION_BUCKETS)
+        self.failed_flushes = 0
+        self._positions: Dict[str, ShapePosition] = {}
+        self._flushing: Dict[str, ShapePosition] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._positions)
+
+    def set(self, shape_id: str, position: ShapePosition) -> None:
+        with self._lock:
+            self._positions[shape_id] = position
+
+    def get(self, shape_id: str) -> Optional[ShapePosition]:
+        with self._lock:
+            position = self._positions.get(shape_id)
+            if position is None:
+                position = self._flushing.get(shape_id)
+            return position
+
+    def pop(self, shape_id: str) -> Optional[ShapePosition]:
+        with self._lock:
+            position = self._positions.pop(shape_id, None)
+            # A position that is being written would overwrite the save that popped it
+            flushing = self._flushing.pop(shape_id, None)
+            return flushing if position is None else position
+
+    async def flush(self) -> None:
+        with self._lock:
+            if not self._positions:
+                return
+            positions = self._flushing = self._positions
+            self._positions = {}
+
+        await db_executor.write(self._write, positions)
+
+    def _write(self, positions: Dict[str, ShapePosition]) -> None:
+        start = time.perf_counter()
+        try:
+            with db_executor.database.atomic():
+                for shape_id, position in list(positions.items()):
+                    Shape.update(
+                        x=position.x, y=position.y, angle=position.angle
+                    ).where(Shape.uuid == shape_id).execute()
+                    if position.vertices is not None:
+                        Polygon.update(vertices=json.dumps(position.vertices)).where(
+                            Polygon.shape == shape_id
+                        ).execute()
+        except Exception:
+            with self._lock:
+                self.failed_flushes += 1
+                for shape_id, position in positions.items():
+                    self._positions.setdefault(shape_id, position)
+            raise
+        finally:
+            with self._lock:
+                if self._flushing is positions:
+                    self._flushing = {}
+
+        duration = time.perf_counter() - start
+        self.flush_duration.observe(duration)
+        logger.debug(f"Flushed {len(positions)} shape positions in {duration:.4f}s")
+
+    def render(self) -> str:
+        """Returns the buffer metrics in the Prometheus text format."""
+        lines = [
+            "# HELP planarally_pending_positions Shape positions waiting to be written to the database.",
+            "# TYPE planarally_pending_positions gauge",
+            f"planarally_pending_positions {self.pending}",
+            "# HELP planarally_position_flush_failures_total Position flushes that failed and were retried.",
+            "# TYPE planarally_position_flush_failures_total counter",
+            f"planarally_position_flush_failures_total {self.failed_flushes}",
+            "# HELP planarally_position_flush_duration_seconds Time spent writing pending positions to the database.",
+            "# TYPE planarally_position_flush_duration_seconds histogram",
+            *self.flush_duration.render("planarally_position_flush_duration_seconds"),
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush shape positions")
+
+
+position_buffer = PositionBuffer(
+    config.getfloat("General", "position_flush_interval_in_seconds", fallback=1.0)
+)
@@ -0,0 +1,179 @@
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Hashable, Iterator, Optional, Set, Tuple
+
+from ..config import config
+from .position import ShapePosition
+
+
+class SnapshotCache:
+    """
+    In-memory cache of serialized location data.
+
+    Every location has a version that changes whenever its content changes, which is signalled with `bump`.
+    Loads take the version before serializing off the event loop and only store their data if it is unchanged.
+    Socket handlers that change a location are marked with `changes_location`,
+    the location is not served from or stored in the cache while they run.
+
+    Moving shapes does not change the version, the positions are recorded with `move` instead
+    and applied to the cached data when it is served.
+
+    Only locations with entries or loads in progress keep a version and their moves.
+    All other locations share a base version that moves forward whenever a location stops being tracked,
+    so a location never returns to a version it had before.
+
+    The cache is bounded by the serialized size of its entries, the least recently used entries are evicted first.
+    Model signals of writes on the database writer thread bump versions as well, so the cache is guarded by a lock.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self._base_version = 0
+        self._lock = threading.Lock()
+        self._versions: Dict[int, int] = {}
+        self._moves: Dict[int, Dict[str, ShapePosition]] = {}
+        self._changing: "Counter[int]" = Counter()
+        self._keys: Dict[int, Set[Hashable]] = {}
+        self._entries: "OrderedDict[Tuple[int, Hashable], Tuple[int, Any]]" = (
+            OrderedDict()
+        )
+
+    def get_version(self, location_id: int) -> int:
+        """Returns the version of the location, its moves are recorded from here on until the location is bumped."""
+        with self._lock:
+            self._moves.setdefault(location_id, {})
+            return self._versions.setdefault(location_id, self._base_version)
+
+    def bump(self, location_id: int) -> None:
+        with self._lock:
+            self._drop(location_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._versions.clear()
+            self._moves.clear()
+            self.size = 0
+            self._base_version += 1
+
+    @contextmanager
+    def changing(self, location_id: int) -> Iterator[None]:
+        """Keeps the location out of the cache while the block runs and bumps it before and after."""
+        with self._lock:
+            self._changing[location_id] += 1
+            self._drop(location_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._changing[location_id] -= 1
+                if not self._changing[location_id]:
+                    del self._changing[location_id]
+                self._drop(location_id)
+
+    def move(self, location_id: int, shape_id: str, position: ShapePosition) -> None:
+        with self._lock:
+            moves = self._moves.get(location_id)
+            if moves is not None:
+                moves[shape_id] = position
+
+    def get(self, location_id: int, key: Hashable) -> Optional[Any]:
+        entry_key = (location_id, key)
+        with self._lock:
+            if location_id in self._changing:
+                return None
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(entry_key)
+            return entry[1]
+
+    def get_moves(self, location_id: int) -> Dict[str, ShapePosition]:
+        """Returns the positions of the shapes that moved since the location was last bumped."""
+        with self._lock:
+            return dict(self._moves.get(location_id, {}))
+
+    def set(
+        self, location_id: int, key: Hashable, value: Any, size: int, version: int
+    ) -> None:
+        """
+        Stores the value with its serialized size, which the caller measures off the event loop.
+
+        The value is only stored if the location is still at the version it was loaded at.
+        """
+        entry_key = (location_id, key)
+        with self._lock:
+            if (
+                self._versions.get(location_id) != version
+                or location_id in self._changing
+            ):
+                return
+
+            if size > self.max_size:
+                if entry_key in self._entries:
+                    self._remove(entry_key)
+                return
+
+            # Replacing an entry keeps the location tracked, the moves recorded during this load still apply
+            previous = self._entries.pop(entry_key, None)
+            if previous is not None:
+                self.size -= previous[0]
+            self._keys.setdefault(location_id, set()).add(key)
+            self._entries[entry_key] = (size, value)
+            self.size += size
+
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _drop(self, location_id: int) -> None:
+        for key in list(self._keys.get(location_id, ())):
+            self._remove((location_id, key))
+        self._untrack(location_id)
+
+    def _untrack(self, location_id: int) -> None:
+        # Loads in progress of a location that is no longer tracked must not store their data
+        self._versions.pop(location_id, None)
+        self._moves.pop(location_id, None)
+        self._base_version += 1
+
+    def _remove(self, entry_key: Tuple[int, Hashable]) -> None:
+        size, _ = self._entries.pop(entry_key)
+        self.size -= size
+
+        location_id, key = entry_key
+        keys = self._keys[location_id]
+        keys.discard(key)
+        if not keys:
+            del self._keys[location_id]
+            self._untrack(location_id)
+
+
+def changes_location(fn):
+    """
+    Decorator for game socket handlers that change the active location of the client.
+
+    The cached data of the location is not served while the handler runs and dropped when it is done.
+    Changes flagged as temporary are not stored in the database and leave the cache alone.
+    """
+
+    @wraps(fn)
+    async def wrapped(sid: str, *args, **kwargs):
+        from .game import game_state
+
+        if args and isinstance(args[0], dict) and args[0].get("temporary"):
+            return await fn(sid, *args, **kwargs)
+
+        with snapshot_cache.changing(game_state.get(sid).active_location_id):
+            return await fn(sid, *args, **kwargs)
+
+    return wrapped
+
+
+snapshot_cache = SnapshotCache(
+    config.getint("General", "snapshot_cache_size_in_bytes", fallback=52_428_800)
+)
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Tuple
+
+from ..assets import precompress, reuse_asset_file
+from ..config import config
+from ..logs import logger
+from ..utils import ASSETS_DIR
+
+# Partial uploads live on the same file system as the assets, so that complete files can be moved in place atomically
+UPLOADS_DIR = ASSETS_DIR / ".uploads"
+
+# Slices that arrive before the slices preceding them are kept in memory until they can be written
+MAX_EARLY_SLICES = 16
+
+
+class PendingUpload:
+    def __init__(self, sid: str, path: Path, total_slices: int) -> None:
+        self.sid = sid
+        self.path = path
+        self.total_slices = total_slices
+        self.next_slice = 0
+        self.early_slices: Dict[int, bytes] = {}
+        self.sha1 = hashlib.sha1()
+        self.last_activity = time.monotonic()
+
+    @property
+    def complete(self) -> bool:
+        return self.next_slice == self.total_slices
+
+    def add(self, slice_: int, data: bytes) -> None:
+        """Appends the slice and any early slices following it to the file, slices that were already written are ignored."""
+        self.last_activity = time.monotonic()
+        if not (0 <= slice_ < self.total_slices):
+            raise ValueError(f"Slice {slice_} is out of range")
+        if slice_ < self.next_slice:
+            return
+
+        self.early_slices[slice_] = data
+        if len(self.early_slices) > MAX_EARLY_SLICES:
+            raise ValueError("Too many slices arrived out of order")
+
+        with open(self.path, "ab") as f:
+            while self.next_slice in self.early_slices:
+                data = self.early_slices.pop(self.next_slice)
+                f.write(data)
+                self.sha1.update(data)
+                self.next_slice += 1
+
+    def store(self) -> str:
+        """Moves the complete file into the assets folder under its hash and returns the hash."""
+        file_hash = self.sha1.hexdigest()
+        if reuse_asset_file(file_hash):
+            self.path.unlink()
+        else:
+            os.replace(self.path, ASSETS_DIR / file_hash)
+            precompress(file_hash)
+        return file_hash
+
+
+class AssetUploads:
+    """
+    Assets are uploaded in small slices, which are appended to a file in `UPLOADS_DIR` as they arrive.
+
+    The sha1 of the file is updated with every slice,
+    so the memory used by an upload does not depend on the size of the file
+    and the complete file can be moved into the assets folder without reading it again.
+
+    Uploads are dropped when their client disconnects or when they have not received a slice for `ttl` seconds,
+    files left behind by a previous run of the server are removed as well.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._uploads: Dict[Tuple[str, str], PendingUpload] = {}
+
+    def get_or_start(
+        self, sid: str, upload_uuid: str, total_slices: int
+    ) -> PendingUpload:
+        key = (sid, upload_uuid)
+        pending = self._uploads.get(key)
+        if pending is not None:
+            if pending.total_slices != total_slices:
+                raise ValueError("The number of slices of the upload changed")
+            return pending
+
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+        path = UPLOADS_DIR / uuid.uuid4().hex
+        path.touch()
+        pending = self._uploads[key] = PendingUpload(sid, path, total_slices)
+        return pending
+
+    def finish(self, sid: str, upload_uuid: str) -> PendingUpload:
+        """Stops tracking the complete upload, the caller becomes responsible for its file."""
+        return self._uploads.pop((sid, upload_uuid))
+
+    def discard(self, sid: str, upload_uuid: str) -> None:
+        pending = self._uploads.pop((sid, upload_uuid), None)
+        if pending is not None:
+            pending.path.unlink(missing_ok=True)
+
+    def discard_sid(self, sid: str) -> None:
+        for key in [key for key in self._uploads if key[0] == sid]:
+            self.discard(*key)
+
+    def remove_stale(self) -> None:
+        now = time.monotonic()
+        for (sid, upload_uuid), pending in list(self._uploads.items()):
+            if now - pending.last_activity > self.ttl:
+                logger.info(f"Removing stale asset upload {upload_uuid}")
+                self.discard(sid, upload_uuid)
+
+        if not UPLOADS_DIR.exists():
+            return
+        tracked = {pending.path for pending in self._uploads.values()}
+        for path in UPLOADS_DIR.iterdir():
+            if (
+                path.is_file()
+                and path not in tracked
+                and time.time() - path.stat().st_mtime > self.ttl
+            ):
+                path.unlink(missing_ok=True)
+
+    async def run(self) -> None:
+        while True:
+            self.remove_stale()
+            await asyncio.sleep(self.ttl / 2)
+
+
+asset_uploads = AssetUploads(
+    config.getfloat("General", "stale_asset_upload_timeout_in_seconds", fallback=600)
+)
@@ -2,6 +2,10 @@ from typing import TYPE_CHECKING, Callable, Optional, Union, overload
 
 import socketio
 
+from .metrics import event_metrics
+
+UNKNOWN_EVENT = "unknown"
+
 
 class TypedAsyncServer(socketio.AsyncServer):
     def __init__(self, **kwargs):
@@ -9,6 +13,25 @@ class TypedAsyncServer(socketio.AsyncServer):
             async_mode="aiohttp", engineio_logger=False, logger=False, **kwargs
         )
 
+    # The two overrides below hook into internals of python-socketio to collect the event metrics
+
+    async def _trigger_event(self, event, namespace, *args):
+        # Clients can send any event name, those without a handler share a label to keep the metrics bounded
+        label = event if event in self.handlers.get(namespace, {}) else UNKNOWN_EVENT
+        return await event_metrics.track(
+            label,
+            super()._trigger_event(event, namespace, *args),
+            sid=args[0] if args else None,
+        )
+
+    async def _send_packet(self, eio_sid, pkt):
+        encoded_packet = pkt.encode()
+        if not isinstance(encoded_packet, list):
+            encoded_packet = [encoded_packet]
+        for ep in encoded_packet:
+            event_metrics.record_send(len(ep))
+            await self.eio.send(eio_sid, ep)
+
     if TYPE_CHECKING:
 
         @overload
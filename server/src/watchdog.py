@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Optional
+
+from .config import config
+from .logs import logger
+from .metrics import DURATION_BUCKETS, EventMetrics, Histogram
+from .state.game import game_state
+
+# Time in seconds between two lag measurements
+LAG_INTERVAL = 0.1
+
+
+class LoopWatchdog:
+    """
+    Measures how late the event loop is in running its scheduled work.
+
+    A helper thread keeps an eye on the loop, if it has been blocked for longer than `threshold`
+    the stack of the loop thread is logged together with the socket event that is being handled.
+    """
+
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.lag = Histogram(DURATION_BUCKETS)
+        self._heartbeat = time.monotonic()
+        self._reported: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+
+    def render(self) -> str:
+        """Returns the lag histogram in the Prometheus text format."""
+        name = "planarally_event_loop_lag_seconds"
+        lines = [
+            f"# HELP {name} Delay of scheduled work on the event loop.",
+            f"# TYPE {name} histogram",
+            *self.lag.render(name),
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def run(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+        while True:
+            start = time.monotonic()
+            self._heartbeat = start
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(0.0, time.monotonic() - start - LAG_INTERVAL)
+            self.lag.observe(lag)
+            if lag >= self.threshold:
+                logger.warning(f"Event loop was blocked for {lag:.3f}s")
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.threshold / 2)
+
+            heartbeat = self._heartbeat
+            lag = time.monotonic() - heartbeat - LAG_INTERVAL
+            if lag < self.threshold or heartbeat == self._reported:
+                continue
+            self._reported = heartbeat
+
+            frame = sys._current_frames().get(self._loop_thread_id)  # type: ignore
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(
+                f"Event loop blocked for more than {lag:.3f}s{_describe_event(frame)}, current stack:\n{stack}"
+            )
+
+
+def _describe_event(frame: Optional[FrameType]) -> str:
+    while frame is not None:
+        if frame.f_code is EventMetrics.track.__code__:
+            break
+        frame = frame.f_back
+    else:
+        return ""
+
+    description = f" while handling {frame.f_locals.get('event')}"
+    sid = frame.f_locals.get("sid")
+    if sid is not None and game_state.has_sid(sid):
+        pr = game_state.get(sid)
+        description += f" (room {pr.room_id}, location {pr.active_location_id})"
+    return description
+
+
+loop_watchdog = LoopWatchdog(
+    config.getfloat("General", "loop_stall_threshold_in_seconds", fallback=0.25)
+)
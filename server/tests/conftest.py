@@ -0,0 +1,16 @@
+import tempfile
+from pathlib import Path
+
+from src.models.db import db
+from src.save import SAVE_VERSION, create_new_db
+
+# The app reads its secret from the save when it is imported,
+# so the tests switch to a fresh save before any test module imports it.
+_save_dir = tempfile.TemporaryDirectory()
+db.init(str(Path(_save_dir.name) / "planar.sqlite"))
+create_new_db(db, SAVE_VERSION)
+
+
+def pytest_unconfigure(config):
+    db.close()
+    _save_dir.cleanup()
@@ -0,0 +1,76 @@
+import os
+import time
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from src import asset_collector as collector_module
+from src.asset_collector import AssetCollector
+from src.models import Asset, UnreferencedAssetFile, User, UserOptions
+
+GRACE_PERIOD = 3600
+USED = "a" * 40
+UNUSED = "b" * 40
+
+
+@pytest.fixture
+def assets_dir(tmp_path: Path, monkeypatch) -> Iterator[Path]:
+    monkeypatch.setattr(collector_module, "ASSETS_DIR", tmp_path)
+    user = User.create(
+        name="collector", password_hash="", default_options=UserOptions.create()
+    )
+    Asset.create(owner=user, name="used", file_hash=USED)
+    for name in (USED, UNUSED, f"{UNUSED}.br", "c" * 39, "upload.tmp"):
+        (tmp_path / name).write_bytes(b"data")
+        # The files have not been touched since long before the tests mark them
+        written = time.time() - 10 * GRACE_PERIOD
+        os.utime(tmp_path / name, (written, written))
+    yield tmp_path
+    UnreferencedAssetFile.delete().execute()
+    user.delete_instance(recursive=True)
+
+
+def age_marks(seconds: float) -> None:
+    UnreferencedAssetFile.update(since=UnreferencedAssetFile.since - seconds).execute()
+
+
+def test_unused_files_are_marked_before_they_are_removed(assets_dir: Path):
+    collector = AssetCollector(0, GRACE_PERIOD)
+
+    assert collector.collect().files == 0
+    assert [mark.file_hash for mark in UnreferencedAssetFile.select()] == [UNUSED]
+
+    # Only marks that are older than the grace period expire, not the files themselves
+    age_marks(GRACE_PERIOD - 60)
+    assert collector.collect().files == 0
+
+    age_marks(120)
+    assert collector.collect().files == 2
+    assert sorted(path.name for path in assets_dir.iterdir()) == sorted(
+        [USED, "c" * 39, "upload.tmp"]
+    )
+
+
+def test_files_that_are_used_again_lose_their_mark(assets_dir: Path):
+    collector = AssetCollector(0, GRACE_PERIOD)
+    collector.collect()
+
+    user = User.get(name="collector")
+    Asset.create(owner=user, name="unused", file_hash=UNUSED)
+    age_marks(2 * GRACE_PERIOD)
+
+    assert collector.collect().files == 0
+    assert UnreferencedAssetFile.select().count() == 0
+
+
+def test_reused_files_are_marked_anew(assets_dir: Path):
+    collector = AssetCollector(0, GRACE_PERIOD)
+    collector.collect()
+    age_marks(2 * GRACE_PERIOD)
+
+    # Reusing a file touches it, e.g. an upload of the same image that has not created its asset yet
+    os.utime(assets_dir / UNUSED)
+
+    assert collector.collect().files == 0
+    assert UnreferencedAssetFile.get_by_id(UNUSED).since > time.time() - 60
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from src import assets
+from src.state import uploads
+from src.state.uploads import MAX_EARLY_SLICES, AssetUploads
+
+TTL = 60
+SID = "sid"
+
+
+@pytest.fixture
+def asset_uploads(tmp_path: Path, monkeypatch) -> AssetUploads:
+    monkeypatch.setattr(assets, "ASSETS_DIR", tmp_path)
+    monkeypatch.setattr(uploads, "ASSETS_DIR", tmp_path)
+    monkeypatch.setattr(uploads, "UPLOADS_DIR", tmp_path / ".uploads")
+    return AssetUploads(TTL)
+
+
+def test_slices_are_written_in_order(asset_uploads: AssetUploads, tmp_path: Path):
+    pending = asset_uploads.get_or_start(SID, "upload", 4)
+
+    for slice_ in (2, 0, 3, 0, 1):
+        pending.add(slice_, f"<{slice_}>".encode())
+        # Slices are written as soon as the slices before them have arrived
+        assert len(pending.early_slices) <= 2
+
+    assert pending.complete
+    data = b"<0><1><2><3>"
+    assert pending.path.read_bytes() == data
+
+    file_hash = asset_uploads.finish(SID, "upload").store()
+    assert file_hash == hashlib.sha1(data).hexdigest()
+    assert (tmp_path / file_hash).read_bytes() == data
+    assert not pending.path.exists()
+
+
+def test_upload_of_a_known_file_reuses_it(asset_uploads: AssetUploads, tmp_path: Path):
+    data = b"known"
+    file_hash = hashlib.sha1(data).hexdigest()
+    (tmp_path / file_hash).write_bytes(data)
+
+    pending = asset_uploads.get_or_start(SID, "upload", 1)
+    pending.add(0, data)
+
+    assert asset_uploads.finish(SID, "upload").store() == file_hash
+    assert not pending.path.exists()
+
+
+@pytest.mark.parametrize("slice_", [-1, 4])
+def test_slices_out_of_range_are_refused(asset_uploads: AssetUploads, slice_: int):
+    pending = asset_uploads.get_or_start(SID, "upload", 4)
+    with pytest.raises(ValueError):
+        pending.add(slice_, b"data")
+
+
+def test_early_slices_are_capped(asset_uploads: AssetUploads):
+    pending = asset_uploads.get_or_start(SID, "upload", MAX_EARLY_SLICES + 2)
+
+    for slice_ in range(1, MAX_EARLY_SLICES + 1):
+        pending.add(slice_, b"data")
+    with pytest.raises(ValueError):
+        pending.add(MAX_EARLY_SLICES + 1, b"data")
+
+    assert pending.path.read_bytes() == b""
+
+
+def test_number_of_slices_can_not_change(asset_uploads: AssetUploads):
+    asset_uploads.get_or_start(SID, "upload", 4)
+    with pytest.raises(ValueError):
+        asset_uploads.get_or_start(SID, "upload", 5)
+
+
+def test_uploads_of_a_disconnected_client_are_removed(asset_uploads: AssetUploads):
+    pending = asset_uploads.get_or_start(SID, "upload", 4)
+    other = asset_uploads.get_or_start("other", "upload", 4)
+
+    asset_uploads.discard_sid(SID)
+
+    assert not pending.path.exists()
+    assert other.path.exists()
+
+
+def test_stale_uploads_are_removed(asset_uploads: AssetUploads):
+    stale = asset_uploads.get_or_start(SID, "stale", 4)
+    stale.last_activity = time.monotonic() - TTL - 1
+    active = asset_uploads.get_or_start(SID, "active", 4)
+
+    # Left behind by a previous run of the server
+    orphan = uploads.UPLOADS_DIR / "orphan"
+    orphan.touch()
+    written = time.time() - TTL - 1
+    os.utime(orphan, (written, written))
+
+    asset_uploads.remove_stale()
+
+    assert not stale.path.exists()
+    assert active.path.exists()
+    assert not orphan.exists()
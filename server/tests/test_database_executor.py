@@ -0,0 +1,132 @@
+"""
+Checks the database executor and measures how long heavy writes block the event loop with and without it.
+
+Run with `-s` to see the measured delays.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Awaitable, Iterator
+
+import pytest
+
+from src.models import Location, LocationOptions, Rect, Room, Shape, User, UserOptions
+from src.models.db import db, db_executor
+
+SHAPES = 20_000
+# Delay of the measuring timer, anything the loop is late on top of this is lag
+TICK = 0.001
+
+
+@pytest.fixture(scope="module")
+def room() -> Iterator[Room]:
+    user = User.create(
+        name="executor", password_hash="", default_options=UserOptions.create()
+    )
+    room = Room.create(
+        name="executor", creator=user, default_options=LocationOptions.create()
+    )
+    yield room
+    room.delete_instance(recursive=True)
+    user.delete_instance(recursive=True)
+
+
+def create_location(room: Room, name: str) -> Location:
+    """Creates a location with a single layer that holds `SHAPES` rectangles."""
+    with db.atomic():
+        location = Location.create(room=room, name=name, index=0)
+        layer = location.create_floor().layers[0]
+        uuids = [f"{name}-{i}" for i in range(SHAPES)]
+        for i in range(0, SHAPES, 1000):
+            Shape.insert_many(
+                [
+                    {
+                        "uuid": uuid,
+                        "layer": layer,
+                        "type_": "rect",
+                        "x": 0,
+                        "y": 0,
+                        "index": j,
+                        "options": "[]",
+                    }
+                    for j, uuid in enumerate(uuids[i : i + 1000], i)
+                ]
+            ).execute()
+            Rect.insert_many(
+                [
+                    {"shape": uuid, "width": 1, "height": 1}
+                    for uuid in uuids[i : i + 1000]
+                ]
+            ).execute()
+    return location
+
+
+async def measure_lag(work: Awaitable) -> float:
+    """Returns the longest time the event loop was late in running a timer while `work` was awaited."""
+    lag = 0.0
+    done = False
+
+    async def tick():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lag = max(lag, time.perf_counter() - start - TICK)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    try:
+        await work
+    finally:
+        done = True
+        await ticker
+    return lag
+
+
+async def on_loop(location: Location) -> None:
+    with db.atomic():
+        location.delete_instance(recursive=True)
+
+
+def test_write_does_not_block_the_loop(room: Room):
+    location = create_location(room, "on-loop")
+    blocked = asyncio.run(measure_lag(on_loop(location)))
+
+    location = create_location(room, "on-writer")
+    offloaded = asyncio.run(
+        measure_lag(db_executor.write(location.delete_instance, recursive=True))
+    )
+
+    print(
+        f"\nLongest event loop delay while deleting a location with {SHAPES} shapes:"
+        f" {blocked * 1000:.1f}ms on the loop, {offloaded * 1000:.1f}ms on the writer thread"
+    )
+    assert Location.select().where(Location.room == room).count() == 0
+    assert offloaded < blocked / 4
+
+
+def test_write_runs_on_the_writer_thread():
+    name = asyncio.run(db_executor.write(lambda: threading.current_thread().name))
+    assert name == "db-write"
+
+
+def test_write_rolls_back_on_error(room: Room):
+    def create_and_fail():
+        Location.create(room=room, name="rolled-back", index=0)
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(db_executor.write(create_and_fail))
+    assert Location.get_or_none(room=room, name="rolled-back") is None
+
+
+def test_writes_run_in_order():
+    async def write_all():
+        return await asyncio.gather(
+            *(db_executor.write(order.append, i) for i in range(50))
+        )
+
+    order = []
+    asyncio.run(write_all())
+    assert order == list(range(50))
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from src.state import imports
+from src.state.imports import ImportSpool
+
+TTL = 60
+USER = 1
+CHUNK_SIZE = 4
+
+
+@pytest.fixture
+def spool(tmp_path: Path, monkeypatch) -> ImportSpool:
+    monkeypatch.setattr(imports, "TEMP_DIR", tmp_path)
+    return ImportSpool(TTL)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_chunks_are_written_at_their_offset(spool: ImportSpool):
+    pending = spool.start(USER, "full", 3, CHUNK_SIZE, ["full"])
+
+    for chunk, data in ((2, b"ij"), (0, b"abcd"), (1, b"efgh")):
+        assert pending.accepts(chunk, len(data))
+        assert pending.write(chunk, data) == sha256(data)
+
+    assert pending.complete
+    assert pending.path.read_bytes() == b"abcdefghij"
+
+
+@pytest.mark.parametrize(
+    "chunk, size",
+    [(-1, CHUNK_SIZE), (3, CHUNK_SIZE), (0, CHUNK_SIZE - 1), (2, 0), (2, 5)],
+)
+def test_chunks_outside_of_the_layout_are_refused(
+    spool: ImportSpool, chunk: int, size: int
+):
+    pending = spool.start(USER, "full", 3, CHUNK_SIZE, ["full"])
+    assert not pending.accepts(chunk, size)
+
+
+def test_interrupted_upload_resumes(spool: ImportSpool):
+    pending = spool.start(USER, "full", 3, CHUNK_SIZE, ["full"])
+    pending.write(0, b"abcd")
+    pending.write(2, b"ij")
+
+    # The client asks which chunks were received and only sends the missing one
+    resumed = spool.start(USER, "full", 3, CHUNK_SIZE, ["full"])
+    assert resumed is pending
+    assert resumed.checksums == {0: sha256(b"abcd"), 2: sha256(b"ij")}
+
+    resumed.write(1, b"efgh")
+    assert spool.finish(USER, "full") == [pending.path]
+    assert pending.path.read_bytes() == b"abcdefghij"
+    assert spool.get(USER, "full") is None
+
+
+def test_damaged_chunk_is_replaced(spool: ImportSpool):
+    pending = spool.start(USER, "full", 2, CHUNK_SIZE, ["full"])
+    pending.write(0, b"abXd")
+    pending.write(1, b"ef")
+
+    # The checksum of the damaged chunk does not match the one of the client, it is sent again
+    checksums = spool.start(USER, "full", 2, CHUNK_SIZE, ["full"]).checksums
+    assert checksums[0] != sha256(b"abcd")
+    assert checksums[1] == sha256(b"ef")
+
+    assert pending.write(0, b"abcd") == sha256(b"abcd")
+    assert pending.path.read_bytes() == b"abcdef"
+
+
+def test_upload_with_a_different_layout_starts_over(spool: ImportSpool):
+    pending = spool.start(USER, "full", 3, CHUNK_SIZE, ["full"])
+    pending.write(0, b"abcd")
+
+    restarted = spool.start(USER, "full", 2, 8, ["full"])
+
+    assert restarted is not pending
+    assert restarted.checksums == {}
+    assert not pending.path.exists()
+
+
+def test_group_is_finished_together(spool: ImportSpool):
+    group = ["full", "delta"]
+    full = spool.start(USER, "full", 1, CHUNK_SIZE, group)
+    delta = spool.start(USER, "delta", 1, CHUNK_SIZE, group)
+
+    full.write(0, b"full")
+    assert spool.finish(USER, "full") is None
+
+    delta.write(0, b"diff")
+    assert spool.finish(USER, "delta") == [full.path, delta.path]
+
+
+def test_stale_uploads_are_removed(spool: ImportSpool, tmp_path: Path):
+    group = ["full", "delta"]
+    stale = spool.start(USER, "stale", 2, CHUNK_SIZE, ["stale"])
+    full = spool.start(USER, "full", 1, CHUNK_SIZE, group)
+    delta = spool.start(USER, "delta", 2, CHUNK_SIZE, group)
+    full.write(0, b"full")
+    stale.last_activity = full.last_activity = time.monotonic() - TTL - 1
+
+    # Left behind by a previous run of the server
+    orphan = tmp_path / f"{imports.SPOOL_PREFIX}orphan{imports.SPOOL_SUFFIX}"
+    orphan.touch()
+    written = time.time() - TTL - 1
+    os.utime(orphan, (written, written))
+    recent = tmp_path / f"{imports.SPOOL_PREFIX}recent{imports.SPOOL_SUFFIX}"
+    recent.touch()
+
+    spool.remove_stale()
+
+    assert spool.get(USER, "stale") is None
+    assert not stale.path.exists()
+    # The complete file waits for the rest of its group, which is still active
+    assert spool.get(USER, "full") is full
+    assert spool.get(USER, "delta") is delta
+    assert not orphan.exists()
+    assert recent.exists()
@@ -0,0 +1,142 @@
+import copy
+import shutil
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from playhouse.sqlite_ext import SqliteExtDatabase
+
+from src.export.manifest import (
+    Manifest,
+    apply_delta,
+    check_delta,
+    check_manifest,
+    create_manifest,
+    remove_unchanged,
+)
+from src.models import ALL_MODELS, Label, User, UserOptions
+from src.models.db import open_db
+
+
+def open_export(path: Path) -> SqliteExtDatabase:
+    db = open_db(path)
+    # Like the exporter and importer, rows are removed regardless of the rows that reference them
+    db.foreign_keys = False
+    return db
+
+
+def create_export(path: Path) -> SqliteExtDatabase:
+    db = open_export(path)
+    with db.bind_ctx(ALL_MODELS):
+        db.create_tables(ALL_MODELS)
+        user = User.create(
+            name="manifest", password_hash="", default_options=UserOptions.create()
+        )
+        for name in ("kept", "changed", "removed"):
+            Label.create(uuid=name, user=user, name=name, visible=False)
+    return db
+
+
+def get_labels(db: SqliteExtDatabase) -> Dict[str, str]:
+    return dict(db.execute_sql("SELECT uuid, name FROM label").fetchall())
+
+
+@pytest.fixture
+def exports(tmp_path: Path):
+    """Returns a full export and a differential export of the changes made since, with their manifests."""
+    full = create_export(tmp_path / "full.sqlite")
+    full_manifest = create_manifest(full)
+    full.close()
+
+    shutil.copy(tmp_path / "full.sqlite", tmp_path / "delta.sqlite")
+    delta = open_export(tmp_path / "delta.sqlite")
+    delta.execute_sql("UPDATE label SET name = 'new name' WHERE uuid = 'changed'")
+    delta.execute_sql("DELETE FROM label WHERE uuid = 'removed'")
+    delta.execute_sql(
+        "INSERT INTO label (uuid, user_id, name, visible) SELECT 'added', id, 'added', 1 FROM user"
+    )
+    delta_manifest = create_manifest(delta)
+    remove_unchanged(delta, delta_manifest, full_manifest)
+    yield tmp_path, full_manifest, delta, delta_manifest
+    delta.close()
+
+
+def test_remove_unchanged(exports):
+    _, full_manifest, delta, delta_manifest = exports
+
+    assert get_labels(delta) == {"changed": "new name", "added": "added"}
+    assert delta.execute_sql("SELECT COUNT(*) FROM user").fetchone() == (0,)
+    assert delta_manifest["base"] == full_manifest["id"]
+    assert delta_manifest["removed"] == {"label": ["removed"]}
+    # The manifest still describes the complete campaign
+    assert {key for key, _ in delta_manifest["rows"]["label"]} == {
+        "kept",
+        "changed",
+        "added",
+    }
+
+
+def test_apply_delta(exports):
+    tmp_path, full_manifest, _, delta_manifest = exports
+    target = open_export(tmp_path / "full.sqlite")
+
+    apply_delta(target, tmp_path / "delta.sqlite", delta_manifest, full_manifest)
+
+    assert get_labels(target) == {
+        "kept": "kept",
+        "changed": "new name",
+        "added": "added",
+    }
+    target.close()
+
+
+def test_delta_of_another_export_is_refused(exports):
+    tmp_path, full_manifest, _, delta_manifest = exports
+    other = {**full_manifest, "id": "other"}
+    target = open_export(tmp_path / "full.sqlite")
+
+    with pytest.raises(ValueError):
+        apply_delta(target, tmp_path / "delta.sqlite", delta_manifest, other)
+
+    # Nothing was applied
+    assert get_labels(target) == {
+        "kept": "kept",
+        "changed": "changed",
+        "removed": "removed",
+    }
+    target.close()
+
+
+def test_delta_removing_unknown_rows_is_refused(exports):
+    _, full_manifest, _, delta_manifest = exports
+
+    delta_manifest["removed"]["label"].append("unknown")
+    with pytest.raises(ValueError):
+        check_delta(delta_manifest, full_manifest)
+
+    delta_manifest["removed"] = {"unknown_table": ["removed"]}
+    with pytest.raises(ValueError):
+        check_delta(delta_manifest, full_manifest)
+
+
+def test_check_manifest(exports):
+    _, _, _, delta_manifest = exports
+    manifest: Manifest = copy.deepcopy(delta_manifest)
+    assert check_manifest(manifest) is manifest
+
+    for invalid in (
+        {"base": 5},
+        {"removed": ["label"]},
+        {"removed": {"label": "removed"}},
+        {"removed": {"label": [["removed"]]}},
+        {"rows": {"label": [["kept"]]}},
+        {"rows": {"label": [[["kept"], "checksum"]]}},
+    ):
+        with pytest.raises(ValueError):
+            check_manifest({**manifest, **invalid})
+
+    for key in ("base", "removed"):
+        incomplete = dict(manifest)
+        del incomplete[key]  # type: ignore
+        with pytest.raises(ValueError):
+            check_manifest(incomplete)
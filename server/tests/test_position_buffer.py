@@ -0,0 +1,130 @@
+import asyncio
+import json
+from typing import Iterator, List
+
+import pytest
+
+from src.models import (
+    Layer,
+    Location,
+    LocationOptions,
+    Polygon,
+    Room,
+    Shape,
+    User,
+    UserOptions,
+)
+from src.state.position import PositionBuffer, ShapePosition, position_buffer
+
+
+@pytest.fixture(scope="module")
+def layer() -> Iterator[Layer]:
+    user = User.create(
+        name="positions", password_hash="", default_options=UserOptions.create()
+    )
+    room = Room.create(
+        name="positions", creator=user, default_options=LocationOptions.create()
+    )
+    location = Location.create(room=room, name="positions", index=0)
+    yield location.create_floor().layers[0]
+    room.delete_instance(recursive=True)
+    user.delete_instance(recursive=True)
+
+
+def create_polygon(layer: Layer, uuid: str, vertices: List[List[float]]) -> Shape:
+    shape = Shape.create(
+        uuid=uuid, layer=layer, type_="polygon", x=0, y=0, index=0, options="[]"
+    )
+    Polygon.create(
+        shape=shape, vertices=json.dumps(vertices), line_width=1, open_polygon=False
+    )
+    return shape
+
+
+def get_position(uuid: str) -> ShapePosition:
+    shape = Shape.get_by_id(uuid)
+    vertices = json.loads(Polygon.get_by_id(uuid).vertices)
+    return ShapePosition(shape.x, shape.y, shape.angle, vertices)
+
+
+def test_flush_writes_positions(layer: Layer):
+    create_polygon(layer, "flushed", [[0, 0], [1, 1]])
+    buffer = PositionBuffer(1)
+    buffer.set("flushed", ShapePosition(1, 2, 45, [[3, 3], [4, 4]]))
+
+    asyncio.run(buffer.flush())
+
+    assert get_position("flushed") == ShapePosition(1, 2, 45, [[3, 3], [4, 4]])
+    assert buffer.pending == 0
+    assert buffer.get("flushed") is None
+
+
+def test_failed_flush_keeps_positions(layer: Layer, monkeypatch):
+    create_polygon(layer, "failed", [[0, 0], [1, 1]])
+    buffer = PositionBuffer(1)
+    buffer.set("failed", ShapePosition(1, 1, 0, [[1, 1]]))
+
+    def fail(*args, **kwargs):
+        # The shape moves again while the failed flush is being written
+        buffer.set("failed", ShapePosition(2, 2, 0, [[2, 2]]))
+        raise RuntimeError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Polygon, "update", fail)
+        with pytest.raises(RuntimeError):
+            asyncio.run(buffer.flush())
+
+    # The newer position is kept, the failed one does not overwrite it
+    assert buffer.failed_flushes == 1
+    assert buffer.get("failed") == ShapePosition(2, 2, 0, [[2, 2]])
+    assert get_position("failed") == ShapePosition(0, 0, 0, [[0, 0], [1, 1]])
+
+    asyncio.run(buffer.flush())
+    assert get_position("failed") == ShapePosition(2, 2, 0, [[2, 2]])
+    assert buffer.pending == 0
+
+
+def test_failed_flush_merges_back_positions(layer: Layer, monkeypatch):
+    create_polygon(layer, "merged", [[0, 0], [1, 1]])
+    buffer = PositionBuffer(1)
+    buffer.set("merged", ShapePosition(1, 1, 0, [[1, 1]]))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Polygon, "update", lambda *args, **kwargs: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            asyncio.run(buffer.flush())
+
+    assert buffer.pending == 1
+    # The transaction was rolled back, the shape was not moved without its vertices
+    assert Shape.get_by_id("merged").x == 0
+
+    asyncio.run(buffer.flush())
+    assert get_position("merged") == ShapePosition(1, 1, 0, [[1, 1]])
+
+
+def test_pending_positions_are_serialized(layer: Layer):
+    shape = create_polygon(layer, "pending", [[0, 0], [1, 1]])
+    position_buffer.set("pending", ShapePosition(5, 6, 90, [[7, 7]]))
+    try:
+        data = shape.as_dict(None, True)
+    finally:
+        position_buffer.pop("pending")
+
+    assert (data["x"], data["y"], data["angle"]) == (5, 6, 90)
+    assert data["vertices"] == [[7, 7]]  # type: ignore
+    assert Shape.get_by_id("pending").x == 0
+
+
+def test_saves_keep_pending_positions(layer: Layer):
+    shape = create_polygon(layer, "saved", [[0, 0], [1, 1]])
+    position_buffer.set("saved", ShapePosition(5, 6, 90, [[7, 7]]))
+    try:
+        shape.name = "renamed"
+        shape.save()
+        polygon = Polygon.get_by_id("saved")
+        polygon.line_width = 2
+        polygon.save()
+    finally:
+        position_buffer.pop("saved")
+
+    assert get_position("saved") == ShapePosition(5, 6, 90, [[7, 7]])
@@ -0,0 +1,363 @@
+"""
+Checks that the lookups of the socket handlers are served by an index.
+
+A synthetic campaign is generated in a fresh save, the queries the handlers issue are recorded
+and `EXPLAIN QUERY PLAN` of every recorded query must not contain a full scan of a table.
+SQLite plans without table statistics, which is also the case for the saves of a running server.
+"""
+
+import asyncio
+import re
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Tuple
+
+import pytest
+
+from src.api.socket.label import get_label_locations
+from src.api.socket.location import get_owned_floors, load_location
+from src.app import sio
+from src.models import (
+    Asset,
+    Aura,
+    Label,
+    Layer,
+    Location,
+    LocationOptions,
+    Marker,
+    Note,
+    PlayerRoom,
+    Rect,
+    Room,
+    Shape,
+    ShapeLabel,
+    ShapeOwner,
+    Tracker,
+    User,
+    UserOptions,
+)
+from src.models.db import db
+from src.models.role import Role
+from src.models.shape import CompositeShapeAssociation, ToggleComposite
+from src.models.shape.access import permission_cache
+from src.models.shape.order import _get_neighbours
+from src.models.shape.prefetch import ShapePrefetch
+from src.state.game import game_state
+
+# Importing the asset state registers it on the app, the login check of the handlers looks it up
+import src.state.asset  # noqa: F401
+
+LOCATIONS = 4
+SHAPES_PER_LAYER = 250
+ASSET_FOLDERS = 20
+ASSETS_PER_FOLDER = 50
+
+# "SCAN shape", older SQLite versions report "SCAN TABLE shape"
+SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+CTE_RE = re.compile(
+    r'(?:WITH|,)\s+(?:RECURSIVE\s+)?"?(\w+)"?\s*(?:\([^)]*\))?\s+AS\s*\('
+)
+
+
+class Campaign(NamedTuple):
+    dm: User
+    player: User
+    room: Room
+    location: Location
+    shapes: List[Shape]
+    folder: Asset
+
+
+def create_shapes(layer: Layer, players: List[User], labels: List[Label]) -> None:
+    shapes = [
+        {
+            "uuid": f"{layer.id}-{i}",
+            "layer": layer,
+            "type_": "rect",
+            "x": i,
+            "y": i,
+            "index": i * 1024,
+            "options": "[]",
+        }
+        for i in range(SHAPES_PER_LAYER)
+    ]
+    Shape.insert_many(shapes).execute()
+    Rect.insert_many(
+        [{"shape": s["uuid"], "width": 1, "height": 1} for s in shapes]
+    ).execute()
+    Tracker.insert_many(
+        [
+            {
+                "uuid": f"{s['uuid']}-tracker",
+                "shape": s["uuid"],
+                "visible": True,
+                "name": "hp",
+                "value": 1,
+                "maxvalue": 2,
+                "draw": False,
+                "primary_color": "#fff",
+                "secondary_color": "#000",
+            }
+            for s in shapes[::2]
+        ]
+    ).execute()
+    Aura.insert_many(
+        [
+            {
+                "uuid": f"{s['uuid']}-aura",
+                "shape": s["uuid"],
+                "vision_source": False,
+                "visible": True,
+                "name": "light",
+                "value": 10,
+                "dim": 5,
+                "colour": "#fff",
+                "active": True,
+                "border_colour": "#000",
+                "angle": 360,
+                "direction": 0,
+            }
+            for s in shapes[::3]
+        ]
+    ).execute()
+    ShapeOwner.insert_many(
+        [
+            {
+                "shape": s["uuid"],
+                "user": players[i % len(players)],
+                "edit_access": True,
+                "vision_access": True,
+                "movement_access": True,
+            }
+            for i, s in enumerate(shapes[::4])
+        ]
+    ).execute()
+    ShapeLabel.insert_many(
+        [
+            {"shape": s["uuid"], "label": labels[i % len(labels)]}
+            for i, s in enumerate(shapes[::5])
+        ]
+    ).execute()
+
+    composite = shapes[-1]["uuid"]
+    ToggleComposite.create(shape=composite, active_variant=shapes[0]["uuid"])
+    CompositeShapeAssociation.insert_many(
+        [
+            {"parent": composite, "variant": s["uuid"], "name": f"v{i}"}
+            for i, s in enumerate(shapes[:3])
+        ]
+    ).execute()
+
+
+def create_user(name: str) -> User:
+    return User.create(
+        name=name, password_hash="", default_options=UserOptions.create()
+    )
+
+
+@pytest.fixture(scope="module")
+def campaign() -> Iterator[Campaign]:
+    with db.atomic():
+        dm = create_user("dm")
+        players = [create_user(f"player{i}") for i in range(8)]
+        labels = [
+            Label.create(uuid=f"label-{i}", user=dm, name=f"label{i}", visible=True)
+            for i in range(10)
+        ]
+
+        room = Room.create(
+            name="campaign", creator=dm, default_options=LocationOptions.create()
+        )
+        locations = [
+            Location.create(room=room, name=f"location{i}", index=i)
+            for i in range(LOCATIONS)
+        ]
+        for user, role in (
+            (dm, Role.DM),
+            *((player, Role.PLAYER) for player in players),
+        ):
+            PlayerRoom.create(
+                player=user, room=room, role=role, active_location=locations[0]
+            )
+        for location in locations:
+            for i in range(2):
+                floor = location.create_floor(f"floor{i}")
+                for layer in floor.layers:
+                    create_shapes(layer, players, labels)
+            for player in players:
+                Note.create(
+                    uuid=f"{location.id}-{player.id}",
+                    room=room,
+                    location=location,
+                    user=player,
+                    title="note",
+                    text="",
+                )
+                Marker.create(
+                    shape=f"{location.floors[0].layers[0].id}-0",
+                    user=player,
+                    location=location,
+                )
+
+        for user in (dm, *players):
+            root = Asset.get_root_folder(user)
+            for i in range(ASSET_FOLDERS):
+                folder = Asset.create(name=f"folder{i}", owner=user, parent=root)
+                for j in range(ASSETS_PER_FOLDER):
+                    Asset.create(
+                        name=f"asset{j}",
+                        owner=user,
+                        parent=folder,
+                        file_hash=f"{user.id:08x}{i:016x}{j:016x}",
+                    )
+
+    location = locations[0]
+    yield Campaign(
+        dm=dm,
+        player=players[0],
+        room=room,
+        location=location,
+        shapes=list(
+            Shape.select().join(Layer).where(Layer.floor == location.floors[0])
+        ),
+        folder=Asset.get(owner=dm, name="folder3"),
+    )
+
+
+@contextmanager
+def record_queries() -> Iterator[List[Tuple[str, Tuple]]]:
+    """Records the statements executed on any thread while in the context."""
+    queries: List[Tuple[str, Tuple]] = []
+    execute_sql = db.execute_sql
+
+    def record(sql, params=None, *args, **kwargs):
+        queries.append((sql, tuple(params or ())))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = record  # type: ignore
+    try:
+        yield queries
+    finally:
+        del db.execute_sql
+
+
+def get_table_scans(queries: List[Tuple[str, Tuple]]) -> List[str]:
+    """Returns the full table scans in the plans of the given queries."""
+    scans = []
+    for sql, params in queries:
+        if not sql.lstrip().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            continue
+        # Common table expressions are temporary results, scanning them is expected
+        ctes = set(CTE_RE.findall(sql))
+        for *_, detail in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params):
+            match = SCAN_RE.match(detail)
+            if match is None or match.group(1) in ctes or detail == "SCAN CONSTANT ROW":
+                continue
+            scans.append(f"{detail} in {sql}")
+    return scans
+
+
+def assert_no_table_scans(fn: Callable[[], object]) -> None:
+    with record_queries() as queries:
+        fn()
+    assert queries
+    assert get_table_scans(queries) == []
+
+
+@pytest.mark.parametrize("role", [Role.DM, Role.PLAYER])
+def test_load_location(campaign: Campaign, monkeypatch, role):
+    async def emit(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(sio, "emit", emit)
+    user = campaign.dm if role == Role.DM else campaign.player
+    pr = PlayerRoom.get(player=user, room=campaign.room)
+    pr.active_location = campaign.location
+    pr.save()
+
+    sid = f"sid-{user.name}"
+
+    async def load():
+        await game_state.add_sid(sid, pr)
+        game_state.client_locations[sid] = {}
+        try:
+            await load_location(sid, campaign.location, complete=True)
+        finally:
+            await game_state.remove_sid(sid)
+
+    assert_no_table_scans(lambda: asyncio.run(load()))
+
+
+def test_shape_prefetch(campaign: Campaign):
+    floor = campaign.location.floors[0]
+    assert_no_table_scans(lambda: ShapePrefetch.for_floor(floor))
+
+
+def test_shape_access(campaign: Campaign):
+    pr = PlayerRoom.get(player=campaign.player, room=campaign.room)
+
+    def check_access():
+        permission_cache.clear()
+        permission_cache.get_many(campaign.shapes)
+        get_owned_floors(campaign.location, pr)
+
+    assert_no_table_scans(check_access)
+
+
+@pytest.mark.parametrize(
+    "lookup",
+    [
+        # Shape.Owner.Add, Shape.Owner.Update and Shape.Owner.Delete
+        lambda c: ShapeOwner.get_or_none(shape=c.shapes[0], user=c.player),
+        lambda c: ShapeOwner.delete()
+        .where((ShapeOwner.shape == c.shapes[1]) & (ShapeOwner.user == c.player))
+        .execute(),
+        # Shape.Options.Label.Remove
+        lambda c: ShapeLabel.get_or_none(shape=c.shapes[0], label="label-0"),
+        # Label.Delete and Label.Visibility.Set
+        lambda c: get_label_locations(Label.get_by_id("label-0")),
+        # Tracker and aura updates
+        lambda c: list(c.shapes[0].trackers),
+        lambda c: list(c.shapes[0].auras),
+        # ToggleComposite.Variants.Rename and ToggleComposite.Variants.Remove
+        lambda c: CompositeShapeAssociation.get_or_none(
+            parent=c.shapes[-1], variant=c.shapes[0]
+        ),
+        # Shape.Order.Set
+        lambda c: _get_neighbours(c.shapes[10], 5),
+        # Marker.Remove
+        lambda c: Marker.get_or_none(shape=c.shapes[0], user=c.player),
+    ],
+)
+def test_shape_lookups(campaign: Campaign, lookup):
+    assert_no_table_scans(lambda: lookup(campaign))
+
+
+@pytest.mark.parametrize(
+    "lookup",
+    [
+        # Folder.Get
+        lambda c: c.folder.as_dict(children=True),
+        # Folder.GetByPath
+        lambda c: Asset.get_root_folder(c.dm).get_descendants_by_path("folder3/asset7"),
+        # Asset.List.Set
+        lambda c: Asset.get_user_structure(c.dm),
+        # Asset.Remove and Asset.Export
+        lambda c: Asset.as_dicts([c.folder], recursive=True),
+        # Asset removal
+        lambda c: Asset.get_or_none(file_hash=c.folder.children[0].file_hash),
+    ],
+)
+def test_asset_lookups(campaign: Campaign, lookup):
+    assert_no_table_scans(lambda: lookup(campaign))
+
+
+def test_asset_rename(campaign: Campaign):
+    folder = Asset.get(owner=campaign.dm, name="folder4")
+
+    def rename():
+        folder.name = "renamed"
+        folder.save()
+
+    assert_no_table_scans(rename)
+    root = Asset.get_root_folder(campaign.dm)
+    assert root.get_descendants_by_path("renamed/asset7")[0] == folder
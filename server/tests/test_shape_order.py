@@ -0,0 +1,135 @@
+from typing import Iterator, List
+
+import pytest
+
+from src.models import (
+    Layer,
+    Location,
+    LocationOptions,
+    Room,
+    Shape,
+    User,
+    UserOptions,
+)
+from src.models.shape.order import (
+    ORDER_KEY_STEP,
+    get_next_index,
+    move_to_position,
+    rebalance_layer,
+)
+
+
+@pytest.fixture(scope="module")
+def room() -> Iterator[Room]:
+    user = User.create(
+        name="order", password_hash="", default_options=UserOptions.create()
+    )
+    room = Room.create(
+        name="order", creator=user, default_options=LocationOptions.create()
+    )
+    yield room
+    room.delete_instance(recursive=True)
+    user.delete_instance(recursive=True)
+
+
+@pytest.fixture
+def layer(room: Room) -> Iterator[Layer]:
+    location = Location.create(room=room, name="order", index=0)
+    yield location.create_floor().layers[0]
+    location.delete_instance(recursive=True)
+
+
+def create_shapes(layer: Layer, indices: List[int]) -> List[Shape]:
+    return [
+        Shape.create(
+            uuid=f"{layer.id}-{i}",
+            layer=layer,
+            type_="rect",
+            x=0,
+            y=0,
+            index=index,
+            options="[]",
+        )
+        for i, index in enumerate(indices)
+    ]
+
+
+def get_order(layer: Layer) -> List[str]:
+    return [
+        shape_id
+        for (shape_id,) in Shape.select(Shape.uuid)
+        .where(Shape.layer == layer)
+        .order_by(Shape.index)
+        .tuples()
+    ]
+
+
+def get_indices(layer: Layer) -> List[int]:
+    return [
+        index
+        for (index,) in Shape.select(Shape.index)
+        .where(Shape.layer == layer)
+        .order_by(Shape.index)
+        .tuples()
+    ]
+
+
+def test_next_index(layer: Layer):
+    assert get_next_index(layer) == 0
+    create_shapes(layer, [0, 5000])
+    assert get_next_index(layer) == 5000 + ORDER_KEY_STEP
+
+
+@pytest.mark.parametrize(
+    "position, order",
+    [
+        (0, [3, 0, 1, 2]),
+        (1, [0, 3, 1, 2]),
+        (2, [0, 1, 3, 2]),
+        (3, [0, 1, 2, 3]),
+        # Positions outside of the layer are clamped
+        (-5, [3, 0, 1, 2]),
+        (50, [0, 1, 2, 3]),
+    ],
+)
+def test_move_to_position(layer: Layer, position: int, order: List[int]):
+    shapes = create_shapes(layer, [0, 1024, 2048, 3072])
+    moved = shapes[3]
+
+    move_to_position(moved, position)
+
+    assert get_order(layer) == [shapes[i].uuid for i in order]
+    # Only the moved shape is written while there is room between its neighbours
+    assert sorted(get_indices(layer)) == sorted([0, 1024, 2048, moved.index])
+
+
+def test_move_rebalances_exhausted_gap(layer: Layer):
+    shapes = create_shapes(layer, [0, 1, 2, 3])
+
+    move_to_position(shapes[3], 1)
+
+    assert get_order(layer) == [shapes[i].uuid for i in (0, 3, 1, 2)]
+    indices = get_indices(layer)
+    assert all(b - a > 1 for a, b in zip(indices, indices[1:]))
+    assert Shape.get_by_id(shapes[3].uuid).index == shapes[3].index
+
+
+def test_repeated_moves_into_the_same_gap(layer: Layer):
+    shapes = create_shapes(layer, [i * ORDER_KEY_STEP for i in range(3)])
+
+    # Every move halves the gap below the top shape, eventually it is exhausted
+    for _ in range(20):
+        move_to_position(shapes[0], 1)
+        move_to_position(shapes[1], 1)
+
+    assert get_order(layer) == [shapes[i].uuid for i in (0, 1, 2)]
+    assert len(set(get_indices(layer))) == 3
+
+
+def test_rebalance_layer(layer: Layer):
+    shapes = create_shapes(layer, [-7, 3, 4, 90000])
+
+    rebalance_layer(layer.id)
+
+    assert get_order(layer) == [shape.uuid for shape in shapes]
+    assert get_indices(layer) == [i * ORDER_KEY_STEP for i in range(4)]
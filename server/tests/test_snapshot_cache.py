@@ -0,0 +1,90 @@
+from src.api.socket.location import apply_moves
+from src.state.position import ShapePosition
+from src.state.snapshot import SnapshotCache
+
+LOCATION = 1
+KEY = (1, "dm")
+
+
+def floor_data():
+    return {
+        "name": "ground",
+        "layers": [
+            {"name": "map", "shapes": [{"uuid": "a", "x": 0, "y": 0, "angle": 0}]},
+            {
+                "name": "tokens",
+                "shapes": [
+                    {"uuid": "b", "x": 0, "y": 0, "angle": 0, "vertices": [[1, 1]]}
+                ],
+            },
+        ],
+    }
+
+
+def test_changes_are_not_cached():
+    cache = SnapshotCache(1000)
+    version = cache.get_version(LOCATION)
+
+    with cache.changing(LOCATION):
+        # A load that started before the change has to load again
+        cache.set(LOCATION, KEY, floor_data(), 10, version)
+        assert cache.get(LOCATION, KEY) is None
+
+        version = cache.get_version(LOCATION)
+        cache.set(LOCATION, KEY, floor_data(), 10, version)
+        assert cache.get(LOCATION, KEY) is None
+
+    cache.set(LOCATION, KEY, floor_data(), 10, version)
+    assert cache.get(LOCATION, KEY) is None
+
+    version = cache.get_version(LOCATION)
+    cache.set(LOCATION, KEY, floor_data(), 10, version)
+    assert cache.get(LOCATION, KEY) is not None
+
+
+def test_moves_keep_the_cached_data():
+    cache = SnapshotCache(1000)
+    version = cache.get_version(LOCATION)
+    # Moves during a load are applied to the data it stores
+    cache.move(LOCATION, "b", ShapePosition(5, 6, 90, [[2, 2]]))
+    cache.set(LOCATION, KEY, floor_data(), 10, version)
+    cache.move(LOCATION, "a", ShapePosition(1, 2, 0))
+
+    data = cache.get(LOCATION, KEY)
+    moved = apply_moves(data, cache.get_moves(LOCATION))
+
+    assert moved["layers"][0]["shapes"][0] == {"uuid": "a", "x": 1, "y": 2, "angle": 0}
+    assert moved["layers"][1]["shapes"][0] == {
+        "uuid": "b",
+        "x": 5,
+        "y": 6,
+        "angle": 90,
+        "vertices": [[2, 2]],
+    }
+    assert data == floor_data()
+
+    cache.bump(LOCATION)
+    assert cache.get(LOCATION, KEY) is None
+    assert cache.get_moves(LOCATION) == {}
+
+
+def test_moves_of_untracked_locations_are_not_kept():
+    cache = SnapshotCache(1000)
+    cache.move(LOCATION, "a", ShapePosition(1, 2, 0))
+    assert cache.get_moves(LOCATION) == {}
+
+
+def test_evicted_locations_do_not_store_loads_in_progress():
+    cache = SnapshotCache(15)
+    version = cache.get_version(LOCATION)
+    cache.set(LOCATION, KEY, floor_data(), 10, version)
+    cache.move(LOCATION, "a", ShapePosition(1, 2, 0))
+
+    other = cache.get_version(2)
+    cache.set(2, KEY, floor_data(), 10, other)
+
+    # The location lost its only entry and the moves recorded for it
+    assert cache.get(LOCATION, KEY) is None
+    assert cache.get_moves(LOCATION) == {}
+    cache.set(LOCATION, (2, "dm"), floor_data(), 10, version)
+    assert cache.get(LOCATION, (2, "dm")) is None
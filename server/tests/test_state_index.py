@@ -0,0 +1,106 @@
+"""
+Checks the session indices of `State.get_sids` and measures them against a scan of all sessions.
+
+Run with `-s` to see the measured lookup times.
+"""
+
+import asyncio
+import timeit
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from src.models import User
+from src.state import State
+
+ROOMS = 500
+PLAYERS_PER_ROOM = 10
+LOOKUPS = 200
+
+
+class Sessions(State[SimpleNamespace]):
+    indexed_options = ("room", "active_location", "player", "role")
+
+    def get_user(self, sid: str) -> User:
+        return self.get(sid).player
+
+
+class ScannedSessions(Sessions):
+    indexed_options = ()
+
+
+def fill(state: State) -> None:
+    async def add_all():
+        for room in range(ROOMS):
+            for player in range(PLAYERS_PER_ROOM):
+                await state.add_sid(
+                    f"{room}-{player}",
+                    SimpleNamespace(
+                        room=room,
+                        active_location=room * 2 + player % 2,
+                        player=player,
+                        role=int(player == 0),
+                    ),
+                )
+
+    asyncio.run(add_all())
+
+
+@pytest.fixture(scope="module")
+def states() -> List[State]:
+    indexed, scanned = Sessions(), ScannedSessions()
+    fill(indexed)
+    fill(scanned)
+    return [indexed, scanned]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"room": 7},
+        {"room": 7, "role": 1},
+        {"room": 7, "skip_sid": "7-0"},
+        {"active_location": 15},
+        {"active_location": 15, "player": 3},
+        {"player": 3, "role": 0},
+        {"room": ROOMS + 1},
+    ],
+)
+def test_index_matches_scan(states: List[State], options):
+    indexed, scanned = states
+    assert sorted(indexed.get_sids(**options)) == sorted(scanned.get_sids(**options))
+
+
+def test_index_follows_changes():
+    state = Sessions()
+    fill(state)
+
+    session = state.get("7-3")
+    session.active_location = -1
+    state.update_sid("7-3")
+    asyncio.run(state.remove_sid("7-5"))
+
+    assert sorted(state.get_sids(active_location=15)) == ["7-1", "7-7", "7-9"]
+    assert list(state.get_sids(active_location=-1)) == ["7-3"]
+    assert list(state.get_sids(room=7, player=5)) == []
+
+
+def test_index_is_faster_than_scan(states: List[State]):
+    indexed, scanned = states
+
+    def lookup(state: State):
+        return lambda: [
+            list(state.get_sids(room=room)) for room in range(0, ROOMS, ROOMS // 10)
+        ]
+
+    timings = [
+        min(timeit.repeat(lookup(state), number=LOOKUPS // 10, repeat=3)) / LOOKUPS
+        for state in states
+    ]
+
+    print(
+        f"\nget_sids(room=...) with {ROOMS * PLAYERS_PER_ROOM} sessions:"
+        f" {timings[0] * 1e6:.1f}us indexed, {timings[1] * 1e6:.1f}us scanned"
+    )
+    assert timings[0] * 10 < timings[1]